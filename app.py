@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request
-from meal_planner import load_fridge, save_fridge, build_meal_plan, complete_meal_plan_with_llm
-from cbr_retrieval import load_recipes
+from flask import Flask, render_template, request, jsonify, abort, Response, stream_with_context, url_for
+from meal_planner import load_fridge, save_fridge, FridgeSession, complete_meal_plan_with_llm, stream_meal_plan_with_llm
+from meal_planner import LLM_SPECULATE, speculate_llm_meals, reconcile_speculation
+from cbr_retrieval import CatalogSource, recipe_error
+from planning_pool import PlanningPool
 import json, os
+import metrics
+from llm_jobs import JobQueue
 
 def get_ingredient_unit(ingredient):
     units = {
@@ -15,11 +19,50 @@ def get_ingredient_unit(ingredient):
 
 app = Flask(__name__)
 app.jinja_env.globals.update(get_ingredient_unit=get_ingredient_unit)
-recipes = load_recipes()
+# reloads the recipe file when it changes, so no restart is needed for a new catalog
+catalog_source = CatalogSource()
+# plans on PLAN_WORKERS worker processes (in the request thread when it is 0)
+planning_pool = PlanningPool(catalog_source)
+
+# token for the /recipes admin routes; they are disabled when it isn't set
+CATALOG_ADMIN_TOKEN = os.environ.get("CATALOG_ADMIN_TOKEN")
+
+# LLM completions run as background jobs, so the page renders the CBR meals at once
+llm_jobs = JobQueue()
+# the jobs stream LLM meals as they are generated instead of waiting for all of them
+LLM_STREAM = os.environ.get("LLM_STREAM", "1") != "0"
+
+def _complete_in_background(preferences, selected_meals, missing_ingredients, meals_needed, speculation=None):
+    # queue the LLM completion; its meals are deducted from the fridge in one commit when it finishes.
+    # With a speculation (started before the plan) its meals are used where they still fit
+    def work(job):
+        session = FridgeSession()
+        try:
+            if speculation is not None:
+                meals = reconcile_speculation(speculation, preferences, session.fridge, selected_meals,
+                                              missing_ingredients, meals_needed, session=session)
+            elif LLM_STREAM:
+                meals = stream_meal_plan_with_llm(preferences, session.fridge, selected_meals,
+                                                  missing_ingredients, meals_needed, session=session)
+            else:
+                meals = complete_meal_plan_with_llm(preferences, session.fridge, selected_meals,
+                                                    missing_ingredients, meals_needed, session=session)
+            for meal in meals:
+                job.add_meal(meal)
+        finally:
+            session.commit()
+    return llm_jobs.submit(work)
+
+def render_home(**context):
+    with metrics.timed("render_home"):
+        return render_template("home.html", **context)
+
 
 @app.route("/", methods=["GET", "POST"])
 def home():
-    fridge = load_fridge()
+    # a plan request loads the fridge once, through its FridgeSession
+    session = FridgeSession() if request.form.get("action") == "plan_meals" else None
+    fridge = session.fridge if session else load_fridge()
     selected_meals = []
     pending_meals = []
     missing_ingredients = {}
@@ -63,7 +106,7 @@ def home():
             
             save_fridge(updated_fridge)
             fridge = updated_fridge
-            return render_template("home.html", fridge=fridge, preferences=preferences,
+            return render_home(fridge=fridge, preferences=preferences,
                                 selected_meals=selected_meals, pending_meals=pending_meals,
                                 missing_ingredients=missing_ingredients, proposed_meals=proposed_meals)
 
@@ -89,40 +132,132 @@ def home():
                 },
                 "priority": priority
             }
+            if request.form.get("planner"): # "greedy" or "optimize"; defaults to PLANNER_MODE
+                preferences["planner"] = request.form["planner"].strip().lower()
             
             # Check if there are any ingredients in the fridge
             has_ingredients = any(amount > 0 for amount in fridge.values())
 
-            # Build meal plan using the existing fridge data
-            selected_meals, pending_meals, missing_ingredients = build_meal_plan(recipes, fridge, preferences)
-            
-            save_fridge(fridge)
+            # LLM_SPECULATE: when the fridge looks too small for the plan, the LLM call starts
+            # now and runs while the recipes are ranked
+            speculation = speculate_llm_meals(catalog_source.get(), fridge, preferences) if LLM_SPECULATE and has_ingredients else None
 
+            # Build meal plan using the existing fridge data. The plan consumes from the session;
+            # session.commit() writes it in one compare-and-set (replanning if a concurrent
+            # request changed the fridge meanwhile)
+            # plan_changes: what differs from this user's last plan for these preferences (None on the first one)
+            session.plan(lambda fridge: planning_pool.plan(fridge, preferences, return_changes=True, user=session.user))
+            fridge = session.commit()
+            selected_meals, pending_meals, missing_ingredients, plan_changes = session.plan_result
+
+            stream_url = None
             total_needed = days * meals_per_day
             if len(selected_meals) < total_needed:
                 meals_needed = total_needed - len(selected_meals)
                 if has_ingredients:
-                    proposed_meals = complete_meal_plan_with_llm(
-                        preferences,
-                        fridge,
-                        selected_meals,
-                        missing_ingredients,
-                        meals_needed
-                )
+                    # LLM meals come from a background job on the committed fridge; the page
+                    # follows it over stream_url (or polls /plan/jobs/<id>)
+                    job = _complete_in_background(preferences, selected_meals, dict(missing_ingredients), meals_needed, speculation)
+                    stream_url = url_for("stream_llm_meals", job_id=job.id)
+            elif speculation is not None:
+                speculation.cancel() # the CBR plan is complete after all
 
             # Pass preferences and selected meals back to the frontend so the form is not reset
-            return render_template(
-                "home.html",
+            return render_home(
                 fridge=fridge,
                 preferences=preferences,  # Ensure preferences are passed for form data
                 selected_meals=selected_meals,
                 pending_meals=pending_meals,
                 missing_ingredients=missing_ingredients,
-                proposed_meals=proposed_meals
+                proposed_meals=proposed_meals,
+                plan_changes=plan_changes,
+                stream_url=stream_url
             )
 
     # If no form submission, render page with empty preferences (first load)
-    return render_template("home.html", fridge=fridge, preferences=preferences)
+    return render_home(fridge=fridge, preferences=preferences)
+
+
+@app.route("/plan/jobs/<job_id>")
+def llm_job_status(job_id):
+    # status and the meals so far of a background LLM completion
+    job = llm_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@app.route("/plan/stream/<job_id>")
+def stream_llm_meals(job_id):
+    # Server-sent events: one "meal" event per LLM meal of the job as it arrives, then
+    # "done". The job runs on whether or not anyone is listening.
+    job = llm_jobs.get(job_id)
+    if job is None:
+        abort(404)
+
+    def events():
+        seen = 0
+        while True:
+            meals, finished = job.wait_for_update(seen, timeout=15)
+            for meal in meals:
+                yield f"event: meal\ndata: {json.dumps(meal)}\n\n"
+            seen += len(meals)
+            if finished:
+                break
+            if not meals:
+                yield ": keep-alive\n\n"
+        yield f"event: done\ndata: {json.dumps({'status': job.status})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # per-stage latency histograms and counters for this worker, Prometheus text format
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _check_admin():
+    if not CATALOG_ADMIN_TOKEN:
+        abort(404)
+    if request.headers.get("Authorization") != f"Bearer {CATALOG_ADMIN_TOKEN}":
+        abort(403)
+
+
+# ---------- live catalog edits (this worker only; edit the file to reach every worker) ----------
+@app.route("/recipes", methods=["POST"])
+def add_recipes():
+    _check_admin()
+    payload = request.get_json(force=True)
+    new_recipes = payload if isinstance(payload, list) else [payload]
+    errors = _recipe_errors(new_recipes)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    rows = catalog_source.get().add_recipes(new_recipes)
+    return jsonify({"rows": rows}), 201
+
+
+def _recipe_errors(recipes):
+    # what's wrong with each malformed recipe of a payload, by its position
+    return {i: error for i, error in enumerate(map(recipe_error, recipes)) if error}
+
+
+@app.route("/recipes/<int:row>", methods=["PUT", "DELETE"])
+def change_recipe(row):
+    _check_admin()
+    catalog = catalog_source.get()
+    try:
+        if request.method == "DELETE":
+            catalog.remove_recipe(row)
+            return jsonify({"removed": row})
+        recipe = request.get_json(force=True)
+        errors = _recipe_errors([recipe])
+        if errors:
+            return jsonify({"errors": errors}), 400
+        return jsonify({"row": catalog.update_recipe(row, recipe)})
+    except KeyError:
+        abort(404)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+# benchmark.py
+#
+# Scale benchmark for retrieval: generates seeded synthetic catalogs with
+# data/recipe_creation_2.py and measures load_recipes, rank_recipes and
+# build_meal_plan latency (p50/p99), throughput and peak memory per size.
+#
+#   python benchmark.py --sizes 1000 10000 100000 --output bench_results/run.json
+#   python benchmark.py --sizes 1000 10000 --compare bench_results/run.json
+
+import os
+import sys
+import json
+import time
+import copy
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from cbr_retrieval import load_recipes, rank_recipes
+from catalog_file import save_catalog
+from data.recipe_creation_2 import write_recipes, vegetables, proteins, dairy, carbs, flavors
+import meal_planner
+from meal_planner import build_meal_plan
+from rank_cache import RankCache, MemoryRankBackend
+
+ALL_INGREDIENTS = proteins + dairy + vegetables + carbs + flavors
+
+
+def _summary(latencies):
+    latencies = np.array(latencies) * 1000
+    total = latencies.sum() / 1000
+    return {
+        "runs": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "throughput_per_s": len(latencies) / total if total else None
+    }
+
+
+def _measure(fn, runs):
+    # Latency summary over fn(0)..fn(runs - 1), then peak traced memory (numpy
+    # allocations included) from one more, untimed call fn(runs): tracemalloc slows
+    # every allocation, so it stays off while timing.
+    latencies = []
+    result = None
+    for i in range(runs):
+        start = time.perf_counter()
+        result = fn(i)
+        latencies.append(time.perf_counter() - start)
+    stats = _summary(latencies)
+
+    tracemalloc.start()
+    fn(runs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats["peak_memory_mb"] = peak / 2**20
+    return stats, result
+
+
+def _random_query(rng):
+    fridge = {i: float(rng.randint(0, 800)) for i in rng.sample(ALL_INGREDIENTS, rng.randint(5, len(ALL_INGREDIENTS)))}
+    meals_per_day = rng.choice([2, 3, 4])
+    preferences = {
+        "days": rng.choice([1, 3, 7]),
+        "meals_per_day": meals_per_day,
+        "target_calories_per_day": rng.uniform(1400, 3000),
+        "target_macros_per_day": {
+            "protein": rng.uniform(60, 200),
+            "fat": rng.uniform(40, 120),
+            "carbs": rng.uniform(100, 350)
+        },
+        "priority": rng.choice(["calories", "protein", "fat", "carbs"])
+    }
+    return fridge, preferences
+
+
+def bench_size(size, runs, seed, workdir):
+    json_path = os.path.join(workdir, f"recipes_{size}.json")
+    compiled_path = os.path.join(workdir, f"recipes_{size}.cat")
+    write_recipes(json_path, size, seed)
+
+    results = {"size": size}
+    results["load_json"], catalog = _measure(lambda _: load_recipes(json_path), max(1, min(runs, 5)))
+    save_catalog(catalog, compiled_path)
+    results["load_compiled"], _ = _measure(lambda _: load_recipes(compiled_path), max(1, min(runs, 5)))
+
+    rng = random.Random(seed)
+    queries = [_random_query(rng) for _ in range(runs + 1)] # the last one for the memory pass
+
+    def rank(i):
+        fridge, preferences = queries[i]
+        meals_per_day = preferences["meals_per_day"]
+        return rank_recipes(
+            catalog, fridge.keys(),
+            {m: v / meals_per_day for m, v in preferences["target_macros_per_day"].items()},
+            preferences["target_calories_per_day"] / meals_per_day,
+            preferences["priority"],
+            top_k=preferences["days"] * meals_per_day * 3
+        )
+
+    results["rank_recipes"], _ = _measure(rank, runs)
+
+    # every query is different, but make sure the ranking cache can't serve any of them
+    meal_planner.rank_cache = RankCache(MemoryRankBackend(max_entries=0))
+    fridges = [copy.deepcopy(fridge) for fridge, _ in queries]
+    results["build_meal_plan"], _ = _measure(lambda i: build_meal_plan(catalog, fridges[i], queries[i][1]), runs)
+
+    os.remove(json_path)
+    os.remove(compiled_path)
+    return results
+
+
+def _compare(current, previous):
+    # ratio of current p50 to previous p50 for every size/stage both runs have
+    before = {r["size"]: r for r in previous["results"]}
+    for r in current["results"]:
+        if r["size"] not in before:
+            continue
+        for stage, stats in r.items():
+            if stage == "size" or stage not in before[r["size"]]:
+                continue
+            old = before[r["size"]][stage]["p50_ms"]
+            print(f"  {r['size']:>8} {stage:<16} p50 {old:9.2f} -> {stats['p50_ms']:9.2f} ms ({stats['p50_ms'] / old:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark recipe retrieval at several catalog sizes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--runs", type=int, default=50, help="queries per size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="where to save the results (JSON)")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "runs": args.runs,
+        "seed": args.seed,
+        "results": []
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            print(f"Benchmarking {size} recipes...")
+            results = bench_size(size, args.runs, args.seed, workdir)
+            for stage, stats in results.items():
+                if stage != "size":
+                    print(f"  {stage:<16} p50 {stats['p50_ms']:9.2f} ms  p99 {stats['p99_ms']:9.2f} ms  "
+                          f"peak {stats['peak_memory_mb']:8.1f} MB")
+            report["results"].append(results)
+
+    output = args.output or f"bench_results/retrieval_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results saved to", output)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+        print("Compared with", args.compare)
+        _compare(report, previous)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+# catalog_file.py
+#
+# Compiled recipe catalog: the columns of a RecipeCatalog written as raw arrays
+# in one file, so it can be memory-mapped instead of parsed. Every worker that
+# opens the same file shares one copy of it in the page cache.
+#
+#   python catalog_file.py data/final_clean_chef_recipes_1000.json data/recipes.cat
+#
+# Layout: MAGIC, 8-byte little-endian header length, JSON header, then the
+# arrays, each starting on an ALIGN-byte boundary. Titles are one UTF-8 blob
+# plus offsets; the ingredient vocabulary and macro names sit in the header.
+
+import os
+import sys
+import json
+import struct
+import numpy as np
+from scipy.sparse import csr_matrix
+from cbr_retrieval import RecipeCatalog
+
+MAGIC = b"CHEFCAT1"
+ALIGN = 64
+
+
+class StringTable:
+    # read-only list of strings decoded on access from a blob + offsets
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, strings):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_catalog(catalog, path):
+    # write the catalog's columns; goes through a temp file so readers never see half a file
+    if not catalog.is_compact:
+        catalog = catalog.compacted()
+    titles = StringTable.build(catalog.titles)
+    arrays = {
+        "calories": catalog.calories,
+        "ratings": catalog.ratings,
+        "macros": catalog.macros,
+        "ingredient_data": catalog.ingredients.data,
+        "ingredient_indices": catalog.ingredients.indices,
+        "ingredient_indptr": catalog.ingredients.indptr,
+        "postings_indptr": catalog.postings_indptr,
+        "postings_indices": catalog.postings_indices,
+        "title_offsets": titles.offsets,
+        "title_blob": titles.blob
+    }
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+
+    header = json.dumps({
+        "version": catalog.version,
+        "macro_names": catalog.macro_names,
+        "vocabulary": catalog.vocabulary,
+        "arrays": layout
+    }).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def is_compiled_catalog(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def open_catalog(path):
+    # memory-map a compiled catalog; nothing is copied or parsed per recipe, so
+    # startup only depends on the header size
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compiled recipe catalog.")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = data_start + spec["offset"]
+        arrays[name] = raw[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+
+    n = len(arrays["calories"])
+    return RecipeCatalog.from_columns(
+        titles=StringTable(arrays["title_blob"], arrays["title_offsets"]),
+        calories=arrays["calories"],
+        ratings=arrays["ratings"],
+        macro_names=header["macro_names"],
+        macros=arrays["macros"],
+        vocabulary=header["vocabulary"],
+        ingredients=csr_matrix(
+            (arrays["ingredient_data"], arrays["ingredient_indices"], arrays["ingredient_indptr"]),
+            shape=(n, len(header["vocabulary"])), copy=False
+        ),
+        postings=(arrays["postings_indptr"], arrays["postings_indices"]),
+        version=header["version"]
+    )
+
+
+def compile_catalog(json_path, out_path):
+    with open(json_path, "r") as f:
+        catalog = RecipeCatalog(json.load(f))
+    save_catalog(catalog, out_path)
+    return catalog
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python catalog_file.py <recipes.json> <output.cat>")
+        sys.exit(1)
+    catalog = compile_catalog(sys.argv[1], sys.argv[2])
+    print(f"Compiled {len(catalog)} recipes to {sys.argv[2]} ({os.path.getsize(sys.argv[2])} bytes)")
@@ -1,12 +1,544 @@
+import os
 import json
+import time
+import hashlib
+import threading
 from typing import List, Dict
-from sklearn.preprocessing import MinMaxScaler
 import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import ConvexHull, QhullError, cKDTree
+
+SCORED_MACROS = ["protein", "fat", "carbs"] # macros used for the macro distance, in this order
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+def recipe_error(recipe):
+    # why a recipe dict can't go into a catalog, or None if it can: a title, macros and
+    # ingredients (name -> grams) are required, calories and rating are optional numbers
+    if not isinstance(recipe, dict):
+        return "recipe must be an object"
+    if not isinstance(recipe.get("title"), str):
+        return "recipe needs a string title"
+    for field in ("macros", "ingredients"):
+        values = recipe.get(field)
+        if not isinstance(values, dict) or not all(isinstance(k, str) and _number(v) for k, v in values.items()):
+            return f"recipe {field} must map names to numbers"
+    if any(amount < 0 for amount in recipe["ingredients"].values()):
+        return "ingredient amounts can't be negative"
+    for field in ("calories", "rating"):
+        if recipe.get(field) is not None and not _number(recipe[field]):
+            return f"recipe {field} must be a number"
+    return None
+
+
+def _recipe_columns(recipes, macro_names, vocabulary, ingredient_index):
+    # column data for a batch of recipe dicts. New macro names and ingredients are
+    # appended to macro_names / vocabulary / ingredient_index in place.
+    macro_index = {macro: i for i, macro in enumerate(macro_names)}
+    for r in recipes:
+        for macro in r["macros"]:
+            if macro not in macro_index:
+                macro_index[macro] = len(macro_names)
+                macro_names.append(macro)
+
+    macros = np.zeros((len(recipes), len(macro_names))) # missing macros count as 0, like recipe["macros"].get(...)
+    for i, r in enumerate(recipes):
+        for macro, value in r["macros"].items():
+            macros[i, macro_index[macro]] = value
+
+    # rows of the sparse recipe x ingredient matrix holding the quantities in grams
+    indptr, indices, quantities = [0], [], []
+    for r in recipes:
+        for ingredient, amount in r["ingredients"].items():
+            col = ingredient_index.get(ingredient)
+            if col is None:
+                col = ingredient_index[ingredient] = len(vocabulary)
+                vocabulary.append(ingredient)
+            indices.append(col)
+            quantities.append(amount)
+        indptr.append(len(indices))
+
+    return {
+        "titles": [r["title"] for r in recipes],
+        "calories": np.array([r.get("calories", 0) for r in recipes], dtype=float),
+        "ratings": np.array([r.get("rating", 0) or 0 for r in recipes], dtype=float),
+        "macros": macros,
+        "indptr": np.array(indptr, dtype=np.int64),
+        "indices": np.array(indices, dtype=np.int32),
+        "quantities": np.array(quantities, dtype=float)
+    }
+
+
+class RecipeCatalog:
+    # Columnar view of the recipe database, built once at load time.
+    # Scoring works on these arrays instead of looping over the recipe dicts.
+    #
+    # Recipes can be added, updated and removed in place (add_recipes, update_recipe,
+    # remove_recipe). Columns live in growable buffers so adding costs time in the
+    # number of recipes added; removed rows are only flagged inactive and are dropped
+    # for good by compacted(). Row ids stay stable until then.
+    def __init__(self, recipes: List[Dict]):
+        macro_names, vocabulary, ingredient_index = [], [], {}
+        columns = _recipe_columns(recipes, macro_names, vocabulary, ingredient_index)
+        indptr = columns["indptr"]
+        index_dtype = np.int32 if indptr[-1] < np.iinfo(np.int32).max else np.int64
+
+        self._set_columns(
+            titles=columns["titles"],
+            calories=columns["calories"],
+            ratings=columns["ratings"],
+            macro_names=macro_names,
+            macros=columns["macros"],
+            vocabulary=vocabulary,
+            ingredients=csr_matrix(
+                (columns["quantities"], columns["indices"], indptr.astype(index_dtype)),
+                shape=(len(recipes), len(vocabulary))
+            )
+        )
+        self.recipes = list(recipes) # original recipe dicts, used to build the returned matches
+
+    @classmethod
+    def from_columns(cls, titles, calories, ratings, macro_names, macros, vocabulary, ingredients,
+                     postings=None, version=None):
+        # catalog straight from its arrays (e.g. a memory-mapped compiled file); recipe
+        # dicts are rebuilt from the columns when asked for
+        catalog = cls.__new__(cls)
+        catalog._set_columns(titles, calories, ratings, macro_names, macros, vocabulary, ingredients,
+                             postings, version)
+        catalog.recipes = None
+        return catalog
+
+    def _set_columns(self, titles, calories, ratings, macro_names, macros, vocabulary, ingredients,
+                     postings=None, version=None):
+        self.titles = titles
+        self.macro_names = list(macro_names)
+        self.macro_index = {macro: i for i, macro in enumerate(self.macro_names)}
+        self.vocabulary = list(vocabulary)
+        self.ingredient_index = {ingredient: i for i, ingredient in enumerate(self.vocabulary)}
+
+        # growable column buffers; the public attributes are views of their used part
+        self._buffers = {
+            "calories": calories,
+            "ratings": ratings,
+            "macros": macros,
+            "ingredient_data": ingredients.data,
+            "ingredient_indices": ingredients.indices,
+            "ingredient_indptr": ingredients.indptr,
+            "ingredient_counts": np.diff(ingredients.indptr)
+        }
+        self._used = {name: len(buffer) for name, buffer in self._buffers.items()}
+        self.calories = calories
+        self.ratings = ratings
+        self.macros = macros
+        self.ingredients = ingredients
+        self.ingredient_counts = self._buffers["ingredient_counts"]
+        self._buffers["scored_macros"] = self.scored_macros = np.column_stack(
+            [self.macro_column(m) for m in SCORED_MACROS]
+        )
+        self._used["scored_macros"] = len(self.scored_macros)
+
+        # inverted index: posting list (sorted recipe ids) of ingredient c is
+        # postings_indices[postings_indptr[c]:postings_indptr[c + 1]], plus
+        # _posting_delta[c] for recipes added since the catalog was built
+        if postings is None:
+            by_ingredient = self.ingredient_mask.tocsc()
+            by_ingredient.sort_indices()
+            postings = (by_ingredient.indptr, by_ingredient.indices)
+        self.postings_indptr, self.postings_indices = postings
+        self._posting_delta = {}
+
+        self.active = None # bool mask of live rows, created on the first removal
+        self.removed = 0
+        self._rating_bounds = None
+        self._distance_index = None
+        self._target_index = None
+        self._write_lock = threading.Lock()
+        self.version = version or self.fingerprint()
+
+    @property
+    def ingredient_mask(self):
+        # same sparsity pattern as ingredients with 1s, so overlap counts are a sparse product
+        ingredients = self.ingredients # once: add_recipes may swap it in the meantime
+        return csr_matrix(
+            (np.ones(len(ingredients.indices)), ingredients.indices, ingredients.indptr),
+            shape=ingredients.shape
+        )
+
+    def fingerprint(self):
+        # content hash of the columns; caches key on it so a reloaded catalog invalidates them
+        h = hashlib.sha1()
+        for column in (self.calories, self.ratings, self.macros,
+                       self.ingredients.data, self.ingredients.indices, self.ingredients.indptr):
+            h.update(np.ascontiguousarray(column).tobytes())
+        h.update(json.dumps([list(self.titles), self.macro_names, self.vocabulary]).encode())
+        return h.hexdigest()
+
+    def __getstate__(self):
+        # for worker processes (planning_pool): the lock and the lookup indexes stay
+        # behind, the indexes are rebuilt on the first query that needs them
+        state = dict(self.__dict__)
+        del state["_write_lock"]
+        state["_distance_index"] = state["_target_index"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        # number of rows, removed ones included; see size for live recipes
+        return len(self.calories)
+
+    @property
+    def size(self):
+        return len(self) - self.removed
+
+    def __iter__(self):
+        return (self[i] for i in self.active_rows())
+
+    def __getitem__(self, i):
+        if self.recipes is not None:
+            return self.recipes[i]
+        return self.recipe(i)
+
+    def recipe(self, i):
+        # recipe dict rebuilt from the columns, in the JSON catalog's format
+        start, end = self.ingredients.indptr[i], self.ingredients.indptr[i + 1]
+        amounts = self.ingredients.data[start:end].tolist()
+        return {
+            "title": self.titles[i],
+            "rating": float(self.ratings[i]),
+            "calories": float(self.calories[i]),
+            "macros": dict(zip(self.macro_names, self.macros[i].tolist())),
+            "ingredients": {
+                self.vocabulary[col]: int(amount) if amount.is_integer() else amount
+                for col, amount in zip(self.ingredients.indices[start:end].tolist(), amounts)
+            }
+        }
+
+    def active_rows(self, n=None):
+        # live rows among the first n (default len()); read len() before the columns
+        n = len(self) if n is None else n
+        active = self.active
+        if active is None:
+            return np.arange(n)
+        return np.flatnonzero(active[:n])
+
+    def is_active(self, i):
+        return 0 <= i < len(self) and (self.active is None or bool(self.active[i]))
+
+    # ---- incremental updates ----
+
+    def _extend(self, name, values):
+        # append to a column buffer, doubling its capacity when full (read-only
+        # memory-mapped columns are copied on the first write); returns the used view
+        buffer, used = self._buffers[name], self._used[name]
+        needed = used + len(values)
+        if needed > len(buffer) or not buffer.flags.writeable:
+            grown = np.empty((max(needed, 2 * len(buffer), 16),) + buffer.shape[1:], dtype=buffer.dtype)
+            grown[:used] = buffer[:used]
+            buffer = self._buffers[name] = grown
+        buffer[used:needed] = values
+        self._used[name] = needed
+        return buffer[:needed]
+
+    def _widen_macros(self):
+        # a new macro name showed up: one more (zero) column for every row
+        used = self._used["macros"]
+        buffer = self._buffers["macros"]
+        widened = np.zeros((len(buffer), len(self.macro_names)))
+        widened[:used, :buffer.shape[1]] = buffer[:used]
+        self._buffers["macros"] = widened
+        self.macros = widened[:used]
+        self.macro_index = {macro: i for i, macro in enumerate(self.macro_names)}
+
+    def _bump_version(self, change):
+        self.version = hashlib.sha1(f"{self.version}:{change}".encode()).hexdigest()
+
+    def add_recipes(self, recipes):
+        # append recipes and return their row ids. Cost is proportional to the recipes
+        # added: columns are appended, the new rows go to the posting-list deltas and
+        # the scoring bounds are widened to include them. Raises ValueError, with the
+        # catalog unchanged, if any recipe is malformed (see recipe_error).
+        recipes = list(recipes)
+        if not recipes:
+            return []
+        with self._write_lock:
+            return self._add(recipes)
+
+    def _add(self, recipes):
+        # add_recipes under the write lock
+        for i, recipe in enumerate(recipes):
+            error = recipe_error(recipe)
+            if error:
+                raise ValueError(f"Recipe {i}: {error}")
+        n = len(self)
+        # new names go to copies, swapped in once the whole batch has its columns
+        macro_names, vocabulary, ingredient_index = list(self.macro_names), list(self.vocabulary), dict(self.ingredient_index)
+        columns = _recipe_columns(recipes, macro_names, vocabulary, ingredient_index)
+        widened = len(macro_names) != len(self.macro_names)
+        self.ingredient_index, self.vocabulary, self.macro_names = ingredient_index, vocabulary, macro_names
+        if widened:
+            self._widen_macros()
+
+        # every row-level column (the ingredient matrix's shape included) is extended
+        # before calories, which defines len(), and the posting lists go last. Readers
+        # take len() once and look at that many rows only, so a half-added recipe is
+        # past their end
+        nnz = self._used["ingredient_data"]
+        data = self._extend("ingredient_data", columns["quantities"])
+        indices = self._extend("ingredient_indices", columns["indices"])
+        indptr = self._extend("ingredient_indptr", columns["indptr"][1:] + nnz)
+        self.ingredients = csr_matrix((data, indices, indptr), shape=(n + len(recipes), len(self.vocabulary)))
+        self.ingredient_counts = self._extend("ingredient_counts", np.diff(columns["indptr"]))
+        self.macros = self._extend("macros", columns["macros"])
+        self.scored_macros = self._extend(
+            "scored_macros",
+            np.column_stack([columns["macros"][:, self.macro_index[m]] if m in self.macro_index
+                             else np.zeros(len(recipes)) for m in SCORED_MACROS])
+        )
+        self.ratings = self._extend("ratings", columns["ratings"])
+        if not isinstance(self.titles, list):
+            self.titles = list(self.titles) # compiled catalogs keep titles in a read-only table
+        self.titles.extend(columns["titles"])
+        if self.recipes is not None:
+            self.recipes.extend(recipes)
+        if self.active is not None:
+            self.active = np.concatenate((self.active, np.ones(len(recipes), dtype=bool)))
+        self.calories = self._extend("calories", columns["calories"])
+
+        rows = list(range(n, n + len(recipes)))
+        for offset, row in enumerate(rows):
+            for col in columns["indices"][columns["indptr"][offset]:columns["indptr"][offset + 1]]:
+                self._posting_delta.setdefault(int(col), []).append(row)
+
+        if self._rating_bounds is not None:
+            low, high = self._rating_bounds
+            self._rating_bounds = (min(low, columns["ratings"].min()), max(high, columns["ratings"].max()))
+        self._bump_version(f"add:{n}:{len(recipes)}")
+        return rows
+
+    def remove_recipe(self, i):
+        # flag a row as removed; it stops showing up in rankings right away
+        with self._write_lock:
+            self._remove(i)
+
+    def _remove(self, i):
+        # remove_recipe under the write lock
+        if not self.is_active(i):
+            raise KeyError(f"No recipe at row {i}.")
+        if self.active is None:
+            self.active = np.ones(len(self), dtype=bool)
+        self.active[i] = False
+        self.removed += 1
+        if self._rating_bounds is not None and self.ratings[i] in self._rating_bounds:
+            self._rating_bounds = None # recomputed on the next query
+        self._distance_index = None # nearest/farthest lookups may point at the removed row
+        self._target_index = None
+        self._bump_version(f"remove:{i}")
+
+    def update_recipe(self, i, recipe):
+        # replace a recipe; the new version gets a new row id, which is returned. The old
+        # one is removed only once the new one is in, so a failed update changes nothing.
+        with self._write_lock:
+            if not self.is_active(i):
+                raise KeyError(f"No recipe at row {i}.")
+            row = self._add([recipe])[0]
+            self._remove(i)
+            return row
+
+    @property
+    def is_compact(self):
+        # no removed rows and no posting-list deltas
+        return self.removed == 0 and not self._posting_delta
+
+    def compacted(self):
+        # new catalog holding only the live rows, with the posting-list deltas merged
+        rows = self.active_rows()
+        positions, counts = self.ingredient_entries(rows)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        catalog = RecipeCatalog.from_columns(
+            titles=[self.titles[i] for i in rows],
+            calories=self.calories[rows],
+            ratings=self.ratings[rows],
+            macro_names=self.macro_names,
+            macros=self.macros[rows],
+            vocabulary=self.vocabulary,
+            ingredients=csr_matrix(
+                (self.ingredients.data[positions], self.ingredients.indices[positions],
+                 indptr.astype(self.ingredients.indptr.dtype)),
+                shape=(len(rows), len(self.vocabulary))
+            )
+        )
+        if self.recipes is not None:
+            catalog.recipes = [self.recipes[i] for i in rows]
+        return catalog
+
+    # ---- query helpers ----
+
+    def macro_column(self, macro):
+        # column of one macro for every recipe, zeros if no recipe has it
+        if macro in self.macro_index:
+            return self.macros[:, self.macro_index[macro]]
+        return np.zeros(len(self))
+
+    def rating_bounds(self):
+        # (min, max) rating over the live recipes, kept up to date as recipes are added
+        if self._rating_bounds is None:
+            ratings = self.ratings[self.active_rows()]
+            self._rating_bounds = (ratings.min(), ratings.max()) if len(ratings) else (0.0, 0.0)
+        return self._rating_bounds
+
+    def ingredient_entries(self, rows):
+        # positions into ingredients.data/indices for the given rows, concatenated in row order,
+        # plus how many entries each row has
+        rows = np.asarray(rows, dtype=np.intp)
+        starts = self.ingredients.indptr[rows]
+        counts = self.ingredients.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        return offsets + np.arange(counts.sum()), counts
+
+    def overlap_counts(self, user_ingredients):
+        # live recipes sharing at least one fridge ingredient and how many they share,
+        # found by walking the fridge ingredients' posting lists only
+        cols = [self.ingredient_index[i] for i in user_ingredients if i in self.ingredient_index]
+        indptr, indices = self.postings_indptr, self.postings_indices
+        lists = [indices[indptr[c]:indptr[c + 1]] for c in cols if c + 1 < len(indptr)]
+        lists += [np.array(self._posting_delta[c]) for c in cols if c in self._posting_delta]
+        if not lists:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.int64)
+        candidates, counts = np.unique(np.concatenate(lists), return_counts=True)
+        if self.active is not None:
+            live = self.active[candidates]
+            candidates, counts = candidates[live], counts[live]
+        return candidates, counts
+
+    def distance_ranges(self, target_macros_array, target_calories):
+        # exact (min, max) of the macro and calorie distances over the live recipes
+        # without scanning them: nearest macro point from a KD-tree, farthest from the
+        # convex hull vertices, calories from a sorted copy. Recipes added after the
+        # index was built are checked directly until there are enough to rebuild it.
+        n = len(self)
+        if self._distance_index is None or n - self._distance_index[4] > max(1024, n // 8):
+            rows = self.active_rows(n)
+            points = self.scored_macros[rows]
+            tree, hull = None, rows
+            if len(rows):
+                tree = cKDTree(points)
+                try:
+                    hull = rows[ConvexHull(points).vertices]
+                except (QhullError, ValueError): # too few or flat points, every point is a candidate
+                    pass
+            self._distance_index = (tree, rows, hull, np.sort(self.calories[rows]), n)
+        tree, base_rows, hull, sorted_calories, indexed = self._distance_index
+
+        added = np.arange(indexed, n)
+        if self.active is not None:
+            added = added[self.active[added]]
+        nearest = [base_rows[tree.query(target_macros_array)[1]]] if tree is not None else []
+        # recompute from the rows so the values match score_recipes bit for bit
+        macro_min = np.linalg.norm(self.scored_macros[np.concatenate((nearest, added)).astype(np.intp)]
+                                   - target_macros_array, axis=1).min()
+        macro_max = np.linalg.norm(self.scored_macros[np.concatenate((hull, added)).astype(np.intp)]
+                                   - target_macros_array, axis=1).max()
+
+        pos = np.searchsorted(sorted_calories, target_calories)
+        calories = np.concatenate((sorted_calories[max(pos - 1, 0):pos + 1], sorted_calories[[0, -1]] if len(sorted_calories) else [],
+                                   self.calories[added]))
+        calorie_distance = np.abs(calories - target_calories)
+
+        return (macro_min, macro_max), (calorie_distance.min(), calorie_distance.max())
+
+
+    def _target_points(self, rows):
+        # (protein, fat, carbs, calories) of the rows, scaled by the index's per-axis spread
+        return np.column_stack((self.scored_macros[rows], self.calories[rows])) / self._target_index[3]
+
+    def nearest_rows(self, target_macros_array, target_calories, count):
+        # the count live recipes closest to the per-meal targets in (protein, fat, carbs,
+        # calories) space, each axis divided by its standard deviation so calories don't
+        # dominate. A KD-tree over the catalog answers this in about log(n); recipes added
+        # after it was built are checked directly until there are enough to rebuild.
+        n = len(self)
+        if self._target_index is None or n - self._target_index[2] > max(1024, n // 8):
+            rows = self.active_rows(n)
+            points = np.column_stack((self.scored_macros[rows], self.calories[rows]))
+            spread = points.std(axis=0) if len(rows) else np.ones(4)
+            spread[spread == 0] = 1
+            self._target_index = (cKDTree(points / spread) if len(rows) else None, rows, n, spread)
+        tree, base_rows, indexed, spread = self._target_index
+
+        target = np.append(target_macros_array, target_calories) / spread
+        found, distances = np.array([], dtype=np.intp), np.array([])
+        if tree is not None:
+            distances, found = tree.query(target, k=min(count, len(base_rows)))
+            distances, found = np.atleast_1d(distances), base_rows[np.atleast_1d(found)]
+        added = np.arange(indexed, n)
+        if self.active is not None:
+            added = added[self.active[added]]
+        if len(added):
+            found = np.concatenate((found, added))
+            distances = np.concatenate((distances, np.linalg.norm(self._target_points(added) - target, axis=1)))
+            found = found[np.argsort(distances, kind="stable")[:count]]
+        return np.sort(found)
+
 
 # load recipes
-def load_recipes(path = "data/final_clean_chef_recipes_1000.json"):
+def load_recipes(path = None):
+    # JSON catalog, or a compiled one (see catalog_file.py) which is memory-mapped
+    path = path or os.environ.get("RECIPES_PATH", "data/final_clean_chef_recipes_1000.json")
+    from catalog_file import is_compiled_catalog, open_catalog
+    if is_compiled_catalog(path):
+        return open_catalog(path)
     with open(path, "r") as f:
-        return json.load(f)
+        return RecipeCatalog(json.load(f))
+
+
+class CatalogSource:
+    # Serves the catalog loaded from a file and swaps in a fresh one when the file
+    # changes on disk, so running processes pick up a new catalog without a restart.
+    # Writers should replace the file atomically (write a temp file, then rename;
+    # catalog_file.save_catalog does this) so a half-written file is never loaded.
+    def __init__(self, path=None, check_interval=2.0):
+        self.path = path or os.environ.get("RECIPES_PATH", "data/final_clean_chef_recipes_1000.json")
+        self.check_interval = check_interval # seconds between stat() calls
+        self._lock = threading.Lock()
+        self._stamp = self._file_stamp()
+        self._checked_at = time.monotonic()
+        self.catalog = load_recipes(self.path)
+        self.loaded_version = self.catalog.version # as on disk; in-place edits move catalog.version on
+
+    def _file_stamp(self):
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self):
+        # the current catalog; in-place edits (add_recipes, ...) last until the file changes
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload_if_changed()
+        return self.catalog
+
+    def reload_if_changed(self):
+        if not self._lock.acquire(blocking=False):
+            return False # another thread is already checking/reloading
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                stamp = self._file_stamp()
+            except FileNotFoundError:
+                return False # mid-replace or deleted: keep serving the current catalog
+            if stamp == self._stamp:
+                return False
+            catalog = load_recipes(self.path)
+            self.catalog, self._stamp = catalog, stamp # readers see either the old or the new catalog
+            self.loaded_version = catalog.version
+            print(f"Recipe catalog reloaded from {self.path} ({catalog.size} recipes)")
+            return True
+        finally:
+            self._lock.release()
 
 
 def compute_similarity(recipe, user_ingredients: set, target_macros: dict, target_calories: float):
@@ -37,41 +569,267 @@ def compute_similarity(recipe, user_ingredients: set, target_macros: dict, targe
     }
 
 
-def rank_recipes(recipes, user_ingredients, target_macros, target_calories, priority, top_k): # rank the recipes based on the user's preferences
-    user_ingredients = set(user_ingredients) # convert the user's ingredients to a set
-    scored = [ # loop through each recipe and compute the similarity between the recipe and the user's preferences
-        compute_similarity(r, user_ingredients, target_macros, target_calories) # compute_similarity(one recipe at a time, fridge contents, required protein/fat/carbs per meal, required calories per meal)
-        for r in recipes
-    ]
+def _min_max(values):
+    # same as MinMaxScaler().fit_transform on a single column: constant columns scale to 0
+    return _scale(values, values.min(), values.max())
 
-    if not scored:
-        return []
 
-    scaler = MinMaxScaler()
+def _scale(values, low, high):
+    # min-max scaling with known bounds
+    spread = high - low
+    if spread == 0:
+        return np.zeros_like(values)
+    return (values - low) / spread
 
-    ingredient_scores = scaler.fit_transform([[s["ingredient_score"]] for s in scored]).flatten()
-    macro_scores = scaler.fit_transform([[s["macro_distance"]] for s in scored])
-    macro_scores = 1 - macro_scores.flatten()
 
-    calorie_scores = scaler.fit_transform([[s["calorie_distance"]] for s in scored])
-    calorie_scores = 1 - calorie_scores.flatten()
+def _final_scores(ingredient_score, macro_distance, calorie_distance, rating_score, bounds):
+    (ing_low, ing_high), (mac_low, mac_high), (cal_low, cal_high), (rat_low, rat_high) = bounds
+    return (
+        0.4 * _scale(ingredient_score, ing_low, ing_high) +
+        0.25 * (1 - _scale(macro_distance, mac_low, mac_high)) +
+        0.25 * (1 - _scale(calorie_distance, cal_low, cal_high)) +
+        0.1 * _scale(rating_score, rat_low, rat_high)
+    )
 
-    rating_scores = scaler.fit_transform([[s["rating_score"]] for s in scored]).flatten()
 
-    final_scores = (
-        0.4 * ingredient_scores +
-        0.25 * macro_scores +
-        0.25 * calorie_scores +
-        0.1 * rating_scores
-    )
+def score_recipes(catalog, user_ingredients, target_macros, target_calories, rows=None):
+    # raw similarity features, as arrays, for the given rows (default: every live recipe)
+    if rows is None:
+        rows = catalog.active_rows()
+    rows = np.asarray(rows, dtype=np.intp)
+
+    # number of fridge ingredients each recipe uses, read off the rows' own entries
+    in_fridge = np.zeros(len(catalog.vocabulary), dtype=bool)
+    in_fridge[[catalog.ingredient_index[i] for i in user_ingredients if i in catalog.ingredient_index]] = True
+    if len(rows) == len(catalog): # every row, in order: use the CSR arrays as they are
+        # (cut to the rows: a recipe being added may already be in the ingredient columns)
+        entry_cols, bounds = catalog.ingredients.indices, catalog.ingredients.indptr[:len(rows) + 1]
+        counts = catalog.ingredient_counts[:len(rows)]
+    else:
+        positions, counts = catalog.ingredient_entries(rows)
+        entry_cols = catalog.ingredients.indices[positions]
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+    running = np.concatenate(([0], np.cumsum(in_fridge[entry_cols])))
+    shared = running[bounds[1:]] - running[bounds[:-1]]
+
+    ingredient_score = np.divide(shared, counts, out=np.zeros(len(rows)), where=counts > 0)
+
+    target_macros_array = np.array([target_macros[m] for m in SCORED_MACROS])
+    macro_distance = np.linalg.norm(catalog.scored_macros[rows] - target_macros_array, axis=1)
+
+    calorie_distance = np.abs(catalog.calories[rows] - target_calories)
+    rating_score = catalog.ratings[rows] / 5
 
-    for i, s in enumerate(scored):
-        s["final_score"] = final_scores[i]
-        # Attach adjusted recipe scaled to target_calories
-        s["adjusted_recipe"] = adjust_serving_size(s["recipe"], target_macros, target_calories, priority)
+    return ingredient_score, macro_distance, calorie_distance, rating_score
 
-    return sorted(scored, key=lambda x: x["final_score"], reverse=True)[:top_k]
 
+def rank_recipes(recipes, user_ingredients, target_macros, target_calories, priority, top_k, threshold=False, nearest=None): # rank the recipes based on the user's preferences
+    # threshold=True only scores recipes sharing a fridge ingredient, as long as
+    # the rest provably cannot reach the top_k; the result is the same either way.
+    # nearest=N first pulls the N recipes closest to the targets in macro/calorie
+    # space and scores only those. Much less work on big catalogs, but approximate:
+    # a recipe outside that set is never returned.
+    catalog = recipes if isinstance(recipes, RecipeCatalog) else RecipeCatalog(list(recipes))
+    if catalog.size == 0:
+        return []
+    user_ingredients = set(user_ingredients)
+
+    pruned = None
+    if nearest and max(nearest, top_k) < catalog.size:
+        pruned = _rank_nearest(catalog, user_ingredients, target_macros, target_calories, max(nearest, top_k))
+    elif threshold:
+        pruned = _rank_candidates(catalog, user_ingredients, target_macros, target_calories, top_k)
+    if pruned is not None:
+        rows, features, final_scores = pruned
+    else:
+        rows = catalog.active_rows()
+        features = score_recipes(catalog, user_ingredients, target_macros, target_calories, rows=rows)
+        final_scores = _final_scores(*features, [(f.min(), f.max()) for f in features])
+    ingredient_score, macro_distance, calorie_distance, rating_score = features
+
+    order = top_k_indices(final_scores, top_k)
+    # only the winners get scaled to the targets
+    adjusted = adjust_serving_sizes(catalog, rows[order], target_macros, target_calories, priority)
+
+    ranked = []
+    for i, adjusted_recipe in zip(order, adjusted):
+        ranked.append({
+            "index": int(rows[i]), # row in the catalog
+            "recipe": catalog[rows[i]],
+            "ingredient_score": ingredient_score[i],
+            "macro_distance": macro_distance[i],
+            "calorie_distance": calorie_distance[i],
+            "rating_score": rating_score[i],
+            "final_score": final_scores[i],
+            # Attach adjusted recipe scaled to target_calories
+            "adjusted_recipe": adjusted_recipe
+        })
+    return ranked
+
+
+def _catalog_bounds(catalog, candidates, candidate_ingredient_score, target_macros, target_calories):
+    # min/max of every scoring feature over all live recipes, without scoring them:
+    # candidates are the recipes sharing a fridge ingredient (everyone else scores 0
+    # on ingredients), distances come from catalog.distance_ranges
+    ingredient_low = 0 if len(candidates) < catalog.size else candidate_ingredient_score.min()
+    ingredient_high = candidate_ingredient_score.max() if len(candidates) else 0
+    target_macros_array = np.array([target_macros[m] for m in SCORED_MACROS])
+    macro_range, calorie_range = catalog.distance_ranges(target_macros_array, target_calories)
+    return [
+        (ingredient_low, ingredient_high),
+        macro_range,
+        calorie_range,
+        tuple(r / 5 for r in catalog.rating_bounds())
+    ]
+
+
+def _rank_candidates(catalog, user_ingredients, target_macros, target_calories, top_k):
+    # score only the recipes that share a fridge ingredient, with the normalization
+    # bounds of the full catalog. Returns None when a recipe outside that set could
+    # still make the top_k, so the caller falls back to scoring everything.
+    candidates, _ = catalog.overlap_counts(user_ingredients)
+    if top_k <= 0 or len(candidates) < top_k:
+        return None
+
+    features = score_recipes(catalog, user_ingredients, target_macros, target_calories, rows=candidates)
+    bounds = _catalog_bounds(catalog, candidates, features[0], target_macros, target_calories)
+    final_scores = _final_scores(*features, bounds)
+
+    # best score any other recipe could get: no ingredient credit, perfect everything else
+    (_, _), (macro_low, _), (calorie_low, _), (_, rating_high) = bounds
+    best_outside = _final_scores(np.zeros(1), np.array([macro_low]), np.array([calorie_low]),
+                                 np.array([rating_high]), bounds)[0]
+    cutoff = final_scores[top_k_indices(final_scores, top_k)[-1]]
+    if len(candidates) < catalog.size and cutoff <= best_outside:
+        return None
+    return candidates, features, final_scores
+
+
+def _rank_nearest(catalog, user_ingredients, target_macros, target_calories, count):
+    # score only the count recipes nearest to the targets. Distance and rating bounds
+    # are the full catalog's, so those parts of the score match a full scan; the
+    # ingredient part is normalized over the nearest set to keep this sublinear.
+    target_macros_array = np.array([target_macros[m] for m in SCORED_MACROS])
+    rows = catalog.nearest_rows(target_macros_array, target_calories, count)
+    features = score_recipes(catalog, user_ingredients, target_macros, target_calories, rows=rows)
+    macro_range, calorie_range = catalog.distance_ranges(target_macros_array, target_calories)
+    bounds = [
+        (features[0].min(), features[0].max()),
+        macro_range,
+        calorie_range,
+        tuple(r / 5 for r in catalog.rating_bounds())
+    ]
+    return rows, features, _final_scores(*features, bounds)
+
+
+def top_k_indices(scores, top_k):
+    # indices of the top_k highest scores, best first; ties keep catalog order like a stable sort.
+    # np.partition finds the cut-off in O(n) so only the winners get sorted.
+    n = len(scores)
+    if top_k <= 0:
+        return np.array([], dtype=np.intp)
+    if top_k >= n:
+        return np.argsort(-scores, kind="stable")
+
+    cutoff = -np.partition(-scores, top_k - 1)[top_k - 1] # k-th best score
+    above = np.flatnonzero(scores > cutoff)
+    ties = np.flatnonzero(scores == cutoff)[:top_k - len(above)]
+    winners = np.concatenate((above, ties))
+    return winners[np.argsort(-scores[winners], kind="stable")]
+
+
+
+def fridge_matrix(catalog, fridges):
+    # sparse users x ingredient-vocabulary 0/1 matrix from a list of ingredient collections,
+    # the fridge input of rank_recipes_batch; ingredients the catalog doesn't know are dropped
+    indptr, indices = [0], []
+    for fridge in fridges:
+        cols = {catalog.ingredient_index[i] for i in fridge if i in catalog.ingredient_index}
+        indices.extend(sorted(cols))
+        indptr.append(len(indices))
+    return csr_matrix(
+        (np.ones(len(indices)), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(fridges), len(catalog.vocabulary))
+    )
+
+
+def _min_max_rows(values):
+    # _min_max applied to every row of a 2D array
+    low = values.min(axis=1, keepdims=True)
+    spread = values.max(axis=1, keepdims=True) - low
+    return np.divide(values - low, spread, out=np.zeros_like(values), where=spread != 0)
+
+
+def rank_recipes_batch(catalog, target_macros, target_calories, fridges, top_k, chunk_size=None):
+    # rank_recipes for many users at once. target_macros is a (users, 3) array of
+    # protein/fat/carbs per meal, target_calories a (users,) array and fridges a sparse
+    # (users, vocabulary) 0/1 matrix (see fridge_matrix). Returns the (users, top_k)
+    # recipe indices, best first, and their final scores. Serving sizes are not adjusted;
+    # use adjust_serving_sizes on the rows a user actually needs.
+    target_macros = np.asarray(target_macros, dtype=float).reshape(-1, len(SCORED_MACROS))
+    target_calories = np.asarray(target_calories, dtype=float).ravel()
+    fridges = csr_matrix(fridges)
+    # fridges built before the vocabulary grew just have no entries for the new ingredients
+    fridges = csr_matrix((fridges.data, fridges.indices, fridges.indptr),
+                         shape=(fridges.shape[0], len(catalog.vocabulary)))
+    live = catalog.active_rows()
+    users, n = len(target_calories), len(live)
+    top_k = max(0, min(top_k, n))
+    indices = np.zeros((users, top_k), dtype=np.intp)
+    scores = np.zeros((users, top_k))
+    if users == 0 or top_k == 0:
+        return indices, scores
+
+    # users are scored a block at a time so the (block, catalog) score matrices stay bounded
+    chunk_size = chunk_size or max(1, 4_000_000 // n)
+    mask = catalog.ingredient_mask
+    if catalog.removed: # score the live rows only; indices are mapped back at the end
+        mask = mask[live]
+    else:
+        mask = mask[:n] # a recipe being added may already be in the ingredient matrix
+    mask_t = mask.T.tocsc()
+    counts = catalog.ingredient_counts[live]
+    scored_macros = catalog.scored_macros[live]
+    calories = catalog.calories[live]
+    rating_scores = _min_max(catalog.ratings[live] / 5)
+
+    for start in range(0, users, chunk_size):
+        block = slice(start, min(start + chunk_size, users))
+
+        overlap = (fridges[block] @ mask_t).toarray()
+        ingredient_score = np.divide(overlap, counts, out=np.zeros_like(overlap), where=counts > 0)
+
+        squared = np.zeros_like(overlap)
+        for j in range(len(SCORED_MACROS)):
+            squared += (scored_macros[:, j] - target_macros[block, j, None]) ** 2
+        macro_distance = np.sqrt(squared)
+
+        calorie_distance = np.abs(calories - target_calories[block, None])
+
+        final_scores = (
+            0.4 * _min_max_rows(ingredient_score) +
+            0.25 * (1 - _min_max_rows(macro_distance)) +
+            0.25 * (1 - _min_max_rows(calorie_distance)) +
+            0.1 * rating_scores
+        )
+
+        if top_k == n:
+            best = np.argsort(-final_scores, axis=1, kind="stable")
+        else:
+            best = np.argpartition(-final_scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(final_scores, best, axis=1)
+            # sort the winners, ties by catalog order like rank_recipes
+            best = np.take_along_axis(best, np.lexsort((best, -best_scores), axis=1), axis=1)
+            # argpartition picks arbitrarily among scores tied at the cut-off; redo those rows
+            cutoff = np.take_along_axis(final_scores, best[:, -1:], axis=1)
+            tied = (final_scores == cutoff).sum(axis=1) > (best_scores == cutoff).sum(axis=1)
+            for row in np.flatnonzero(tied):
+                best[row] = top_k_indices(final_scores[row], top_k)
+
+        indices[block] = live[best]
+        scores[block] = np.take_along_axis(final_scores, best, axis=1)
+
+    return indices, scores
 
 
 def adjust_serving_size(recipe, target_macros, target_calories, priority):
@@ -123,6 +881,57 @@ def adjust_serving_size(recipe, target_macros, target_calories, priority):
     }
 
 
+def adjust_serving_sizes(catalog, rows, target_macros, target_calories, priority):
+    # batched adjust_serving_size for the given catalog rows, scaling all their
+    # macros and ingredient quantities at once
+    rows = np.asarray(rows, dtype=np.intp)
+    if priority == "calories":
+        base_values = catalog.calories[rows]
+        target_value = target_calories
+    elif priority in catalog.macro_index:
+        base_values = catalog.macro_column(priority)[rows]
+        target_value = target_macros.get(priority, 0)
+    else:
+        return [{"error": "Invalid priority selected."} for _ in rows]
+
+    valid = base_values != 0
+    servings = np.divide(target_value, base_values, out=np.zeros(len(rows)), where=valid)
+
+    # Scale macros
+    scaled_macros = np.round(catalog.macros[rows] * servings[:, None], 2)
+    total_calories = np.round(servings * catalog.calories[rows], 2)
+
+    # Scale ingredients, rounded to the nearest 5g
+    positions, counts = catalog.ingredient_entries(rows)
+    amounts = catalog.ingredients.data[positions] * np.repeat(servings, counts)
+    amounts = (5 * np.rint(amounts / 5)).astype(int)
+    names = [catalog.vocabulary[col] for col in catalog.ingredients.indices[positions]]
+
+    adjusted = []
+    start = 0
+    for j, i in enumerate(rows):
+        end = start + counts[j]
+        if not valid[j]:
+            adjusted.append({
+                "error": f"Recipe has no {priority} info. Cannot adjust servings."
+            })
+            start = end
+            continue
+
+        adjusted.append({
+            "title": catalog.titles[i],
+            "ingredients": dict(zip(names[start:end], amounts[start:end].tolist())),
+            "original_calories_per_serving": float(catalog.calories[i]),
+            "servings_needed": round(float(servings[j]), 2),
+            "total_calories": float(total_calories[j]),
+            "adjusted_macros": dict(zip(catalog.macro_names, scaled_macros[j].tolist())),
+            "rating": float(catalog.ratings[i]),
+            "priority": priority
+        })
+        start = end
+    return adjusted
+
+
 #used for testing 
 def main():
     recipes = load_recipes()
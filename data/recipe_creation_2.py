@@ -1,5 +1,7 @@
-import random
+import sys
 import json
+import random
+import argparse
 
 # Ingredient categories
 proteins = ["chicken", "beef", "tofu", "salmon", "eggs", "lentils", "black beans"]
@@ -23,12 +25,12 @@ title_templates = [
 ]
 
 # Helper for macros
-def generate_macros():
-    protein = round(random.uniform(10, 35), 1)
-    fat = round(random.uniform(5, 30), 1)
-    carbs = round(random.uniform(15, 60), 1)
-    sodium = round(random.uniform(100, 1400), 1)
-    calories = round(protein * 4 + fat * 9 + carbs * 4 + random.uniform(-30, 50), 1)
+def generate_macros(rng=random):
+    protein = round(rng.uniform(10, 35), 1)
+    fat = round(rng.uniform(5, 30), 1)
+    carbs = round(rng.uniform(15, 60), 1)
+    sodium = round(rng.uniform(100, 1400), 1)
+    calories = round(protein * 4 + fat * 9 + carbs * 4 + rng.uniform(-30, 50), 1)
     return calories, {
         "protein": protein,
         "fat": fat,
@@ -37,57 +39,79 @@ def generate_macros():
     }
 
 # Updated recipe generator with final format
-def generate_recipe():
+# rng is a random.Random so catalogs are reproducible from a seed
+def generate_recipe(rng=random):
     ingredients = []
 
     # Step 1: Pick a logical combo
-    p = random.choice(proteins)
+    p = rng.choice(proteins)
     ingredients.append(p)
 
     if p in ["tofu", "eggs", "lentils", "black beans"]:
-        d = random.choice(dairy)
+        d = rng.choice(dairy)
     else:
-        d = random.choice(dairy + flavors)
+        d = rng.choice(dairy + flavors)
     ingredients.append(d)
 
-    v = random.choice(vegetables)
+    v = rng.choice(vegetables)
     ingredients.append(v)
 
-    c = random.choice(carbs)
+    c = rng.choice(carbs)
     ingredients.append(c)
 
-    f = random.choice(flavors)
+    f = rng.choice(flavors)
     if f not in ingredients:
         ingredients.append(f)
 
-    extra = random.sample([i for i in (proteins + dairy + vegetables + carbs + flavors) if i not in ingredients], k=random.randint(0, 2))
+    extra = rng.sample([i for i in (proteins + dairy + vegetables + carbs + flavors) if i not in ingredients], k=rng.randint(0, 2))
     ingredients.extend(extra)
-    ingredients = list(set(ingredients))
+    ingredients = sorted(set(ingredients), key=ingredients.index)
 
     # Step 2: Build title from templates based on core pair
-    template = random.choice(title_templates)
+    template = rng.choice(title_templates)
     i1 = p if template[0] == "protein" else (v if template[0] == "vegetable" else d)
     i2 = d if template[1] == "dairy" else (v if template[1] == "vegetable" else c)
     title = template[2].format(i1.capitalize(), i2.capitalize())
 
     # Step 3: Store ingredients with numeric quantities only
-    ingredient_quantities = {i: random.randint(30, 250) for i in ingredients}
-    calories, macros = generate_macros()
+    ingredient_quantities = {i: rng.randint(30, 250) for i in ingredients}
+    calories, macros = generate_macros(rng)
 
     return {
         "title": title,
-        "rating": round(random.uniform(2.5, 5.0), 2),
+        "rating": round(rng.uniform(2.5, 5.0), 2),
         "calories": calories,
         "macros": macros,
         "ingredients": ingredient_quantities
     }
 
-# Generate 1000 updated recipes
-final_recipes_updated = [generate_recipe() for _ in range(1000)]
-
-# Save to file
-output_path_final_updated = "/mnt/data/final_clean_chef_recipes_1000.json"
-with open(output_path_final_updated, "w") as f:
-    json.dump(final_recipes_updated, f, indent=2)
-
-output_path_final_updated
+def generate_recipes(count, seed=0):
+    # yields count recipes; the same seed always gives the same catalog
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield generate_recipe(rng)
+
+def write_recipes(path, count, seed=0):
+    # streams the catalog to a JSON file, so 1M recipes never sit in memory as dicts
+    with open(path, "w") as f:
+        f.write("[\n")
+        for i, recipe in enumerate(generate_recipes(count, seed)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(recipe))
+        f.write("\n]\n")
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic recipe catalog.")
+    parser.add_argument("--count", type=int, default=1000, help="number of recipes (1k to 1M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="defaults to data/synthetic_recipes_<count>.json")
+    args = parser.parse_args(argv)
+
+    output = args.output or f"data/synthetic_recipes_{args.count}.json"
+    write_recipes(output, args.count, args.seed)
+    print(f"Wrote {args.count} recipes (seed {args.seed}) to {output}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
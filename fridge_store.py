@@ -0,0 +1,252 @@
+# fridge_store.py
+
+import os
+import re
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError: # not on Windows: commits are then only serialized within one process
+    fcntl = None
+try:
+    from redis.exceptions import WatchError
+except ImportError: # only RedisFridgeStore needs it
+    class WatchError(Exception):
+        pass
+
+DEFAULT_FRIDGE_PATH = "data/default_fridge.json"
+FRIDGE_USER = os.environ.get("FRIDGE_USER", "default") # whose fridge is used when no user is given
+
+VERSION_WIDTH = 20 # digits of the write counter in a fridge's lock file
+
+
+def _load_default_fridge():
+    with open(DEFAULT_FRIDGE_PATH, "r") as f:
+        return json.load(f)
+
+
+def _user_name(user):
+    user = user or FRIDGE_USER
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", user) or user.startswith("."):
+        raise ValueError(f"Invalid fridge user: {user!r}")
+    return user
+
+
+def _consumed(fridge, used):
+    # use_ingredients on a plain dict: only ingredients already in the fridge, clamped at 0
+    for ingredient, amount in used.items():
+        if ingredient in fridge:
+            fridge[ingredient] -= amount
+            if fridge[ingredient] <= 0:
+                fridge[ingredient] = 0
+    return fridge
+
+
+class FileFridgeStore:
+    # One JSON file per user (local dev). The default user keeps `path`, others get
+    # data/fridge.<user>.json next to it. Writes go to a temp file that is renamed over
+    # the old one, so readers never see a half-written fridge. Writers take a lock file
+    # (<path>.lock) for the few milliseconds of a read-modify-write; readers never lock.
+    # The lock file also holds a write counter, bumped after every rename, which is the
+    # fridge's version together with the file's identity (inode, mtime, size): the
+    # counter can't be fooled by a reused inode, the identity catches hand edits.
+    _thread_lock = threading.Lock()
+
+    def __init__(self, path="data/fridge.json"):
+        self.path = path
+
+    def _path(self, user):
+        user = _user_name(user)
+        if user == FRIDGE_USER:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{user}{ext}"
+
+    @contextmanager
+    def _locked(self, user):
+        # the lock file, open for reading and writing its counter
+        fd = os.open(self._path(user) + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        with self._thread_lock, os.fdopen(fd, "r+b") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield lock
+
+    def _counter(self, raw):
+        # writes counted in a lock file's contents; 0 for a new (empty) lock file
+        raw = raw.strip()
+        return int(raw) if raw.isdigit() else 0
+
+    def _written(self, user):
+        try:
+            with open(self._path(user) + ".lock", "rb") as f:
+                return self._counter(f.read(VERSION_WIDTH))
+        except FileNotFoundError:
+            return 0
+
+    def _version(self, written, stat):
+        return (written, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def load(self, user=None):
+        return self.load_versioned(user)[0]
+
+    def _read(self, user):
+        # the fridge for a write already under _locked(user): a missing or unreadable
+        # file reads as the default fridge (load_versioned would take the lock again)
+        try:
+            with open(self._path(user), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return _load_default_fridge()
+
+    def load_versioned(self, user=None):
+        # (fridge, version) for commit(). The counter is read before the fridge and
+        # bumped after the rename, so a fridge is never older than its counter: at
+        # worst newer, and then commit() finds the counter moved and refuses.
+        written = self._written(user)
+        try:
+            with open(self._path(user), "r") as f:
+                return json.load(f), self._version(written, os.fstat(f.fileno()))
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._locked(user) as lock:
+                self._write(_load_default_fridge(), user, lock)
+            return self.load_versioned(user)
+
+    def _write(self, fridge, user, lock):
+        # under _locked(user), whose lock file is `lock`
+        path = self._path(user)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".fridge-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(fridge, f, indent=2)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        lock.seek(0)
+        written = self._counter(lock.read(VERSION_WIDTH))
+        lock.seek(0)
+        lock.write(b"%0*d" % (VERSION_WIDTH, written + 1)) # fixed width: rewritten in place, never truncated
+        lock.flush()
+
+    def save(self, fridge, user=None):
+        with self._locked(user) as lock:
+            self._write(fridge, user, lock)
+
+    def consume(self, used, user=None):
+        # the file is rewritten whole anyway
+        with self._locked(user) as lock:
+            self._write(_consumed(self._read(user), used), user, lock)
+
+    def commit(self, used, version, user=None):
+        # consume `used` only if the fridge is still the one loaded as `version`
+        with self._locked(user) as lock:
+            lock.seek(0)
+            written = self._counter(lock.read(VERSION_WIDTH))
+            try:
+                current = self._version(written, os.stat(self._path(user)))
+            except FileNotFoundError:
+                return False
+            if current != version:
+                return False
+            self._write(_consumed(self._read(user), used), user, lock)
+            return True
+
+
+class RedisFridgeStore:
+    # One hash per user (fridge:<user>), one field per ingredient holding its amount,
+    # plus a counter (fridge:<user>:version) every write increments. The counter also
+    # tells an emptied fridge (no hash, counter set) from one never created, which gets
+    # the default fridge. Consumption is a pipelined HINCRBYFLOAT per used ingredient,
+    # so a request sends only what it uses instead of the whole fridge.
+    def __init__(self, client, prefix="fridge"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, user):
+        return f"{self.prefix}:{_user_name(user)}"
+
+    def load(self, user=None):
+        return self.load_versioned(user)[0]
+
+    def load_versioned(self, user=None):
+        # (fridge, version) for commit(), read together in one MULTI
+        key = self._key(user)
+        pipe = self.client.pipeline()
+        pipe.hgetall(key)
+        pipe.get(f"{key}:version")
+        fields, version = pipe.execute()
+        if fields or version is not None:
+            return {ingredient: float(amount) for ingredient, amount in fields.items()}, int(version)
+        self.save(self._legacy_fridge(user) or _load_default_fridge(), user)
+        return self.load_versioned(user)
+
+    def _legacy_fridge(self, user):
+        # fridges saved before the hash layout were one JSON string under "fridge"
+        if _user_name(user) != FRIDGE_USER or self.client.type(self.prefix) != "string":
+            return None
+        try:
+            return json.loads(self.client.get(self.prefix))
+        except (TypeError, json.JSONDecodeError):
+            return None
+
+    def save(self, fridge, user=None):
+        # full replace (the fridge form); an empty fridge is no hash, with the counter still set
+        key = self._key(user)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if fridge:
+            pipe.hset(key, mapping=fridge)
+        pipe.incr(f"{key}:version")
+        pipe.execute()
+
+    def consume(self, used, user=None):
+        # HINCRBYFLOAT can't clamp, so an ingredient that went below 0 gets back the
+        # overdraft, at most what this call took. Relative fixes keep concurrent
+        # consumers and restocks intact (a plain HSET 0 could overwrite a restock).
+        # Ingredients missing from the hash are skipped, as use_ingredients does.
+        key = self._key(user)
+        used = {ingredient: amount for ingredient, amount in used.items() if amount}
+        if not used:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for ingredient in used:
+            pipe.hexists(key, ingredient)
+        present = [ingredient for ingredient, exists in zip(used, pipe.execute()) if exists]
+        for ingredient in present:
+            pipe.hincrbyfloat(key, ingredient, -used[ingredient])
+        pipe.incr(f"{key}:version")
+        overdrawn = [
+            (ingredient, min(-float(amount), used[ingredient]))
+            for ingredient, amount in zip(present, pipe.execute())
+            if float(amount) < 0
+        ]
+        for ingredient, overdraft in overdrawn:
+            pipe.hincrbyfloat(key, ingredient, overdraft)
+        if overdrawn:
+            pipe.execute()
+
+    def commit(self, used, version, user=None):
+        # Consume `used` only if no write happened since the fridge was loaded as
+        # `version`: WATCH the hash and the counter, check the counter, then write the
+        # new amounts and bump it in one MULTI/EXEC. False when another writer got
+        # there first.
+        key, version_key = self._key(user), f"{self._key(user)}:version"
+        used = {ingredient: amount for ingredient, amount in used.items() if amount}
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key, version_key)
+                if int(pipe.get(version_key) or 0) != version:
+                    return False
+                ingredients = list(used)
+                current = pipe.hmget(key, ingredients) if ingredients else []
+                fridge = {ingredient: float(amount) for ingredient, amount in zip(ingredients, current) if amount is not None}
+                pipe.multi()
+                if fridge:
+                    pipe.hset(key, mapping=_consumed(fridge, used))
+                pipe.incr(version_key)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
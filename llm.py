@@ -1,7 +1,11 @@
 import json
-import requests
+import math
 import os
 from dotenv import load_dotenv
+import metrics
+from llm_client import LLMClient, LLMUnavailable, LLM_BASE_URL
+from llm_replay import backend_client, LLM_BACKEND
+from llm_flight import SingleFlightClient, LLM_COALESCE
 
 # Load environment variables from .env file
 load_dotenv()
@@ -9,94 +13,124 @@ load_dotenv()
 #openrouter key
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 
+# one pooled client for the whole process (keep-alive, timeouts, retries, circuit breaker),
+# wrapped for recording or replaced by recordings depending on LLM_BACKEND
+llm_client = backend_client(LLMClient(api_key=OPENROUTER_API_KEY))
+# identical concurrent requests share one call (across workers once meal_planner hands it Redis)
+if LLM_COALESCE:
+    llm_client = SingleFlightClient(llm_client)
+
+LLM_PROMPT_TOKENS = int(os.environ.get("LLM_PROMPT_TOKENS", 1500)) # estimated tokens a meal prompt may take
+CHARS_PER_TOKEN = 3.5
+
+# part of every completion cache key (llm_cache.completion_key): bump it whenever the
+# prompt wording or the expected meal format changes, so older cached answers stop matching
+PROMPT_VERSION = 1
+
+
+def estimate_tokens(text):
+    # rough count without a tokenizer: CHARS_PER_TOKEN (3.5) characters per token,
+    # below English prose's ~4 to allow for dense JSON punctuation, so it errs high
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _compact_amounts(amounts):
+    # (ingredient, whole grams) sorted by name; empty and sub-gram amounts dropped
+    return [(ingredient, round(amount)) for ingredient, amount in sorted(amounts.items()) if round(amount) > 0]
+
+
+def _json_amounts(items):
+    return json.dumps(dict(items), separators=(",", ":"))
+
+
+def _render_prompt(preferences, fridge_items, titles, selected_count, missing_items, meals_needed):
+    macros = preferences['target_macros_per_day']
+    selected = f"{selected_count} already selected"
+    if titles:
+        selected += ": " + "; ".join(titles)
+    missing = f"\nMissing for the planned meals (g): {_json_amounts(missing_items)}" if missing_items else ""
+    return f"""You are Chefie, a practical meal planning assistant.
+Plan: {preferences['days']} days x {preferences['meals_per_day']} meals. Daily targets: {preferences['target_calories_per_day']} kcal, protein {macros['protein']} g, fat {macros['fat']} g, carbs {macros['carbs']} g.
+Meals {selected}.
+Fridge (g): {_json_amounts(fridge_items)}{missing}
+
+Propose {meals_needed} new, simple, realistic meals that use as much of the fridge as possible and stay close to the targets. Use only fridge ingredients.
+Respond ONLY with a JSON array, no other text:
+[{{"meal_title":"...","ingredients":{{"ingredient":grams}},"estimated_nutrition":{{"calories":n,"protein":n,"fat":n,"carbs":n}}}}]"""
+
+
+def build_prompt(preferences, fridge, selected_meals, missing_ingredients, meals_needed, budget=None):
+    # Compact, deterministic prompt: amounts in whole grams, no empty ingredients, no
+    # indentation. Over `budget` tokens (LLM_PROMPT_TOKENS), context is dropped from
+    # the least useful end: the missing ingredients, then the selected meal titles
+    # (the count stays), then the smallest fridge amounts. Returns the prompt, its
+    # estimated tokens and what was trimmed.
+    budget = LLM_PROMPT_TOKENS if budget is None else budget
+    fridge_items = _compact_amounts(fridge)
+    missing_items = _compact_amounts(missing_ingredients)
+    titles = list(dict.fromkeys(meal['meal_title'] for meal in selected_meals))
+    trimmed = {"missing": 0, "titles": 0, "fridge": 0}
+    by_amount = sorted(fridge_items, key=lambda item: (item[1], item[0]))
+
+    while True:
+        prompt = _render_prompt(preferences, fridge_items, titles, len(selected_meals), missing_items, meals_needed)
+        tokens = estimate_tokens(prompt)
+        if tokens <= budget:
+            break
+        if missing_items:
+            trimmed["missing"] = len(missing_items)
+            missing_items = []
+        elif titles:
+            trimmed["titles"] += 1
+            titles.pop()
+        elif len(by_amount) > 1:
+            trimmed["fridge"] += 1
+            fridge_items.remove(by_amount.pop(0))
+        else:
+            break
+    return prompt, tokens, {part: count for part, count in trimmed.items() if count}
+
+
 def build_llm_prompt(preferences, fridge, selected_meals, missing_ingredients, meals_needed):
-    prompt = f"""
-You are Chefie, a highly adaptive AI meal planning assistant.
-
-Your job is to help users build personalized, realistic meal plans based on:
-- Available fridge ingredients
-- Their nutrition goals
-- Their preferences for number of meals and days
-
-You are creative but practical: you prefer realistic meal suggestions that are achievable with the current pantry, and you adjust flexibly when ingredients are limited.
-
-The user wants {preferences['days']} days of meals, with {preferences['meals_per_day']} meals per day.
-
-Their daily nutrition targets are:
-- Calories: {preferences['target_calories_per_day']} kcal
-- Protein: {preferences['target_macros_per_day']['protein']} g
-- Fat: {preferences['target_macros_per_day']['fat']} g
-- Carbs: {preferences['target_macros_per_day']['carbs']} g
-
-Meals already selected:
-{chr(10).join([f"- {meal['meal_title']}" for meal in selected_meals])}
-
-Available ingredients in the fridge (grams):
-{json.dumps(fridge, indent=2)}
-
-Missing ingredients (estimated to fulfill planned meals):
-{json.dumps(missing_ingredients, indent=2)}
-
-Currently, {len(selected_meals)} meals have been selected, but {meals_needed} more are needed.
-
-You must now:
-- Creatively propose {meals_needed} new meals using as much of the available ingredients as possible.
-- Adjust and flexibly create simple, plausible meals.
-- Do NOT hallucinate ingredients that aren't listed as available.
-- Stay close to the user's calorie and macro goals if possible.
-
-For each proposed meal, include:
-- A meal title
-- A dictionary of ingredients and amounts in grams
-- An estimated nutrition breakdown (calories, protein, fat, carbs)
-
-⚠️ Important:
-Respond ONLY with a valid JSON array in this exact format:
-[
-  {{
-    "meal_title": "Example Meal Title",
-    "ingredients": {{
-      "ingredient 1": grams,
-      "ingredient 2": grams
-    }},
-    "estimated_nutrition": {{
-      "calories": number,
-      "protein": number,
-      "fat": number,
-      "carbs": number
-    }}
-  }},
-  ...
-]
-
-Do not add any extra text, explanation, greetings, or notes. Only respond with pure JSON.
-"""
-    return prompt
+    return build_prompt(preferences, fridge, selected_meals, missing_ingredients, meals_needed)[0]
+
+
+def _meal_messages(preferences, fridge, selected_meals, missing_ingredients, meals_needed):
+    # chat messages for a completion request; each prompt's size goes to the llm_prompt_tokens histogram
+    prompt, tokens, trimmed = build_prompt(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+    metrics.observe("llm_prompt_tokens", tokens)
+    if trimmed:
+        metrics.inc("llm_prompts_trimmed")
+    return [
+        {"role": "system", "content": "You are a helpful meal planning assistant."},
+        {"role": "user", "content": prompt}
+    ]
 
 
 def call_llm_for_meal_completion(preferences, fridge, selected_meals, missing_ingredients, meals_needed):
-    if OPENROUTER_API_KEY is None:
+    if OPENROUTER_API_KEY is None and "openrouter.ai" in LLM_BASE_URL and LLM_BACKEND != "replay":
         raise ValueError("OPENROUTER_API_KEY environment variable not set.")
 
-    prompt = build_llm_prompt(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+    messages = _meal_messages(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+
+    metrics.inc("llm_calls")
+    try:
+        with metrics.timed("llm_call"):
+            return llm_client.chat(messages)
+    except LLMUnavailable as e:
+        # slow or unhealthy upstream: the plan goes out with the CBR meals only
+        print("Error contacting LLM:", e)
+        return None
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
 
-    payload = {
-        "model": "qwen/qwen-2.5-72b-instruct:free",
-        "messages": [
-            {"role": "system", "content": "You are a helpful meal planning assistant."},
-            {"role": "user", "content": prompt}
-        ]
-    }
+def stream_llm_meal_completion(preferences, fridge, selected_meals, missing_ingredients, meals_needed):
+    # call_llm_for_meal_completion, but yields the response text in pieces as it is
+    # generated; raises LLMUnavailable if the call fails or the stream breaks off
+    if OPENROUTER_API_KEY is None and "openrouter.ai" in LLM_BASE_URL and LLM_BACKEND != "replay":
+        raise ValueError("OPENROUTER_API_KEY environment variable not set.")
 
-    response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
+    messages = _meal_messages(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
 
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        print("Error contacting LLM:", response.text)
-        return None
\ No newline at end of file
+    metrics.inc("llm_calls")
+    with metrics.timed("llm_call"):
+        yield from llm_client.chat_stream(messages)
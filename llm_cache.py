@@ -0,0 +1,251 @@
+# llm_cache.py
+
+import os
+import copy
+import json
+import math
+import time
+import hashlib
+import tempfile
+import threading
+import metrics
+from llm_client import LLM_MODEL
+from llm import PROMPT_VERSION
+
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 1000)) # max cached completions
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600)) # seconds
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "data/llm_cache") # disk backend
+LLM_CACHE_BUCKET = float(os.environ.get("LLM_CACHE_BUCKET", 1.25)) # fridge amounts within this ratio share a bucket
+
+CALORIE_STEP = 50 # kcal per day
+MACRO_STEP = 5 # g per day
+
+
+def _bucket(amount):
+    # geometric buckets: 100g and 110g land together, 100g and 300g don't
+    return round(math.log(amount) / math.log(LLM_CACHE_BUCKET))
+
+
+def _rounded(value, step):
+    return int(round(value / step)) * step
+
+
+def completion_key(preferences, fridge, selected_meals, missing_ingredients, meals_needed):
+    # Canonical form of what the completion depends on: the model and prompt version,
+    # fridge amounts bucketed with empty ingredients dropped, targets rounded, the meals
+    # already chosen and the missing ingredients (names only). Nearby requests share a key.
+    canonical = {
+        "model": LLM_MODEL,
+        "prompt_version": PROMPT_VERSION,
+        "days": preferences["days"],
+        "meals_per_day": preferences["meals_per_day"],
+        "calories": _rounded(preferences["target_calories_per_day"], CALORIE_STEP),
+        "macros": {macro: _rounded(amount, MACRO_STEP) for macro, amount in sorted(preferences["target_macros_per_day"].items())},
+        "fridge": {ingredient: _bucket(amount) for ingredient, amount in sorted(fridge.items()) if amount > 0},
+        "selected": sorted(meal["meal_title"] for meal in selected_meals),
+        "missing": sorted(ingredient for ingredient, amount in missing_ingredients.items() if amount > 0),
+        "meals_needed": meals_needed
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_meals(meals):
+    # the proposed meals if they are a well-formed meal list, else None
+    if not isinstance(meals, list):
+        return None
+    for meal in meals:
+        if not isinstance(meal, dict) or not isinstance(meal.get("meal_title"), str):
+            return None
+        ingredients = meal.get("ingredients")
+        if not isinstance(ingredients, dict) or not all(_number(amount) and amount >= 0 for amount in ingredients.values()):
+            return None
+        nutrition = meal.get("estimated_nutrition", {})
+        if not isinstance(nutrition, dict) or not all(_number(value) for value in nutrition.values()):
+            return None
+    return meals
+
+
+def parse_meals(response):
+    # the meal list in a raw LLM response, or None if it isn't valid JSON of the right shape
+    try:
+        meals = json.loads(response)
+    except json.JSONDecodeError:
+        print("Failed to parse LLM response as JSON.")
+        return None
+    if validate_meals(meals) is None:
+        print("LLM response is not a valid list of meals.")
+        return None
+    return meals
+
+
+def iter_meals(chunks):
+    # Meal objects from a JSON array that arrives in pieces (a streamed completion),
+    # each yielded as soon as its closing brace is in. Tracks only nesting depth and
+    # whether it is inside a string, so the array never has to be complete; malformed
+    # meals are skipped. The generator's return value says whether the closing "]"
+    # arrived, i.e. whether the stream was cut short.
+    started, depth, in_string, escaped, buffer = False, 0, False, False, []
+    for chunk in chunks:
+        for ch in chunk:
+            if not started:
+                started = ch == "["
+                continue
+            if depth == 0:
+                if ch == "{":
+                    depth, buffer = 1, [ch]
+                elif ch == "]":
+                    return True
+                continue
+            buffer.append(ch)
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+            elif ch in "}]":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        meal = json.loads("".join(buffer))
+                    except json.JSONDecodeError:
+                        print("Skipping a meal the LLM stream sent as invalid JSON.")
+                        continue
+                    if validate_meals([meal]) is None:
+                        print("Skipping a malformed meal from the LLM stream.")
+                        continue
+                    yield meal
+    return False
+
+
+class DiskCompletionBackend:
+    # One JSON file per key under `directory`. A file's mtime is its last use
+    # (least recently used files are removed past max_entries); its stored_at field
+    # bounds its age.
+    def __init__(self, directory=LLM_CACHE_DIR, max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - entry["stored_at"] > self.ttl:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["value"]
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".entry-", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"stored_at": time.time(), "value": value}, f)
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+            if len(entries) > self.max_entries:
+                entries.sort(key=lambda e: e.stat().st_mtime)
+                for entry in entries[:len(entries) - self.max_entries]:
+                    self._remove(entry.path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                self._remove(entry.path)
+
+
+class CompletionCache:
+    # Parsed, validated LLM meal lists by completion_key. The backend is a
+    # DiskCompletionBackend or a rank_cache.RedisRankBackend (with its own prefix);
+    # anything with get/set/clear of JSON values works, and None disables caching.
+    # Hits and misses are counted here and in metrics (llm_cache_hits / llm_cache_misses).
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def complete(self, call, preferences, fridge, selected_meals, missing_ingredients, meals_needed):
+        # the meals for these inputs from the cache, or from call(...) (a raw JSON string)
+        if self.backend is None:
+            response = call(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+            return parse_meals(response) if response else None
+
+        key = completion_key(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+        meals = self.backend.get(key)
+        if meals is not None and validate_meals(meals) is not None:
+            self.hits += 1
+            metrics.inc("llm_cache_hits")
+            return copy.deepcopy(meals)
+        self.misses += 1
+        metrics.inc("llm_cache_misses")
+
+        response = call(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+        meals = parse_meals(response) if response else None
+        if meals:
+            self.backend.set(key, meals)
+        return copy.deepcopy(meals)
+
+    def stream(self, call_stream, preferences, fridge, selected_meals, missing_ingredients, meals_needed):
+        # complete() for a streamed completion: yields meals one by one as they are
+        # parsed from call_stream(...) (text pieces). A hit yields the cached meals at
+        # once; only a stream whose array was complete is cached, not one that ended
+        # early or that the reader stopped.
+        key = None
+        if self.backend is not None:
+            key = completion_key(preferences, fridge, selected_meals, missing_ingredients, meals_needed)
+            meals = self.backend.get(key)
+            if meals is not None and validate_meals(meals) is not None:
+                self.hits += 1
+                metrics.inc("llm_cache_hits")
+                yield from copy.deepcopy(meals)
+                return
+            self.misses += 1
+            metrics.inc("llm_cache_misses")
+
+        meals = []
+        parsed = iter_meals(call_stream(preferences, fridge, selected_meals, missing_ingredients, meals_needed))
+        while True:
+            try:
+                meal = next(parsed)
+            except StopIteration as end:
+                complete = end.value
+                break
+            meals.append(meal)
+            yield copy.deepcopy(meal)
+        if key is not None and meals and complete:
+            self.backend.set(key, meals)
+
+    def invalidate(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
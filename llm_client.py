@@ -0,0 +1,194 @@
+# llm_client.py
+
+import os
+import json
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://openrouter.ai/api/v1") # any chat-completions API, e.g. a local stub
+LLM_MODEL = os.environ.get("LLM_MODEL", "qwen/qwen-2.5-72b-instruct:free")
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 3.05)) # seconds
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 60)) # seconds without a byte from the upstream
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", 2)) # extra attempts on 429/5xx and connection errors
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", 0.5)) # seconds, doubled per retry, full jitter
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 10)) # keep-alive connections kept per host
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5)) # failed calls in a row that open the breaker
+LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", 30)) # seconds before an open breaker lets a trial call through
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_BACKOFF = 8.0 # seconds
+
+
+class LLMUnavailable(Exception):
+    # the upstream failed (after retries) or the breaker is open; callers fall back to CBR only
+    pass
+
+
+class CircuitBreaker:
+    # closed: calls go through. After `failures` failed calls in a row it opens and
+    # calls fail at once; `reset` seconds later one trial call is let through
+    # (half-open), which closes it again on success or re-opens it on failure.
+    def __init__(self, failures=LLM_BREAKER_FAILURES, reset=LLM_BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self._failed = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failed = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failed += 1
+            self._trial = False
+            if self._opened_at is not None or self._failed >= self.failures:
+                if self._opened_at is None:
+                    print(f"LLM circuit breaker open after {self._failed} failed calls")
+                    metrics.inc("llm_breaker_opened")
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._trial or time.monotonic() - self._opened_at >= self.reset else "open"
+
+
+class LLMClient:
+    # Long-lived chat-completions client: one requests.Session with pooled keep-alive
+    # connections, connect/read timeouts, retries with jittered exponential backoff on
+    # 429/5xx and connection errors, and a circuit breaker in front of it all.
+    def __init__(self, base_url=LLM_BASE_URL, api_key=None, model=LLM_MODEL,
+                 timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT), retries=LLM_RETRIES,
+                 backoff=LLM_BACKOFF, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=LLM_POOL_SIZE, pool_maxsize=LLM_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _delay(self, attempt, response):
+        # Retry-After when the upstream sends one (seconds form), else full jitter
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def _post(self, payload, stream=False):
+        # a 200 response for payload, after retries; raises LLMUnavailable. Every call the
+        # breaker lets through reports back to it, so a half-open trial can't be left open
+        if not self.breaker.allow():
+            metrics.inc("llm_short_circuits")
+            raise LLMUnavailable("LLM circuit breaker is open")
+        try:
+            return self._attempts(payload, stream)
+        except LLMUnavailable:
+            raise # already reported
+        except Exception as e: # e.g. an invalid URL or too many redirects, not worth retrying
+            self.breaker.failure()
+            raise LLMUnavailable(f"LLM call failed: {e}")
+        except BaseException:
+            self.breaker.failure()
+            raise
+
+    def _attempts(self, payload, stream):
+        error, response = None, None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.inc("llm_retries")
+                time.sleep(self._delay(attempt - 1, response))
+            response = None
+            try:
+                response = self.session.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=self._headers(), json=payload, timeout=self.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                continue
+            if response.status_code == 200:
+                return response
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            if response.status_code not in RETRY_STATUSES:
+                self.breaker.success() # the upstream is up, it rejected this request
+                raise LLMUnavailable(f"LLM call failed: {error}")
+
+        self.breaker.failure()
+        raise LLMUnavailable(f"LLM call failed: {error}")
+
+    def chat(self, messages, **options):
+        # content of the first choice; raises LLMUnavailable when it can't be had
+        response = self._post({"model": self.model, "messages": messages, **options})
+        try:
+            content = response.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.breaker.failure() # a malformed body is not worth retrying
+            raise LLMUnavailable(f"LLM call failed: {e}")
+        self.breaker.success()
+        return content
+
+    def chat_stream(self, messages, **options):
+        # Content of the first choice in pieces, as the upstream generates them
+        # (stream=True, server-sent events). Retries only happen before the first byte;
+        # a stream that breaks off raises LLMUnavailable after what it already yielded.
+        # The upstream counts as healthy once its first piece arrives, or when the reader
+        # stops early (iter_meals closes the stream at the closing bracket).
+        response = self._post({"model": self.model, "messages": messages, "stream": True, **options}, stream=True)
+        response.encoding = "utf-8"
+        answered, failed = False, False
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue # blank separators and ": keep-alive" comments
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    choices = json.loads(data).get("choices") or [{}]
+                except ValueError:
+                    continue
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    if not answered:
+                        answered = True
+                        self.breaker.success()
+                    yield content
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            failed = True
+            self.breaker.failure()
+            raise LLMUnavailable(f"LLM stream broke off: {e}")
+        finally:
+            response.close()
+            if not answered and not failed:
+                self.breaker.success()
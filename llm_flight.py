@@ -0,0 +1,193 @@
+# llm_flight.py
+
+import os
+import json
+import time
+import uuid
+import threading
+import metrics
+from llm_client import LLMUnavailable
+from llm_replay import request_key
+try:
+    from redis.exceptions import WatchError
+except ImportError: # only the cross-worker mode needs it
+    class WatchError(Exception):
+        pass
+
+LLM_COALESCE = os.environ.get("LLM_COALESCE", "1") != "0" # make identical concurrent LLM requests once
+LLM_FLIGHT_TTL = float(os.environ.get("LLM_FLIGHT_TTL", 180)) # seconds a worker may lead a request before others stop waiting
+
+FLIGHT_POLL = 0.05 # seconds between checks for another worker's answer
+FLIGHT_RESULT_TTL = 10 # seconds a finished answer stays readable for the workers that waited on it
+
+
+class _Flight:
+    # One request in progress in this process: the leader adds the answer's pieces,
+    # followers read them as they come in
+    def __init__(self):
+        self.pieces = []
+        self.followers = 0
+        self.done = False
+        self.error = None
+        self._changed = threading.Condition()
+
+    def add(self, piece):
+        with self._changed:
+            self.pieces.append(piece)
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    def follow(self):
+        seen = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(self.pieces) > seen or self.done)
+                pieces, done, error = self.pieces[seen:], self.done, self.error
+            yield from pieces
+            seen += len(pieces)
+            if done and seen == len(self.pieces):
+                if error is not None:
+                    raise LLMUnavailable(error)
+                return
+
+
+class SingleFlightClient:
+    # Wraps an LLM client so concurrent calls with the same model and messages (the
+    # prompt hash, as in llm_replay) make one upstream request. The first caller leads;
+    # the others get the same answer text, streamed as it arrives, and parse it
+    # themselves, so nobody shares meal objects. When the leader fails, its followers
+    # fail with it instead of all retrying.
+    #
+    # With a Redis client set, one worker process leads per key: it holds
+    # <prefix>:<key>:lock while calling and publishes the answer (or its error) under
+    # <prefix>:<key>:result. Other workers poll for it and get it whole, not streamed.
+    # If the lock goes away without an answer (the leader died), the next waiter leads.
+    def __init__(self, client, redis_client=None, prefix="llmflight"):
+        self.client = client
+        self.model = client.model
+        self.redis = redis_client
+        self.prefix = prefix
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def chat(self, messages, **options):
+        return "".join(self._coalesced(messages, lambda: iter([self.client.chat(messages, **options)])))
+
+    def chat_stream(self, messages, **options):
+        return self._coalesced(messages, lambda: self.client.chat_stream(messages, **options))
+
+    def _coalesced(self, messages, produce):
+        # the answer's pieces, from this caller's own call (produce()) or another's
+        key = request_key(self.model, messages)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            metrics.inc("llm_coalesced")
+            yield from flight.follow()
+            return
+
+        upstream = self._lead(key, produce)
+        try:
+            for piece in upstream:
+                flight.add(piece)
+                yield piece
+        except GeneratorExit:
+            # The leader stopped reading early (iter_meals stops at the closing bracket).
+            # Read the rest for whoever waits on this answer, here or in another worker.
+            with self._lock:
+                self._forget(key, flight)
+            if flight.followers or self.redis is not None:
+                self._drain(upstream, flight)
+            else:
+                upstream.close()
+                flight.finish("LLM request abandoned")
+            raise
+        except BaseException as e:
+            flight.finish(str(e) or type(e).__name__)
+            raise
+        else:
+            flight.finish()
+        finally:
+            with self._lock:
+                self._forget(key, flight)
+
+    def _forget(self, key, flight):
+        # a later flight for the same key may already have taken its place
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _drain(self, upstream, flight):
+        try:
+            for piece in upstream:
+                flight.add(piece)
+        except Exception as e:
+            flight.finish(str(e) or type(e).__name__)
+        else:
+            flight.finish()
+
+    def _lead(self, key, produce):
+        # this process's call for key; with Redis only one worker makes it
+        if self.redis is None:
+            yield from produce()
+            return
+
+        lock, result, token = f"{self.prefix}:{key}:lock", f"{self.prefix}:{key}:result", uuid.uuid4().hex
+        while not self.redis.set(lock, token, nx=True, px=int(LLM_FLIGHT_TTL * 1000)):
+            content = self._remote_answer(lock, result)
+            if content is not None:
+                metrics.inc("llm_coalesced_remote")
+                yield content
+                return
+
+        self.redis.delete(result) # an answer left from an earlier flight
+        pieces = []
+        try:
+            for piece in produce():
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            self.redis.set(result, json.dumps({"error": str(e)}), px=FLIGHT_RESULT_TTL * 1000)
+            raise
+        else:
+            self.redis.set(result, json.dumps({"content": "".join(pieces)}), px=FLIGHT_RESULT_TTL * 1000)
+        finally:
+            self._release(lock, token)
+
+    def _remote_answer(self, lock, result):
+        # the answer another worker published, or None once its lock is gone without one
+        deadline = time.monotonic() + LLM_FLIGHT_TTL
+        while time.monotonic() < deadline:
+            raw = self.redis.get(result)
+            if raw is None and not self.redis.exists(lock):
+                raw = self.redis.get(result) # published just before the lock was released
+                if raw is None:
+                    return None
+            if raw is not None:
+                entry = json.loads(raw)
+                if "error" in entry:
+                    raise LLMUnavailable(entry["error"])
+                return entry["content"]
+            time.sleep(FLIGHT_POLL)
+        return None
+
+    def _release(self, lock, token):
+        # delete the lock only if it is still ours (it may have expired and been taken)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(lock)
+                if pipe.get(lock) == token:
+                    pipe.multi()
+                    pipe.delete(lock)
+                    pipe.execute()
+            except WatchError:
+                pass
@@ -0,0 +1,98 @@
+# llm_jobs.py
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+LLM_JOB_WORKERS = int(os.environ.get("LLM_JOB_WORKERS", 4)) # LLM completions running at once (threads: they wait on the network)
+LLM_JOB_TTL = float(os.environ.get("LLM_JOB_TTL", 600)) # seconds a finished job's result is kept
+
+
+class Job:
+    # One background LLM completion. `meals` grows while it runs; status goes
+    # queued -> running -> done | failed. Readers wait on it with wait_for_update().
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.meals = []
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    def add_meal(self, meal):
+        with self._changed:
+            self.meals.append(meal)
+            self._changed.notify_all()
+
+    def _set_status(self, status, error=None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            if status in ("done", "failed"):
+                self.finished_at = time.monotonic()
+            self._changed.notify_all()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def wait_for_update(self, seen, timeout=None):
+        # block until there are more than `seen` meals or the job has finished
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.meals) > seen or self.finished, timeout)
+            return list(self.meals[seen:]), self.finished
+
+    def to_dict(self):
+        with self._changed:
+            return {"id": self.id, "status": self.status, "meals": list(self.meals), "error": self.error}
+
+
+class JobQueue:
+    # Runs jobs on a small thread pool and keeps them by id until LLM_JOB_TTL after
+    # they finish. Jobs live in this process: with several server processes, status
+    # requests must reach the process that queued the job.
+    def __init__(self, workers=LLM_JOB_WORKERS, ttl=LLM_JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, work):
+        # work(job) fills in job.meals; the job fails if it raises
+        job = Job()
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        metrics.inc("llm_jobs")
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        job._set_status("running")
+        try:
+            with metrics.timed("llm_job"):
+                work(job)
+        except Exception as e:
+            print(f"LLM job {job.id} failed:", e)
+            metrics.inc("llm_job_failures")
+            job._set_status("failed", str(e))
+        else:
+            job._set_status("done")
+
+    def _expire(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,124 @@
+# llm_replay.py
+#
+# Record/replay backends for the LLM client, for load tests and offline runs that
+# must not reach the real upstream. LLM_BACKEND picks one in llm.py:
+#
+#   http    LLMClient against LLM_BASE_URL (default)
+#   record  the same, and every complete answer is saved to LLM_RECORD_DIR
+#   replay  answers come from LLM_RECORD_DIR only; a request never recorded fails
+#           like an unavailable upstream (the plan keeps its CBR meals)
+#
+# Recordings are keyed by the model and the exact messages, so replays need the same
+# prompts: build_llm_prompt is deterministic for the same inputs. llm_stub.py can
+# serve the same recordings over HTTP, with simulated latency.
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import metrics
+from llm_client import LLMUnavailable, LLM_MODEL
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "http") # http, record or replay
+LLM_RECORD_DIR = os.environ.get("LLM_RECORD_DIR", "data/llm_recordings")
+
+REPLAY_CHUNK = 16 # characters per piece when a recording is replayed as a stream
+
+
+def request_key(model, messages):
+    return hashlib.sha256(json.dumps({"model": model, "messages": messages}, sort_keys=True).encode()).hexdigest()
+
+
+class RecordingStore:
+    # One JSON file per request key with the request and the answer's content, so a
+    # recording can be read (and edited) by hand.
+    def __init__(self, directory=LLM_RECORD_DIR):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, model, messages):
+        try:
+            with open(self._path(request_key(model, messages)), "r") as f:
+                return json.load(f)["content"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def save(self, model, messages, content):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {"model": model, "messages": messages, "content": content, "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".recording-", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp, self._path(request_key(model, messages)))
+
+
+class RecordingClient:
+    # Wraps an LLMClient and saves every answer that came back whole
+    def __init__(self, client, store=None):
+        self.client = client
+        self.model = client.model
+        self.store = store or RecordingStore()
+
+    def chat(self, messages, **options):
+        content = self.client.chat(messages, **options)
+        self._save(messages, [content])
+        return content
+
+    def chat_stream(self, messages, **options):
+        # a reader that stops early (iter_meals stops at the closing bracket) still gets
+        # the whole answer recorded: the rest is read before the stream is closed
+        pieces = []
+        upstream = self.client.chat_stream(messages, **options)
+        try:
+            for piece in upstream:
+                pieces.append(piece)
+                yield piece
+        except GeneratorExit:
+            try:
+                pieces.extend(upstream)
+                self._save(messages, pieces)
+            except LLMUnavailable:
+                pass # broke off: nothing complete to record
+            raise
+        self._save(messages, pieces)
+
+    def _save(self, messages, pieces):
+        self.store.save(self.model, messages, "".join(pieces))
+        metrics.inc("llm_recorded")
+
+
+class ReplayClient:
+    # Answers from recordings only, without any network access
+    def __init__(self, store=None, model=LLM_MODEL):
+        self.model = model
+        self.store = store or RecordingStore()
+
+    def _recorded(self, messages):
+        content = self.store.get(self.model, messages)
+        if content is None:
+            metrics.inc("llm_replay_misses")
+            raise LLMUnavailable(f"No recorded LLM response for request {request_key(self.model, messages)[:12]}")
+        metrics.inc("llm_replay_hits")
+        return content
+
+    def chat(self, messages, **options):
+        return self._recorded(messages)
+
+    def chat_stream(self, messages, **options):
+        content = self._recorded(messages)
+        for i in range(0, len(content), REPLAY_CHUNK):
+            yield content[i:i + REPLAY_CHUNK]
+
+
+def backend_client(client, backend=LLM_BACKEND):
+    # the client llm.py calls for the configured backend; `client` is the HTTP one
+    if backend == "http":
+        return client
+    if backend == "record":
+        return RecordingClient(client)
+    if backend == "replay":
+        return ReplayClient(model=client.model)
+    raise ValueError(f"Unknown LLM_BACKEND: {backend!r} (expected http, record or replay)")
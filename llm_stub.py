@@ -0,0 +1,173 @@
+# llm_stub.py
+#
+# Local stand-in for the chat-completions API, so the app can be load-tested
+# without calling openrouter.ai. Answers are meal lists made from the fridge in the
+# prompt (the same prompt always gets the same meals), or recorded answers from
+# llm_replay when --replay points at a recordings directory. Latency, error rate
+# and streaming speed are configurable:
+#
+#   python llm_stub.py --port 8001 --latency lognormal:1.5:0.4 --error-rate 0.02
+#   LLM_BASE_URL=http://127.0.0.1:8001/v1 python app.py
+#
+# Latencies: fixed:<s>, uniform:<low>:<high> or lognormal:<median>:<sigma>. A
+# streamed answer spreads its latency over the pieces it sends.
+
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm_replay import RecordingStore
+
+STREAM_CHUNK = 12 # characters of content per streamed event
+
+
+def parse_latency(spec):
+    # a function returning one latency sample in seconds, for the spec formats above
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed" and len(args) == 1:
+        return lambda rng: args[0]
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: rng.uniform(*args)
+    if kind == "lognormal" and len(args) == 2:
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+def stub_meals(prompt):
+    # Plausible meals for a meal prompt: ingredients taken from its fridge, seeded by
+    # the prompt so a repeated request gets the same answer
+    rng = random.Random(prompt)
+    match = re.search(r"Fridge \(g\): (\{.*?\})\n", prompt)
+    fridge = json.loads(match.group(1)) if match else {}
+    match = re.search(r"Propose (\d+) new", prompt)
+    count = int(match.group(1)) if match else 1
+    stocked = sorted(ingredient for ingredient, amount in fridge.items() if amount > 0)
+
+    meals = []
+    for i in range(count):
+        picked = rng.sample(stocked, min(len(stocked), rng.randint(2, 4)))
+        ingredients = {ingredient: max(1, round(min(150, fridge[ingredient] / (count + 1)))) for ingredient in picked}
+        protein, fat, carbs = rng.randint(15, 45), rng.randint(5, 30), rng.randint(20, 80)
+        meals.append({
+            "meal_title": f"Stub {' and '.join(picked[:2]) or 'pantry'} bowl {i + 1}",
+            "ingredients": ingredients,
+            "estimated_nutrition": {"calories": 4 * protein + 9 * fat + 4 * carbs, "protein": protein, "fat": fat, "carbs": carbs}
+        })
+    return json.dumps(meals)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency="fixed:0.5", error_rate=0.0, error_status=503, replay=None, seed=None):
+        super().__init__(address, StubHandler)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.store = RecordingStore(replay) if replay else None
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        # clients closing idle keep-alive connections are not worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def sample(self):
+        # (latency, whether to fail) for one request
+        with self.rng_lock:
+            self.requests += 1
+            return max(0.0, self.latency(self.rng)), self.rng.random() < self.error_rate
+
+    def answer(self, body):
+        messages = body.get("messages") or []
+        if self.store is not None:
+            content = self.store.get(body.get("model"), messages)
+            if content is not None:
+                return content
+        return stub_meals(messages[-1].get("content", "") if messages else "")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, as the real upstream
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid JSON body"}})
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        latency, fail = self.server.sample()
+        if fail:
+            time.sleep(latency / 2)
+            return self._send_json(self.server.error_status, {"error": {"message": "stub error"}})
+        content = self.server.answer(body)
+
+        if not body.get("stream"):
+            time.sleep(latency)
+            return self._send_json(200, {
+                "id": "stub", "object": "chat.completion", "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [content[i:i + STREAM_CHUNK] for i in range(0, len(content), STREAM_CHUNK)]
+        for piece in pieces:
+            time.sleep(latency / len(pieces))
+            self._send_chunk("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": piece}}]}) + "\n\n")
+        self._send_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local chat-completions stub for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default="fixed:0.5", help="fixed:<s>, uniform:<low>:<high> or lognormal:<median>:<sigma>")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--replay", help="recordings directory (llm_replay) to answer from when a request matches")
+    parser.add_argument("--seed", type=int, default=None, help="seed for latencies and errors")
+    args = parser.parse_args(argv)
+
+    server = StubServer((args.host, args.port), args.latency, args.error_rate, args.error_status, args.replay, args.seed)
+    print(f"LLM stub on http://{args.host}:{server.server_address[1]}/v1 (latency {args.latency}, error rate {args.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {server.requests} requests")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
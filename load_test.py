@@ -0,0 +1,182 @@
+# load_test.py
+#
+# Load-test driver for the web app: sends concurrent plan_meals requests with seeded
+# random preferences and reports throughput and latency percentiles. With
+# --wait-llm each request also follows its LLM job's event stream, so the time to
+# the first LLM meal and to the finished job are measured too. Run it against an
+# app pointed at llm_stub.py (or LLM_BACKEND=replay) to test without the real LLM:
+#
+#   python llm_stub.py --latency lognormal:1.5:0.4 &
+#   LLM_BASE_URL=http://127.0.0.1:8001/v1 LLM_CACHE=0 python app.py &
+#   python load_test.py --requests 500 --concurrency 32 --wait-llm --restock data/fridge.json
+#
+# --restock replaces the app's fridge before the run; every plan consumes from it.
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+PRIORITIES = ["calories", "protein", "fat", "carbs"]
+
+
+def _random_form(rng):
+    return {
+        "action": "plan_meals",
+        "days": str(rng.choice([1, 3, 7])),
+        "meals_per_day": str(rng.choice([2, 3, 4])),
+        "calories": str(round(rng.uniform(1400, 3000))),
+        "protein": str(round(rng.uniform(60, 200))),
+        "fat": str(round(rng.uniform(40, 120))),
+        "carbs": str(round(rng.uniform(100, 350))),
+        "priority": rng.choice(PRIORITIES)
+    }
+
+
+def _summary(latencies, wall):
+    if not latencies:
+        return {"count": 0}
+    ms = np.array(latencies) * 1000
+    return {
+        "count": len(ms),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "max_ms": float(ms.max()),
+        "throughput_per_s": len(ms) / wall if wall else None
+    }
+
+
+class LoadTest:
+    def __init__(self, url, wait_llm=False, timeout=120):
+        self.url = url.rstrip("/")
+        self.wait_llm = wait_llm
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies = {"plan": [], "llm_first_meal": [], "llm_done": []}
+        self.errors = Counter()
+        self.llm_jobs = Counter()
+
+    def _session(self):
+        # one keep-alive session per driver thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _record(self, stage, seconds):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def _error(self, kind):
+        with self._lock:
+            self.errors[kind] += 1
+
+    def restock(self, path):
+        with open(path, "r") as f:
+            fridge = json.load(f)
+        form = {"action": "save_fridge", **{f"fridge_{ingredient}": amount for ingredient, amount in fridge.items()}}
+        self._session().post(self.url + "/", data=form, timeout=self.timeout).raise_for_status()
+
+    def plan(self, form):
+        start = time.perf_counter()
+        try:
+            response = self._session().post(self.url + "/", data=form, timeout=self.timeout)
+        except requests.RequestException as e:
+            return self._error(type(e).__name__)
+        if response.status_code != 200:
+            return self._error(f"HTTP {response.status_code}")
+        self._record("plan", time.perf_counter() - start)
+
+        stream_url = self._stream_url(response.text)
+        if self.wait_llm and stream_url:
+            self._follow(stream_url, start)
+
+    def _stream_url(self, page):
+        marker = 'data-stream-url="'
+        at = page.find(marker)
+        if at < 0:
+            return None
+        return page[at + len(marker):page.index('"', at + len(marker))]
+
+    def _follow(self, stream_url, start):
+        # read the job's server-sent events until "done"
+        first, status, event = True, None, None
+        try:
+            with self._session().get(self.url + stream_url, stream=True, timeout=self.timeout) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:") and event == "meal" and first:
+                        first = False
+                        self._record("llm_first_meal", time.perf_counter() - start)
+                    elif line.startswith("data:") and event == "done":
+                        status = json.loads(line[5:]).get("status")
+                        break
+        except requests.RequestException as e:
+            return self._error(f"stream {type(e).__name__}")
+        self._record("llm_done", time.perf_counter() - start)
+        with self._lock:
+            self.llm_jobs[status or "incomplete"] += 1
+
+    def run(self, count, concurrency, seed):
+        rng = random.Random(seed)
+        forms = [_random_form(rng) for _ in range(count)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.plan, forms))
+        return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test plan_meals on a running app.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--wait-llm", action="store_true", help="follow each LLM job to the end")
+    parser.add_argument("--restock", help="fridge JSON to save in the app before the run")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="where to save the results (JSON)")
+    args = parser.parse_args(argv)
+
+    test = LoadTest(args.url, args.wait_llm, args.timeout)
+    if args.restock:
+        test.restock(args.restock)
+    print(f"Sending {args.requests} plan requests, {args.concurrency} at a time, to {args.url}...")
+    wall = test.run(args.requests, args.concurrency, args.seed)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "url": args.url,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "wall_s": wall,
+        "errors": dict(test.errors),
+        "llm_jobs": dict(test.llm_jobs),
+        "results": {stage: _summary(latencies, wall) for stage, latencies in test.latencies.items()}
+    }
+    print(f"  {len(test.latencies['plan'])} plans in {wall:.2f} s, errors: {dict(test.errors) or 'none'}")
+    for stage, stats in report["results"].items():
+        if stats["count"]:
+            print(f"  {stage:<15} n {stats['count']:5}  p50 {stats['p50_ms']:8.1f} ms  p90 {stats['p90_ms']:8.1f} ms  "
+                  f"p99 {stats['p99_ms']:8.1f} ms  {stats['throughput_per_s']:7.1f}/s")
+    if test.llm_jobs:
+        print(f"  LLM jobs: {dict(test.llm_jobs)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Results saved to", args.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
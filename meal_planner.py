@@ -3,11 +3,34 @@
 import os
 import time
 import json
-from collections import defaultdict
-from cbr_retrieval import load_recipes, rank_recipes
-from llm import call_llm_for_meal_completion
+import threading
+from contextlib import contextmanager
+from collections import defaultdict, OrderedDict, Counter
+import numpy as np
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from cbr_retrieval import adjust_serving_sizes
+import llm
+from llm import call_llm_for_meal_completion, stream_llm_meal_completion
+from llm_flight import SingleFlightClient
+from llm_client import LLMUnavailable
+from rank_cache import RankCache, MemoryRankBackend, RedisRankBackend
+from fridge_store import FileFridgeStore, RedisFridgeStore, FRIDGE_USER
+from llm_cache import CompletionCache, DiskCompletionBackend, LLM_CACHE_SIZE, LLM_CACHE_TTL
 
 REDIS_URL = os.environ.get("REDIS_URL")
+# "greedy" keeps ranked recipes in score order while they fit the fridge; "optimize" searches
+# for the best set of recipes the fridge can cover together (see optimize_meals)
+PLANNER_MODE = os.environ.get("PLANNER_MODE", "greedy")
+PLANNER_TIME_BUDGET = float(os.environ.get("PLANNER_TIME_BUDGET", 0.25)) # seconds the optimizing planner may search
+# when set, ranking only scores this many recipes nearest to the per-meal targets (approximate, for big catalogs)
+NEAREST_CANDIDATES = int(os.environ.get("NEAREST_CANDIDATES", 0)) or None
+FRIDGE_COMMIT_ATTEMPTS = int(os.environ.get("FRIDGE_COMMIT_ATTEMPTS", 5)) # plans tried before a conflicting fridge write wins anyway
+PLAN_STATE_LIMIT = int(os.environ.get("PLAN_STATE_LIMIT", 64)) # last greedy plans kept for incremental replanning
+# start the LLM completion while recipes are ranked when the fridge looks too small for the plan
+LLM_SPECULATE = os.environ.get("LLM_SPECULATE", "0") != "0"
+LLM_SPECULATE_WORKERS = int(os.environ.get("LLM_SPECULATE_WORKERS", 4)) # speculative LLM calls running at once
+PREDICT_SAMPLE = 20 # covered recipes per planned meal the shortfall prediction looks at
 _redis_client = None
 if REDIS_URL:
     try:
@@ -17,46 +40,127 @@ if REDIS_URL:
         print("Redis unavailable, falling back to file storage:", e)
         _redis_client = None
 
-def _load_default_fridge():
-    with open("data/default_fridge.json", "r") as f:
-        return json.load(f)
+# memoized rank_recipes, shared across workers when Redis is configured
+rank_cache = RankCache(RedisRankBackend(_redis_client) if _redis_client else MemoryRankBackend())
+
+# identical LLM requests from several workers are made by one of them, coordinated in Redis
+if _redis_client and isinstance(llm.llm_client, SingleFlightClient):
+    llm.llm_client.redis = _redis_client
+
+# LLM meal completions by (bucketed) planning inputs, in Redis or on disk; LLM_CACHE=0 turns it off
+if os.environ.get("LLM_CACHE", "1") == "0":
+    llm_cache = CompletionCache(None)
+elif _redis_client:
+    llm_cache = CompletionCache(RedisRankBackend(_redis_client, max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, prefix="llmcache"))
+else:
+    llm_cache = CompletionCache(DiskCompletionBackend())
+
+# last greedy plan per user and preferences (see PlanState), oldest dropped first. This is
+# per process: with PLAN_WORKERS > 0 each worker keeps its own, and a request only reuses
+# a plan if it lands on the worker that made the previous one (about 1 in PLAN_WORKERS)
+_plan_states = OrderedDict()
+_plan_states_lock = threading.Lock()
 
 # Fridge Management
 # def load_fridge(path="data/fridge.json"):
 #     with open(path, "r") as f:
 #         return json.load(f)
-def load_fridge(path="data/fridge.json"):
-    if _redis_client:
-        data = _redis_client.get("fridge")
-        if data:
-            try:
-                return json.loads(data)
-            except json.JSONDecodeError:
-                pass
-        # Initialize if missing or invalid
-        fridge = _load_default_fridge()
-        save_fridge(fridge, path)
-        return fridge
-    # File fallback (local dev)
-    try:
-        with open(path, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        fridge = _load_default_fridge()
-        save_fridge(fridge, path)
-        return fridge
-
-def save_fridge(fridge, path="data/fridge.json"):
-    if _redis_client:
-        _redis_client.set("fridge", json.dumps(fridge))
-        # Optional: debug print
-        print("Fridge saved to Redis. Size:", len(json.dumps(fridge)))
-        return
-    # File fallback (local dev)
-    with open(path, "w") as f:
-        json.dump(fridge, f, indent=2)
-    with open(path, "r") as f:
-        print("File contents after save:", f.read())
+def _fridge_store(path):
+    # a Redis hash per user when Redis is configured, otherwise a JSON file per user
+    return RedisFridgeStore(_redis_client) if _redis_client else FileFridgeStore(path)
+
+def load_fridge(path="data/fridge.json", user=None):
+    with metrics.timed("load_fridge"):
+        return _fridge_store(path).load(user)
+
+def save_fridge(fridge, path="data/fridge.json", user=None):
+    metrics.inc("fridge_writes")
+    with metrics.timed("save_fridge"):
+        _fridge_store(path).save(fridge, user)
+
+def consume_fridge(used, path="data/fridge.json", user=None):
+    # subtract used amounts (ingredient -> amount) from the stored fridge, clamped at 0
+    metrics.inc("fridge_writes")
+    with metrics.timed("save_fridge"):
+        _fridge_store(path).consume(used, user)
+
+def load_fridge_versioned(path="data/fridge.json", user=None):
+    # (fridge, version) for commit_fridge
+    with metrics.timed("load_fridge"):
+        return _fridge_store(path).load_versioned(user)
+
+def commit_fridge(used, version, path="data/fridge.json", user=None):
+    # consume_fridge, but only if the fridge is unchanged since it was loaded as `version`
+    metrics.inc("fridge_writes")
+    with metrics.timed("save_fridge"):
+        return _fridge_store(path).commit(used, version, user)
+
+class FridgeSession:
+    # One request's unit of work on the fridge. It is loaded once. The CBR plan and
+    # the LLM meals consume from session.fridge and are recorded as steps, and
+    # commit() writes the request's total usage in one compare-and-set. If another
+    # request wrote the fridge meanwhile and the fresh fridge still covers that usage,
+    # the same usage is committed on top of it. Otherwise the recorded steps are
+    # replayed on the fresh fridge: the plan is redone and the LLM meals are consumed
+    # again. Read plan_result after commit() for the plan that was actually stored.
+    def __init__(self, path="data/fridge.json", user=None):
+        self.path = path
+        self.user = user
+        self.fridge, self._version = load_fridge_versioned(path, user)
+        self._base = dict(self.fridge)
+        self._steps = []
+        self.plan_result = None
+
+    def plan(self, plan):
+        # plan(fridge) consumes from the session fridge in place
+        self._steps.append(("plan", plan))
+        self.plan_result = plan(self.fridge)
+        return self.plan_result
+
+    def use(self, ingredients):
+        # use_ingredients for one meal outside the plan (an LLM meal)
+        self._steps.append(("use", dict(ingredients)))
+        use_ingredients(ingredients, self.fridge)
+
+    @contextmanager
+    def step(self):
+        # everything recorded inside the block is undone if it raises
+        fridge, steps = dict(self.fridge), len(self._steps)
+        try:
+            yield self
+        except BaseException:
+            self._reset(fridge)
+            del self._steps[steps:]
+            raise
+
+    def _reset(self, fridge):
+        # in place, so references to session.fridge stay valid
+        self.fridge.clear()
+        self.fridge.update(fridge)
+
+    def commit(self):
+        for attempt in range(FRIDGE_COMMIT_ATTEMPTS):
+            used = fridge_usage(self._base, self.fridge)
+            if not used or commit_fridge(used, self._version, self.path, self.user):
+                return self.fridge
+            metrics.inc("fridge_conflicts")
+            fresh, self._version = load_fridge_versioned(self.path, self.user)
+            self._base = dict(fresh)
+            if fresh.keys() == self.fridge.keys() and all(fresh[i] >= amount for i, amount in used.items()):
+                self._reset({i: fresh[i] - used.get(i, 0) for i in fresh}) # the stored plan still fits
+                continue
+            steps, self._steps = self._steps, []
+            self._reset(fresh)
+            for kind, step in steps:
+                self.plan(step) if kind == "plan" else self.use(step)
+        print(f"Fridge still changing after {FRIDGE_COMMIT_ATTEMPTS} attempts, applying this request's usage as is")
+        consume_fridge(fridge_usage(self._base, self.fridge), self.path, self.user)
+        return self.fridge
+
+def fridge_usage(before, after):
+    # what was taken out of `before` to leave `after` (ingredient -> amount)
+    return {ingredient: before[ingredient] - after.get(ingredient, 0)
+            for ingredient in before if after.get(ingredient, 0) != before[ingredient]}
 
 # Ingredient Checking
 def has_enough_ingredients(adjusted_ingredients, fridge):
@@ -80,8 +184,278 @@ def calculate_missing_ingredients(adjusted_ingredients, fridge):
             missing[ingredient] = required_amount - available
     return missing
 
+# Vectorized selection
+def _candidate_entries(top_matches, fridge):
+    # the matches' scaled ingredients flattened into (row, column, amount) entries over
+    # their own ingredient vocabulary, plus the fridge as presence/stock vectors on it
+    columns = {} # ingredient -> column
+    rows, cols, amounts = [], [], []
+    for r, match in enumerate(top_matches):
+        for ingredient, amount in match["adjusted_recipe"]["ingredients"].items():
+            rows.append(r)
+            cols.append(columns.setdefault(ingredient, len(columns)))
+            amounts.append(amount)
+    names = list(columns)
+    rows = np.array(rows, dtype=np.intp)
+    starts = np.searchsorted(rows, np.arange(len(top_matches) + 1)) # entries of match r: starts[r]:starts[r + 1]
+    present = np.array([name in fridge for name in names], dtype=bool)
+    stock = np.array([fridge.get(name, 0) for name in names], dtype=float)
+    return names, rows, np.array(cols, dtype=np.intp), np.array(amounts, dtype=float), starts, present, stock
+
+
+def _planned_meal(match):
+    adjusted = match["adjusted_recipe"]
+    return {
+        "meal_title": adjusted["title"],
+        "ingredients": adjusted["ingredients"],
+        "estimated_nutrition": adjusted["adjusted_macros"]
+    }
+
+
+def _write_back(fridge, names, stock, touched):
+    # copy consumed stock back into the fridge dict, with use_ingredients' clamp to 0
+    for col in np.flatnonzero(touched):
+        fridge[names[col]] = float(stock[col]) if stock[col] > 0 else 0
+
+
+def _missing_totals(names, missing_cols, missing_amounts):
+    # totals summed in the order the one-by-one loop would add them, keyed in first-seen order
+    missing_ingredients_list = defaultdict(float)
+    if missing_cols:
+        missing_cols = np.concatenate(missing_cols)
+        totals = np.bincount(missing_cols, weights=np.concatenate(missing_amounts), minlength=len(names))
+        _, first_seen = np.unique(missing_cols, return_index=True)
+        for col in missing_cols[np.sort(first_seen)]:
+            missing_ingredients_list[names[col]] = float(totals[col])
+    return missing_ingredients_list
+
+
+def _greedy_pass(entries, stock, position):
+    # the greedy loop from match `position` on, consuming from stock in place. Returns
+    # which matches (from position on) were chosen and the shortfall entries of the
+    # others as (row, column, amount) arrays, in the order the loop meets them.
+    names, rows, cols, amounts, starts, present, _ = entries
+    count = len(starts) - 1
+
+    def rows_with(flags):
+        # per match: does any of its entries have the flag set
+        running = np.concatenate(([0], np.cumsum(flags)))
+        return running[starts[1:]] > running[starts[:-1]]
+
+    feasible = ~rows_with(~present[cols] | (stock[cols] < amounts))
+    chosen = np.zeros(count, dtype=bool)
+    missing = []
+    while position < count:
+        # next match the current fridge covers; everything before it is pending
+        ahead = np.flatnonzero(feasible[position:])
+        pick = position + ahead[0] if len(ahead) else count
+
+        if pick > position:
+            block = slice(starts[position], starts[pick])
+            available = np.where(present, stock, 0)[cols[block]]
+            short = available < amounts[block]
+            missing.append((rows[block][short], cols[block][short], amounts[block][short] - available[short]))
+        if pick == count:
+            break
+
+        chosen[pick] = True
+        used = slice(starts[pick], starts[pick + 1])
+        used_cols = cols[used]
+        stock[used_cols] = np.maximum(stock[used_cols] - amounts[used], 0)
+
+        # stock only went down on used_cols: re-check the later entries on those columns
+        later = slice(starts[pick + 1], len(cols))
+        recheck = np.isin(cols[later], used_cols)
+        short = np.zeros(len(cols), dtype=bool)
+        short[later][recheck] = stock[cols[later][recheck]] < amounts[later][recheck]
+        feasible &= ~rows_with(short)
+        position = pick + 1
+
+    if not missing:
+        return chosen, np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([])
+    missing_rows, missing_cols, missing_amounts = (np.concatenate(part) for part in zip(*missing))
+    return chosen, missing_rows, missing_cols, missing_amounts
+
+
+class PlanState:
+    # What a greedy plan was derived from: the catalog version, the fridge it started
+    # from, the ranked matches and their entries, which matches were chosen and the
+    # shortfall entries of the others. Enough to redo only the part of the plan that a
+    # small fridge edit can change (see replan_meals). Never mutated once built.
+    def __init__(self, version, fridge, top_matches, entries, chosen, missing):
+        self.version = version
+        self.fridge = fridge
+        self.top_matches = top_matches
+        self.entries = entries
+        self.chosen = chosen
+        self.missing = missing # (rows, cols, amounts)
+
+    def reusable_for(self, version, fridge):
+        # the ranking only depends on the catalog and on which ingredients are in the fridge
+        return self.version == version and self.fridge.keys() == fridge.keys()
+
+    def plan(self):
+        names = self.entries[0]
+        return (
+            [_planned_meal(self.top_matches[i]) for i in np.flatnonzero(self.chosen)],
+            [self.top_matches[i] for i in np.flatnonzero(~self.chosen)],
+            _missing_totals(names, [self.missing[1]], [self.missing[2]])
+        )
+
+
+def _plan_key(preferences, user=None):
+    # plans are only reused for the same user's fridge
+    key = {k: v for k, v in preferences.items() if k != "planner"}
+    return json.dumps([user or FRIDGE_USER, key], sort_keys=True, default=str)
+
+
+def _greedy_state(version, top_matches, fridge):
+    # Greedy pass over the ranked matches, same result as checking them one by one
+    # with has_enough_ingredients / use_ingredients / calculate_missing_ingredients:
+    # a match is selected if the fridge (as it is after the earlier selections) covers
+    # it, otherwise it goes to pending and its shortfall is added to the missing totals.
+    # Every remaining match is checked in one array comparison and, after a selection,
+    # only entries on the ingredients it consumed are re-checked. Returns the PlanState
+    # replan_meals needs (its plan() is the result). Updates fridge in place.
+    start = dict(fridge)
+    entries = _candidate_entries(top_matches, fridge)
+    names, rows, cols, amounts, starts, present, stock = entries
+    chosen, missing_rows, missing_cols, missing_amounts = _greedy_pass(entries, stock, 0)
+    _write_back(fridge, names, stock, np.isin(np.arange(len(names)), cols[chosen[rows]]))
+    return PlanState(version, start, top_matches, entries, chosen, (missing_rows, missing_cols, missing_amounts))
+
+
+def replan_meals(state, fridge):
+    # Greedy plan for a fridge that differs from state.fridge only in quantities, reusing
+    # its ranking. The decisions for the matches before the first one that uses a changed
+    # ingredient can't change, so they are kept as they are and the greedy pass restarts
+    # from there, with the new stock minus what the kept selections consume. Returns the
+    # new PlanState and the position it restarted from; updates fridge in place.
+    start = dict(fridge)
+    names, rows, cols, amounts, starts, _, _ = state.entries
+    count = len(starts) - 1
+    present = np.array([name in fridge for name in names], dtype=bool)
+    stock = np.array([fridge.get(name, 0) for name in names], dtype=float)
+    changed = np.array([fridge.get(name) != state.fridge.get(name) for name in names], dtype=bool)
+    affected = rows[changed[cols]]
+    position = int(affected.min()) if len(affected) else count
+
+    # kept selections never run a column below zero, so in-order subtraction matches use_ingredients
+    chosen = state.chosen.copy()
+    chosen[position:] = False
+    kept = chosen[rows]
+    np.subtract.at(stock, cols[kept], amounts[kept])
+
+    entries = (names, rows, cols, amounts, starts, present, stock)
+    redone, missing_rows, missing_cols, missing_amounts = _greedy_pass(entries, stock, position)
+    chosen[position:] = redone[position:]
+    _write_back(fridge, names, stock, np.isin(np.arange(len(names)), cols[chosen[rows]]))
+
+    old_rows, old_cols, old_amounts = state.missing
+    before = old_rows < position
+    missing = (
+        np.concatenate((old_rows[before], missing_rows)),
+        np.concatenate((old_cols[before], missing_cols)),
+        np.concatenate((old_amounts[before], missing_amounts))
+    )
+    return PlanState(state.version, start, state.top_matches, entries, chosen, missing), position
+
+
+def optimize_meals(top_matches, fridge, meals_needed, time_budget=None):
+    # Alternative to the greedy plan (_greedy_state): picks up to meals_needed matches that the fridge can
+    # cover together, maximizing the number of meals first and their total score second.
+    # Depth-first branch and bound over the matches in score order, seeded with the
+    # greedy plan. It is anytime: when time_budget (seconds) runs out it returns the
+    # best plan found so far. Same return values as PlanState.plan(); updates fridge in place.
+    time_budget = PLANNER_TIME_BUDGET if time_budget is None else time_budget
+    deadline = time.perf_counter() + time_budget
+    names, rows, cols, amounts, starts, present, stock = _candidate_entries(top_matches, fridge)
+    count = len(top_matches)
+    need = np.zeros((count, len(names)))
+    need[rows, cols] = amounts
+    uses = np.zeros((count, len(names)), dtype=bool)
+    uses[rows, cols] = True
+    scores = np.array([float(m["final_score"]) for m in top_matches])
+
+    # stock only goes down, so a match the full fridge can't cover is never part of a plan
+    possible = ~(uses & ~present).any(axis=1) & (need <= stock).all(axis=1)
+    items = np.flatnonzero(possible)
+    items = items[np.argsort(-scores[items], kind="stable")]
+
+    # greedy plan as the first incumbent
+    best, best_score, left = [], 0.0, stock.copy()
+    for i in items:
+        if len(best) == meals_needed:
+            break
+        if (need[i] <= left).all():
+            best.append(i)
+            best_score += scores[i]
+            left -= need[i]
+
+    # each node: matches still open (best first), stock left, matches taken, their score
+    stack = [(items, stock, [], 0.0)]
+    nodes = 0
+    timed_out = False
+    while stack:
+        nodes += 1
+        if nodes % 64 == 0 and time.perf_counter() > deadline:
+            timed_out = True
+            break
+        candidates, left, taken, score = stack.pop()
+        if (len(taken), score) > (len(best), best_score):
+            best, best_score = taken, score
+        open_slots = meals_needed - len(taken)
+        if open_slots == 0 or len(candidates) == 0:
+            continue
+        candidates = candidates[(need[candidates] <= left).all(axis=1)]
+        # bound: the best open_slots of the matches that still fit, as if they fit together
+        top = candidates[:open_slots]
+        if (len(taken) + len(top), score + scores[top].sum()) <= (len(best), best_score):
+            continue
+        first, rest = candidates[0], candidates[1:]
+        stack.append((rest, left, taken, score)) # without first
+        stack.append((rest, left - need[first], taken + [first], score + scores[first])) # with first, explored next
+    if timed_out:
+        metrics.inc("planner_timeouts")
+
+    chosen = np.zeros(count, dtype=bool)
+    chosen[best] = True
+    selected_meals = [_planned_meal(top_matches[i]) for i in np.flatnonzero(chosen)]
+    stock = np.maximum(stock - need[chosen].sum(axis=0), 0)
+    _write_back(fridge, names, stock, uses[chosen].any(axis=0))
+
+    # everything not chosen is pending, with its shortfall against the fridge that's left
+    pending_meals = [top_matches[i] for i in np.flatnonzero(~chosen)]
+    pending_entries = ~chosen[rows]
+    available = np.where(present, stock, 0)[cols]
+    short = pending_entries & (available < amounts)
+    missing_ingredients_list = _missing_totals(names, [cols[short]], [amounts[short] - available[short]])
+    return selected_meals, pending_meals, missing_ingredients_list
+
 # Meal Planning
-def build_meal_plan(recipes, fridge, preferences):
+def _plan_changes(previous, selected_meals, missing_ingredients, reused, position):
+    # what changed since the last plan for this user and these preferences, None when there was none
+    if previous is None:
+        return None
+    old_selected, _, old_missing = previous.plan()
+    before = Counter(meal["meal_title"] for meal in old_selected)
+    after = Counter(meal["meal_title"] for meal in selected_meals)
+    missing = {
+        ingredient: missing_ingredients.get(ingredient, 0) - old_missing.get(ingredient, 0)
+        for ingredient in list(old_missing) + [i for i in missing_ingredients if i not in old_missing]
+        if missing_ingredients.get(ingredient, 0) != old_missing.get(ingredient, 0)
+    }
+    return {
+        "reused_ranking": reused,
+        "replanned_from": position, # first match whose decision was redone (incremental replans only)
+        "added_meals": list((after - before).elements()),
+        "removed_meals": list((before - after).elements()),
+        "missing_changes": missing # ingredient -> change in missing amount
+    }
+
+
+def build_meal_plan(recipes, fridge, preferences, return_changes=False, user=None):
+    # user: whose fridge this is, so incremental replans and plan changes stay per user
     days = preferences["days"] # number of days # for example, 3 days
     meals_per_day = preferences["meals_per_day"] # number of meals per day # for example, 2 meals per day
     total_meals = days * meals_per_day # total number of meals # for example, 3 days * 2 meals per day = 6 meals
@@ -98,61 +472,249 @@ def build_meal_plan(recipes, fridge, preferences):
     # with all the information, we can now rank the recipes
     # we will use the rank_recipes function to rank the recipes
 
-    top_matches = rank_recipes(
-        recipes, # we will use the database of recipes to retrieve the relevant recipes
-        user_ingredients, # we will use the user_ingredients parameter to target the ingredients in the fridge
-        target_macros_per_meal, # we will use the target_macros_per_meal parameter to target the macros per meal
-        target_calories_per_meal, # we will use the target_calories_per_meal parameter to target the calories per meal
-        priority, # we will use the priority parameter to prioritize the recipes
-        top_k=total_meals * 3 # we will use the top_k parameter to limit the number of recipes to return
-    )
+    # a greedy plan for the same preferences and fridge ingredients can reuse the last
+    # ranking and redo only what the changed quantities touch (see replan_meals)
+    key = _plan_key(preferences, user)
+    version = getattr(recipes, "version", None)
+    greedy = preferences.get("planner", PLANNER_MODE) != "optimize"
+    with _plan_states_lock:
+        previous = _plan_states.get(key)
+    reused = greedy and version is not None and previous is not None and previous.reusable_for(version, fridge)
+    position = None
 
-    selected_meals = []
-    pending_meals = []
-    missing_ingredients_list = defaultdict(float)
+    if reused:
+        with metrics.timed("select_meals"):
+            state, position = replan_meals(previous, fridge)
+        metrics.inc("incremental_replans")
+        selected_meals, pending_meals, missing_ingredients_list = state.plan()
+    else:
+        with metrics.timed("rank_recipes"):
+            top_matches = rank_cache.rank(
+                recipes, # we will use the database of recipes to retrieve the relevant recipes
+                user_ingredients, # we will use the user_ingredients parameter to target the ingredients in the fridge
+                target_macros_per_meal, # we will use the target_macros_per_meal parameter to target the macros per meal
+                target_calories_per_meal, # we will use the target_calories_per_meal parameter to target the calories per meal
+                priority, # we will use the priority parameter to prioritize the recipes
+                top_k=total_meals * 3, # we will use the top_k parameter to limit the number of recipes to return
+                threshold=True, # skip recipes without fridge ingredients when they cannot make the top_k (same result, less work)
+                nearest=NEAREST_CANDIDATES
+            )
+        with metrics.timed("select_meals"):
+            if greedy:
+                state = _greedy_state(version, top_matches, fridge)
+                selected_meals, pending_meals, missing_ingredients_list = state.plan()
+            else:
+                state = None
+                selected_meals, pending_meals, missing_ingredients_list = optimize_meals(top_matches, fridge, total_meals)
 
-    for match in top_matches:
-        adjusted = match["adjusted_recipe"]
-
-        if has_enough_ingredients(adjusted["ingredients"], fridge):
-            selected_meals.append({
-                "meal_title": adjusted["title"],
-                "ingredients": adjusted["ingredients"],
-                "estimated_nutrition": adjusted["adjusted_macros"]
-            })
-            use_ingredients(adjusted["ingredients"], fridge)
-        else:
-            pending_meals.append(match)
-            missing = calculate_missing_ingredients(adjusted["ingredients"], fridge)
-            for ing, amount in missing.items():
-                missing_ingredients_list[ing] += amount
+    if state is not None and version is not None:
+        with _plan_states_lock:
+            _plan_states[key] = state
+            _plan_states.move_to_end(key)
+            while len(_plan_states) > PLAN_STATE_LIMIT:
+                _plan_states.popitem(last=False)
 
+    if return_changes:
+        changes = _plan_changes(previous, selected_meals, missing_ingredients_list, reused, position)
+        return selected_meals, pending_meals, missing_ingredients_list, changes
     return selected_meals, pending_meals, missing_ingredients_list
 
 # LLM xtension 
-def complete_meal_plan_with_llm(preferences, fridge, selected_meals, missing_ingredients, meals_needed):
-    llm_response = call_llm_for_meal_completion(
+def complete_meal_plan_with_llm(preferences, fridge, selected_meals, missing_ingredients, meals_needed, session=None):
+    # with a FridgeSession the proposed meals are only recorded in it (fridge should be
+    # session.fridge) and written by session.commit(); without one they are written here
+    # parsed and validated, from the completion cache when a close enough request was answered before
+    proposed_meals = llm_cache.complete(
+        call_llm_for_meal_completion,
         preferences,
         fridge,
         selected_meals,
         missing_ingredients,
         meals_needed
     )
-    
-    if not llm_response:
-        return []
 
-    try:
-        proposed_meals = json.loads(llm_response)
+    if not proposed_meals:
+        return []
 
-        # ---- NEW: burn ingredients ----
+    # ---- NEW: burn ingredients ----
+    if session is not None:
+        with session.step(): # undone as a whole if anything in it fails
+            for meal in proposed_meals:
+                session.use(meal["ingredients"])
+    else:
+        before = dict(fridge)
         for meal in proposed_meals:
             use_ingredients(meal["ingredients"], fridge)
-        save_fridge(fridge)
-        # --------------------------------
+        consume_fridge(fridge_usage(before, fridge))
+    # --------------------------------
+
+    return proposed_meals
 
-        return proposed_meals
 
-    except json.JSONDecodeError:
-        print("Failed to parse LLM response as JSON.")
-        return []
\ No newline at end of file
+def stream_meal_plan_with_llm(preferences, fridge, selected_meals, missing_ingredients, meals_needed, session=None):
+    # complete_meal_plan_with_llm for a streamed completion: yields each proposed meal
+    # as soon as it is parsed, consuming its ingredients as it goes (recorded in the
+    # session, or written once at the end without one)
+    before = dict(fridge)
+    started = time.perf_counter()
+    try:
+        for meal in llm_cache.stream(
+            stream_llm_meal_completion,
+            preferences,
+            fridge,
+            selected_meals,
+            missing_ingredients,
+            meals_needed
+        ):
+            if started is not None:
+                metrics.observe("llm_first_meal", time.perf_counter() - started)
+                started = None
+            if session is not None:
+                session.use(meal["ingredients"])
+            else:
+                use_ingredients(meal["ingredients"], fridge)
+            yield meal
+    except LLMUnavailable as e:
+        # the meals that already arrived stand; the plan just gets fewer of them
+        print("Error contacting LLM:", e)
+    finally:
+        used = fridge_usage(before, fridge)
+        if session is None and used:
+            consume_fridge(used)
+
+
+# Speculative completion
+_speculation_pool = ThreadPoolExecutor(max_workers=LLM_SPECULATE_WORKERS, thread_name_prefix="llm-speculate")
+
+def predict_shortfall(recipes, fridge, preferences):
+    # How many meals the CBR plan will probably be short, estimated before any ranking:
+    # recipes made only of stocked ingredients, scaled to the per-meal target and taken
+    # greedily while the fridge covers them, are what the fridge can fill. It can only
+    # be optimistic (the plan picks from the best-ranked recipes, not from all of them),
+    # so a predicted shortfall is usually real.
+    total_meals = preferences["days"] * preferences["meals_per_day"]
+    meals_per_day = preferences["meals_per_day"]
+    stocked = [ingredient for ingredient, amount in fridge.items() if amount > 0]
+    rows, shared = recipes.overlap_counts(stocked)
+    covered = rows[shared == recipes.ingredient_counts[rows]][:total_meals * PREDICT_SAMPLE]
+    adjusted = adjust_serving_sizes(
+        recipes, covered,
+        {macro: amount / meals_per_day for macro, amount in preferences["target_macros_per_day"].items()},
+        preferences["target_calories_per_day"] / meals_per_day,
+        preferences["priority"]
+    )
+
+    stock = dict(fridge)
+    filled = 0
+    for recipe in adjusted:
+        if "error" not in recipe and has_enough_ingredients(recipe["ingredients"], stock):
+            use_ingredients(recipe["ingredients"], stock)
+            filled += 1
+            if filled == total_meals:
+                break
+    return total_meals - filled
+
+
+class Speculation:
+    # An LLM completion started before the CBR plan, on the fridge as loaded, for the
+    # predicted shortfall, so the LLM works while recipes are ranked. Its meals are
+    # streamed into a list here; reconcile_speculation() takes what still fits the
+    # fridge the plan left, cancel() drops it (its stream is closed at the next meal).
+    def __init__(self, preferences, fridge, meals_needed):
+        self.meals_needed = meals_needed
+        self._meals = []
+        self._done = False
+        self._cancelled = threading.Event()
+        self._changed = threading.Condition()
+        metrics.inc("llm_speculations")
+        self._future = _speculation_pool.submit(self._run, preferences, dict(fridge), meals_needed)
+
+    def _run(self, preferences, fridge, meals_needed):
+        stream = llm_cache.stream(stream_llm_meal_completion, preferences, fridge, [], {}, meals_needed)
+        try:
+            for meal in stream:
+                if self._cancelled.is_set():
+                    break
+                with self._changed:
+                    self._meals.append(meal)
+                    self._changed.notify_all()
+        except Exception as e:
+            print("Speculative LLM completion failed:", e)
+        finally:
+            stream.close()
+            self._finish()
+
+    def _finish(self):
+        with self._changed:
+            self._done = True
+            self._changed.notify_all()
+
+    def close(self):
+        # stop taking meals; returns whether it was still running
+        with self._changed:
+            if self._done or self._cancelled.is_set():
+                return False
+            self._cancelled.set()
+        if self._future.cancel(): # never started
+            self._finish()
+        return True
+
+    def cancel(self):
+        # the plan turned out complete: the completion is not needed at all
+        if self.close():
+            metrics.inc("llm_speculations_cancelled")
+
+    def meals(self):
+        # the speculative meals as they arrive, until the completion ends or is cancelled
+        seen = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(self._meals) > seen or self._done)
+                meals, done = self._meals[seen:], self._done
+            yield from meals
+            seen += len(meals)
+            if done and seen == len(self._meals):
+                return
+
+
+def speculate_llm_meals(recipes, fridge, preferences):
+    # a Speculation when a shortfall is predicted, else None
+    with metrics.timed("predict_shortfall"):
+        shortfall = predict_shortfall(recipes, fridge, preferences)
+    return Speculation(preferences, fridge, shortfall) if shortfall > 0 else None
+
+
+def _fits(ingredients, fridge):
+    # enough of every ingredient the fridge has; others are skipped, as use_ingredients does
+    return all(fridge[ingredient] >= amount for ingredient, amount in ingredients.items() if ingredient in fridge)
+
+
+def reconcile_speculation(speculation, preferences, fridge, selected_meals, missing_ingredients, meals_needed, session=None):
+    # stream_meal_plan_with_llm for a plan that had a Speculation: its meals that still
+    # fit the fridge after the CBR plan are used (consumed the same way) up to
+    # meals_needed, and the rest, if any, comes from a regular completion on that fridge
+    before = dict(fridge)
+    accepted = []
+    try:
+        for meal in speculation.meals():
+            if not _fits(meal["ingredients"], fridge):
+                metrics.inc("llm_speculative_rejected")
+                continue
+            if session is not None:
+                session.use(meal["ingredients"])
+            else:
+                use_ingredients(meal["ingredients"], fridge)
+            accepted.append(meal)
+            yield meal
+            if len(accepted) == meals_needed:
+                break
+    finally:
+        speculation.close()
+        metrics.inc("llm_speculative_meals", len(accepted))
+        used = fridge_usage(before, fridge)
+        if session is None and used:
+            consume_fridge(used)
+
+    if len(accepted) < meals_needed:
+        yield from stream_meal_plan_with_llm(preferences, fridge, selected_meals + accepted, missing_ingredients,
+                                             meals_needed - len(accepted), session=session)
@@ -0,0 +1,146 @@
+# metrics.py
+#
+# Per-stage timing histograms and counters for the planning pipeline, exposed in
+# Prometheus text format by app.py's /metrics route. Set METRICS_ENABLED=0 to turn
+# them off; timed() then hands back a shared no-op context manager and inc() returns
+# right away, so the hooks cost a function call.
+#
+#   with metrics.timed("rank_recipes"):
+#       ...
+#   metrics.inc("llm_calls")
+#   metrics.observe("llm_prompt_tokens", tokens) # a size histogram, see SIZE_BUCKETS
+#
+# Metrics are per process: with several workers each one reports its own. Planning
+# pool workers send theirs back with each plan, so they count in the process that
+# asked (see planning_pool.py).
+
+import os
+import time
+import threading
+from contextlib import nullcontext
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+# upper bounds in seconds, from a cached ranking to a slow LLM round trip
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# histograms of sizes rather than stage timings, with their own upper bounds; each is
+# rendered as its own cheffie_<name> histogram
+SIZE_BUCKETS = {
+    "llm_prompt_tokens": (100, 200, 300, 400, 500, 750, 1000, 1250, 1500, 2000, 3000, 5000),
+}
+
+_NOOP = nullcontext()
+_lock = threading.Lock()
+_histograms = {} # stage -> [bucket counts..., +Inf count], sum
+_counters = {} # name -> value
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timed(stage):
+    # context manager recording how long the block took under the given stage
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Timer(stage)
+
+
+def observe(stage, seconds):
+    # seconds spent in a stage, or a size for the histograms in SIZE_BUCKETS
+    if not METRICS_ENABLED:
+        return
+    bounds = SIZE_BUCKETS.get(stage, BUCKETS)
+    with _lock:
+        entry = _histograms.get(stage)
+        if entry is None:
+            entry = _histograms[stage] = [[0] * (len(bounds) + 1), 0.0]
+        counts = entry[0]
+        for i, bound in enumerate(bounds):
+            if seconds <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        entry[1] += seconds
+
+
+def inc(name, amount=1):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def snapshot():
+    # plain copy of everything recorded so far
+    with _lock:
+        return (
+            {stage: (list(counts), total) for stage, (counts, total) in _histograms.items()},
+            dict(_counters)
+        )
+
+
+def merge(histograms, counters):
+    # add what another process recorded (a snapshot() taken there), e.g. a planning worker's
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        for stage, (counts, total) in histograms.items():
+            entry = _histograms.get(stage)
+            if entry is None:
+                entry = _histograms[stage] = [[0] * (len(BUCKETS) + 1), 0.0]
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+        for name, value in counters.items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _histogram_lines(metric, labels, bounds, counts, total):
+    lines, cumulative = [], 0
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    cumulative += counts[-1]
+    lines.append(f'{metric}_bucket{{{labels}le="+Inf"}} {cumulative}')
+    labels = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{metric}_sum{labels} {total}")
+    lines.append(f"{metric}_count{labels} {cumulative}")
+    return lines
+
+
+def render():
+    # Prometheus text exposition format
+    histograms, counters = snapshot()
+    lines = []
+    stages = {stage: entry for stage, entry in histograms.items() if stage not in SIZE_BUCKETS}
+    if stages:
+        lines.append("# HELP cheffie_stage_seconds Time spent in each planning stage.")
+        lines.append("# TYPE cheffie_stage_seconds histogram")
+        for stage, (counts, total) in sorted(stages.items()):
+            lines += _histogram_lines("cheffie_stage_seconds", f'stage="{stage}",', BUCKETS, counts, total)
+    for name, (counts, total) in sorted(histograms.items()):
+        if name in SIZE_BUCKETS:
+            lines.append(f"# TYPE cheffie_{name} histogram")
+            lines += _histogram_lines(f"cheffie_{name}", "", SIZE_BUCKETS[name], counts, total)
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE cheffie_{name}_total counter")
+        lines.append(f"cheffie_{name}_total {value}")
+    return "\n".join(lines) + "\n"
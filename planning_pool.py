@@ -0,0 +1,126 @@
+# planning_pool.py
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import metrics
+import meal_planner
+from cbr_retrieval import load_recipes
+
+# worker processes for meal planning; 0 plans in the calling thread
+PLAN_WORKERS = int(os.environ.get("PLAN_WORKERS", 0))
+
+# the catalog a worker process plans against, set once per process (see _init_worker)
+_catalog = None
+
+
+def _init_worker(catalog, path):
+    # A catalog as it is on disk comes as its path and is loaded here; a compiled one
+    # is memory-mapped, so its arrays come from the one page-cached file. A catalog
+    # edited in place (add_recipes, ...) comes pickled, once per worker.
+    global _catalog
+    _catalog = catalog if catalog is not None else load_recipes(path)
+
+
+def _plan_task(plan, fridge, preferences, kwargs):
+    # runs in a worker: the plan functions update the fridge in place, so send it back,
+    # with the stage timings and counters this plan recorded
+    metrics.reset()
+    result = plan(_catalog, fridge, preferences, **kwargs)
+    return result, fridge, metrics.snapshot()
+
+
+class PlanTicket:
+    # A submitted plan. result() waits for it, copies the worker's updated fridge into
+    # the caller's fridge dict (what an in-thread plan would have done), adds the
+    # worker's metrics to this process's and returns what the plan function returned.
+    def __init__(self, future, fridge):
+        self._future = future
+        self._fridge = fridge
+        self._applied = False
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout=None):
+        result, fridge, recorded = self._future.result(timeout)
+        if not self._applied:
+            if fridge is not self._fridge:
+                self._fridge.clear()
+                self._fridge.update(fridge)
+            if recorded is not None:
+                metrics.merge(*recorded)
+        self._applied = True
+        return result
+
+
+class PlanningPool:
+    # Runs plan requests on a pool of worker processes so concurrent requests use all
+    # cores instead of taking turns on the GIL. Each worker receives the catalog once
+    # when it starts (see _init_worker), never per task. `source` is a RecipeCatalog
+    # or a CatalogSource; when the catalog is swapped or edited in place the pool is
+    # restarted so workers never plan against a stale copy. Tasks already running
+    # finish on the old workers.
+    #
+    # Workers are started with forkserver where there is one: the pool is (re)started
+    # while the app's request threads run, and a plain fork would copy whatever locks
+    # those threads held at that moment into the worker, where nobody releases them.
+    def __init__(self, source, workers=None, path=None):
+        self.source = source
+        self.workers = PLAN_WORKERS if workers is None else workers
+        self.path = path or getattr(source, "path", None) or os.environ.get("RECIPES_PATH", "data/final_clean_chef_recipes_1000.json")
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._loaded = None # (catalog, version) the current workers were started with
+
+    def _catalog(self):
+        return self.source.get() if hasattr(self.source, "get") else self.source
+
+    def _executor_for(self, catalog):
+        loaded = (catalog, getattr(catalog, "version", None))
+        with self._lock:
+            if self._executor is None or self._loaded[0] is not catalog or self._loaded[1] != loaded[1]:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                on_disk = catalog.version == getattr(self.source, "loaded_version", None)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=self._context,
+                    initializer=_init_worker,
+                    initargs=(None if on_disk else catalog, self.path)
+                )
+                self._loaded = loaded
+            return self._executor
+
+    def submit(self, fridge, preferences, plan=None, **kwargs):
+        # plan(catalog, fridge, preferences, **kwargs) defaults to meal_planner.build_meal_plan
+        # and must be a module-level function (workers receive it by name)
+        plan = plan or meal_planner.build_meal_plan
+        catalog = self._catalog()
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result((plan(catalog, fridge, preferences, **kwargs), fridge, None))
+            except Exception as e:
+                future.set_exception(e)
+            return PlanTicket(future, fridge)
+        future = self._executor_for(catalog).submit(_plan_task, plan, dict(fridge), preferences, kwargs)
+        return PlanTicket(future, fridge)
+
+    def plan(self, fridge, preferences, plan=None, **kwargs):
+        return self.submit(fridge, preferences, plan, **kwargs).result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
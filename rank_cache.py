@@ -0,0 +1,171 @@
+# rank_cache.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import metrics
+from cbr_retrieval import RecipeCatalog, rank_recipes
+
+RANK_CACHE_SIZE = int(os.environ.get("RANK_CACHE_SIZE", 512)) # max cached rankings
+RANK_CACHE_TTL = float(os.environ.get("RANK_CACHE_TTL", 600)) # seconds
+
+
+class MemoryRankBackend:
+    # in-process LRU with a TTL, shared by the threads of one worker
+    shared = False
+
+    def __init__(self, max_entries=RANK_CACHE_SIZE, ttl=RANK_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisRankBackend:
+    # shared across workers: entries are SETEX keys, recency is tracked in a sorted set
+    shared = True
+
+    def __init__(self, client, max_entries=RANK_CACHE_SIZE, ttl=RANK_CACHE_TTL, prefix="rankcache"):
+        self.client = client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prefix = prefix
+        self.index_key = f"{prefix}:lru"
+
+    def get(self, key):
+        data = self.client.get(f"{self.prefix}:{key}")
+        if data is None:
+            return None
+        self.client.zadd(self.index_key, {key: time.time()})
+        return json.loads(data)
+
+    def set(self, key, value):
+        pipe = self.client.pipeline()
+        pipe.set(f"{self.prefix}:{key}", json.dumps(value), ex=max(1, int(self.ttl)))
+        pipe.zadd(self.index_key, {key: time.time()})
+        pipe.zcard(self.index_key)
+        size = pipe.execute()[-1]
+        if size > self.max_entries:
+            # evict the least recently used keys
+            stale = self.client.zrange(self.index_key, 0, size - self.max_entries - 1)
+            if stale:
+                self.client.delete(*[f"{self.prefix}:{k}" for k in stale])
+                self.client.zrem(self.index_key, *stale)
+
+    def clear(self):
+        keys = self.client.zrange(self.index_key, 0, -1)
+        if keys:
+            self.client.delete(*[f"{self.prefix}:{k}" for k in keys])
+        self.client.delete(self.index_key)
+
+
+def cache_key(catalog, user_ingredients, target_macros, target_calories, priority, top_k, options=None):
+    # canonical hash of everything the ranking depends on
+    payload = {
+        "options": options or {}, # rank_recipes keyword arguments, e.g. nearest
+        "catalog": catalog.version,
+        "ingredients": sorted(set(user_ingredients)),
+        "macros": {m: float(v) for m, v in sorted(target_macros.items())},
+        "calories": float(target_calories),
+        "priority": priority,
+        "top_k": int(top_k)
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _to_cached(matches):
+    # JSON-safe form: the recipe itself is stored as its catalog row
+    return [
+        {
+            "index": m["index"],
+            "ingredient_score": float(m["ingredient_score"]),
+            "macro_distance": float(m["macro_distance"]),
+            "calorie_distance": float(m["calorie_distance"]),
+            "rating_score": float(m["rating_score"]),
+            "final_score": float(m["final_score"]),
+            "adjusted_recipe": m["adjusted_recipe"]
+        }
+        for m in matches
+    ]
+
+
+def _from_cached(catalog, cached):
+    # fresh dicts every time so callers can't modify the cached entry
+    matches = json.loads(json.dumps(cached))
+    for m in matches:
+        m["recipe"] = catalog[m["index"]]
+    return matches
+
+
+class RankCache:
+    # Memoizes rank_recipes. Keys include the catalog version, so entries for another
+    # catalog are never returned. When the catalog changes, an in-process backend is
+    # emptied to free the stale entries. A shared backend (Redis) is left alone: other
+    # workers may still be on that catalog, and stale entries expire by TTL.
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryRankBackend()
+        self.hits = 0
+        self.misses = 0
+        self._catalog_version = None
+        self._lock = threading.Lock()
+
+    def rank(self, catalog, user_ingredients, target_macros, target_calories, priority, top_k, **kwargs):
+        if not isinstance(catalog, RecipeCatalog): # plain recipe lists have no version to key on
+            return rank_recipes(catalog, user_ingredients, target_macros, target_calories, priority, top_k, **kwargs)
+        if self._catalog_version != catalog.version:
+            if self._catalog_version is not None and not self.backend.shared:
+                self.invalidate()
+            self._catalog_version = catalog.version
+
+        key = cache_key(catalog, user_ingredients, target_macros, target_calories, priority, top_k, kwargs)
+        cached = self.backend.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            metrics.inc("rank_cache_hits")
+            return _from_cached(catalog, cached)
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc("rank_cache_misses")
+        matches = rank_recipes(catalog, user_ingredients, target_macros, target_calories, priority, top_k, **kwargs)
+        cached = _to_cached(matches)
+        self.backend.set(key, cached)
+        return _from_cached(catalog, cached)
+
+    def invalidate(self):
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -4,6 +4,7 @@ import json
 from collections import defaultdict
 from cbr_retrieval import load_recipes, rank_recipes
 from llm import call_llm_for_meal_completion
+from planning_pool import PlanningPool
 
 def load_fridge(path="data/fridge.json"):
     with open(path, "r") as f:
@@ -142,7 +143,8 @@ def main():
     fridge = load_fridge()
     preferences = get_user_preferences()
 
-    selected_meals, pending_meals, missing_ingredients = build_meal_plan(recipes, fridge, preferences)
+    with PlanningPool(recipes) as planning_pool: # PLAN_WORKERS worker processes, or this thread when 0
+        selected_meals, pending_meals, missing_ingredients = planning_pool.plan(fridge, preferences, plan=build_meal_plan)
 
     print_meal_plan(selected_meals, pending_meals, missing_ingredients, preferences)
     save_fridge(fridge)
@@ -0,0 +1,35 @@
+# conftest.py
+#
+# The modules live at the repository root; make them importable from tests/.
+# Also the local LLM stub server fixtures shared by the LLM client tests.
+
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def stub_server():
+    # start_stub(latency) runs an llm_stub.StubServer on a free local port for the test
+    import llm_stub
+    servers = []
+
+    def start_stub(latency="fixed:0.01"):
+        server = llm_stub.StubServer(("127.0.0.1", 0), latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start_stub
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def stub(stub_server):
+    # a stub answering after 10 ms; a test module can override it for another latency
+    return stub_server()
@@ -0,0 +1,24 @@
+# test_app.py
+
+import pytest
+import app as web
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(web, "CATALOG_ADMIN_TOKEN", "secret")
+    return web.app.test_client()
+
+
+def test_malformed_recipes_are_rejected_before_the_catalog(client):
+    catalog = web.catalog_source.get()
+    size, vocabulary = len(catalog), list(catalog.vocabulary)
+    response = client.post("/recipes", json=[{"title": "Ok", "macros": {}, "ingredients": {"rice": 10}}, {"ingredients": {"yuzu": 1}}],
+                           headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 400
+    assert list(response.get_json()["errors"]) == ["1"]
+    assert (len(catalog), catalog.vocabulary) == (size, vocabulary)
+
+    response = client.put("/recipes/0", json={"title": "Broken"}, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 400
+    assert catalog.is_active(0)
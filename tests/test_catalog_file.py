@@ -0,0 +1,57 @@
+# test_catalog_file.py
+
+import pytest
+from catalog_file import save_catalog, open_catalog, is_compiled_catalog
+from cbr_retrieval import RecipeCatalog, load_recipes, rank_recipes
+
+QUERY = (["rice", "chicken", "egg"], {"protein": 30, "fat": 15, "carbs": 50}, 450, "protein", 20)
+
+
+def _ranking(catalog):
+    return [(match["index"], match["final_score"], match["adjusted_recipe"]) for match in rank_recipes(catalog, *QUERY)]
+
+
+def test_round_trip_keeps_every_recipe_and_ranking(tmp_path):
+    recipes = load_recipes().recipes
+    recipes[0] = dict(recipes[0], title="Crème brûlée à la 🍳") # titles are UTF-8
+    catalog = RecipeCatalog(recipes)
+    path = str(tmp_path / "recipes.cat")
+    save_catalog(catalog, path)
+
+    assert is_compiled_catalog(path)
+    opened = open_catalog(path)
+    assert opened.version == catalog.version
+    assert (opened.vocabulary, opened.macro_names) == (catalog.vocabulary, catalog.macro_names)
+    assert [opened.recipe(i) for i in range(len(opened))] == [catalog.recipe(i) for i in range(len(catalog))]
+    assert _ranking(opened) == _ranking(catalog)
+    assert _ranking(load_recipes(path)) == _ranking(catalog)
+
+
+def test_an_edited_catalog_is_saved_compacted(tmp_path):
+    catalog = load_recipes()
+    catalog.remove_recipe(0)
+    catalog.add_recipes([dict(catalog.recipe(1), title="Added")])
+    path = str(tmp_path / "recipes.cat")
+    save_catalog(catalog, path)
+
+    opened = open_catalog(path)
+    live = [catalog.recipe(i) for i in catalog.active_rows()]
+    assert [opened.recipe(i) for i in range(len(opened))] == live
+    assert opened.is_compact
+
+
+def test_an_opened_catalog_can_be_edited(tmp_path):
+    path = str(tmp_path / "recipes.cat")
+    save_catalog(load_recipes(), path)
+    opened = open_catalog(path)
+    [row] = opened.add_recipes([{"title": "New", "macros": {"protein": 30}, "ingredients": {"saffron": 2}, "calories": 400}])
+    assert opened.recipe(row)["ingredients"] == {"saffron": 2}
+    assert open_catalog(path).vocabulary == load_recipes().vocabulary # the file itself is untouched
+
+
+def test_a_json_file_is_not_a_compiled_catalog(tmp_path):
+    path = tmp_path / "recipes.json"
+    path.write_text("[]")
+    assert not is_compiled_catalog(str(path))
+    with pytest.raises(ValueError):
+        open_catalog(str(path))
@@ -0,0 +1,241 @@
+# test_cbr_retrieval.py
+
+import sys
+import random
+import threading
+import numpy as np
+import pytest
+from cbr_retrieval import (RecipeCatalog, load_recipes, rank_recipes, rank_recipes_batch, fridge_matrix,
+                           top_k_indices, compute_similarity, adjust_serving_size)
+
+TARGETS = ({"protein": 30, "fat": 15, "carbs": 50}, 450)
+PRIORITIES = ["calories", "protein", "fat", "carbs"]
+
+
+def _recipes(count=300, copies=30):
+    # the first recipes of the sample catalog plus exact copies of some, so scores tie
+    recipes = load_recipes().recipes[:count]
+    return recipes + [dict(recipe) for recipe in recipes[:copies]]
+
+
+def _random_query(rng, vocabulary):
+    # (fridge, target macros, target calories, priority) per meal
+    fridge = rng.sample(vocabulary, rng.randint(0, 12))
+    macros = {"protein": rng.uniform(10, 60), "fat": rng.uniform(5, 40), "carbs": rng.uniform(20, 120)}
+    return fridge, macros, rng.uniform(250, 1000), rng.choice(PRIORITIES)
+
+
+def _baseline_rank(recipes, user_ingredients, target_macros, target_calories, top_k):
+    # the ranking from before the columnar catalog: compute_similarity per recipe,
+    # MinMaxScaler per feature and a stable sort; (recipe position, final score) pairs
+    preprocessing = pytest.importorskip("sklearn.preprocessing")
+    scored = [compute_similarity(r, set(user_ingredients), target_macros, target_calories) for r in recipes]
+    scaler = preprocessing.MinMaxScaler()
+    column = lambda name: scaler.fit_transform([[s[name]] for s in scored]).flatten()
+    final_scores = (0.4 * column("ingredient_score") + 0.25 * (1 - column("macro_distance"))
+                    + 0.25 * (1 - column("calorie_distance")) + 0.1 * column("rating_score"))
+    order = sorted(range(len(recipes)), key=lambda i: final_scores[i], reverse=True)[:top_k]
+    return [(i, final_scores[i]) for i in order]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_rank_recipes_matches_the_baseline_ranking(seed):
+    rng = random.Random(seed)
+    recipes = _recipes()
+    catalog = RecipeCatalog(recipes)
+    fridge, macros, calories, priority = _random_query(rng, catalog.vocabulary)
+    top_k = rng.choice([1, 5, 40, len(recipes) + 5])
+    expected = _baseline_rank(recipes, fridge, macros, calories, top_k)
+    ranked = rank_recipes(catalog, fridge, macros, calories, priority, top_k)
+    assert [match["index"] for match in ranked] == [i for i, _ in expected] # ties in catalog order
+    assert [match["final_score"] for match in ranked] == pytest.approx([score for _, score in expected])
+
+
+@pytest.mark.parametrize("removed", [False, True])
+def test_ranking_while_recipes_are_added(removed):
+    catalog = load_recipes()
+    if removed:
+        catalog.remove_recipe(0)
+    new = [dict(catalog.recipe(i), title=f"Copy {i}") for i in range(400)]
+    fridge = ["rice", "chicken", "egg", "cheese"]
+    errors, adding = [], threading.Event()
+
+    def rank():
+        while adding.is_set():
+            try:
+                rank_recipes(catalog, fridge, *TARGETS, "protein", 10)
+                rank_recipes(catalog, fridge, *TARGETS, "protein", 10, threshold=True, nearest=50)
+                rank_recipes_batch(catalog, np.array([[30, 15, 50]]), np.array([450]), fridge_matrix(catalog, [fridge]), 10)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    adding.set()
+    readers = [threading.Thread(target=rank) for _ in range(4)]
+    try:
+        for reader in readers:
+            reader.start()
+        for recipe in new:
+            catalog.add_recipes([recipe])
+    finally:
+        adding.clear()
+        for reader in readers:
+            reader.join()
+        sys.setswitchinterval(interval)
+    assert not errors, errors[0]
+    assert len(catalog) == 1400
+
+
+def _state(catalog):
+    return len(catalog), list(catalog.vocabulary), list(catalog.macro_names), catalog.version
+
+
+def test_a_malformed_recipe_leaves_the_catalog_unchanged():
+    catalog = load_recipes()
+    before = _state(catalog)
+    good = {"title": "New", "macros": {"protein": 10, "fibre": 3}, "ingredients": {"saffron": 1}, "calories": 300}
+    with pytest.raises(ValueError):
+        catalog.add_recipes([good, {"macros": {"iron": 1}, "ingredients": {"yuzu": 5}}]) # no title
+    assert _state(catalog) == before
+
+    # ranking and later adds still work on it
+    fridge = ["rice", "chicken"]
+    rank_recipes_batch(catalog, np.array([[30, 15, 50]]), np.array([450]), fridge_matrix(catalog, [fridge]), 10)
+    [row] = catalog.add_recipes([good])
+    assert catalog.recipe(row)["ingredients"] == {"saffron": 1}
+    rank_recipes_batch(catalog, np.array([[30, 15, 50]]), np.array([450]), fridge_matrix(catalog, [fridge]), 10)
+
+
+def test_a_failed_update_keeps_the_old_recipe():
+    catalog = load_recipes()
+    before = _state(catalog)
+    with pytest.raises(ValueError):
+        catalog.update_recipe(3, {"title": "Broken", "macros": {}, "ingredients": {"rice": "lots"}})
+    assert catalog.is_active(3)
+    assert _state(catalog) == before
+    row = catalog.update_recipe(3, dict(catalog.recipe(3), title="Renamed"))
+    assert not catalog.is_active(3)
+    assert catalog.recipe(row)["title"] == "Renamed"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_top_k_indices_matches_a_stable_sort(seed):
+    rng = np.random.default_rng(seed)
+    scores = rng.integers(0, 6, size=int(rng.integers(1, 60))) / 5 # few distinct values: many ties
+    for top_k in (0, 1, 3, len(scores) // 2, len(scores), len(scores) + 3):
+        assert list(top_k_indices(scores, top_k)) == list(np.argsort(-scores, kind="stable")[:top_k])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_only_the_winners_are_adjusted_like_adjust_serving_size(seed):
+    rng = random.Random(seed)
+    recipes = _recipes()
+    catalog = RecipeCatalog(recipes)
+    fridge, macros, calories, _ = _random_query(rng, catalog.vocabulary)
+    priority = rng.choice(PRIORITIES + ["sodium", "fibre"]) # no recipe has fibre: the invalid-priority answer
+    ranked = rank_recipes(catalog, fridge, macros, calories, priority, 10)
+    assert len(ranked) == 10
+    for match in ranked:
+        assert match["adjusted_recipe"] == adjust_serving_size(recipes[match["index"]], macros, calories, priority)
+
+
+def _edited_catalog(rng):
+    # the sample catalog with a few recipes removed and copies added, so the posting
+    # lists have deltas and the scoring bounds have moved
+    catalog = load_recipes()
+    for row in rng.sample(range(len(catalog)), 20):
+        catalog.remove_recipe(row)
+    catalog.add_recipes([dict(catalog.recipe(row), title=f"Copy {row}") for row in rng.sample(range(len(catalog)), 20)])
+    return catalog
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_threshold_ranking_matches_a_full_scan(seed):
+    rng = random.Random(seed)
+    catalog = _edited_catalog(rng) if seed % 2 else load_recipes()
+    fridge, macros, calories, priority = _random_query(rng, catalog.vocabulary)
+    top_k = rng.choice([1, 5, 20, 100])
+    full = rank_recipes(catalog, fridge, macros, calories, priority, top_k)
+    pruned = rank_recipes(catalog, fridge, macros, calories, priority, top_k, threshold=True)
+    assert [match["index"] for match in pruned] == [match["index"] for match in full]
+    assert [match["final_score"] for match in pruned] == [match["final_score"] for match in full]
+    assert [match["adjusted_recipe"] for match in pruned] == [match["adjusted_recipe"] for match in full]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 7])
+@pytest.mark.parametrize("edited", [False, True])
+def test_batch_ranking_matches_ranking_each_user(chunk_size, edited):
+    rng = random.Random(chunk_size or 0)
+    catalog = _edited_catalog(rng) if edited else load_recipes()
+    queries = [_random_query(rng, catalog.vocabulary) for _ in range(25)]
+    top_k = 15
+    indices, scores = rank_recipes_batch(
+        catalog,
+        np.array([[macros["protein"], macros["fat"], macros["carbs"]] for _, macros, _, _ in queries]),
+        np.array([calories for _, _, calories, _ in queries]),
+        fridge_matrix(catalog, [fridge for fridge, _, _, _ in queries]),
+        top_k, chunk_size=chunk_size
+    )
+    for user, (fridge, macros, calories, priority) in enumerate(queries):
+        ranked = rank_recipes(catalog, fridge, macros, calories, priority, top_k)
+        assert list(indices[user]) == [match["index"] for match in ranked]
+        assert list(scores[user]) == pytest.approx([match["final_score"] for match in ranked])
+
+
+def _exhaustive_nearest(catalog, macros, calories, count):
+    # the count live rows closest to the targets by a full scan over the same scaled points
+    rows = catalog.active_rows()
+    points = np.column_stack((catalog.scored_macros[rows], catalog.calories[rows]))
+    spread = points.std(axis=0)
+    spread[spread == 0] = 1
+    target = np.array([macros["protein"], macros["fat"], macros["carbs"], calories])
+    distances = np.linalg.norm((points - target) / spread, axis=1)
+    return rows, distances, rows[np.argsort(distances, kind="stable")[:count]]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_nearest_mode_matches_an_exhaustive_search(seed):
+    rng = random.Random(seed)
+    catalog = load_recipes()
+    _, macros, calories, priority = _random_query(rng, catalog.vocabulary)
+    if seed % 2: # edit after the indexes are built, so added rows are checked directly
+        rank_recipes(catalog, [], macros, calories, priority, 5, nearest=50)
+        for row in rng.sample(range(len(catalog)), 20):
+            catalog.remove_recipe(row)
+        catalog.add_recipes([dict(catalog.recipe(row), title=f"Copy {row}") for row in rng.sample(catalog.active_rows().tolist(), 20)])
+    count = rng.choice([1, 10, 50])
+    target = np.array([macros["protein"], macros["fat"], macros["carbs"]])
+
+    rows, distances, expected = _exhaustive_nearest(catalog, macros, calories, count)
+    found = catalog.nearest_rows(target, calories, count)
+    assert len(found) == count
+    assert set(found.tolist()) <= set(rows.tolist()) # only live rows
+    # the same set up to ties at the cut-off distance
+    distance = dict(zip(rows.tolist(), distances))
+    assert sorted(distance[row] for row in found) == pytest.approx(sorted(distance[row] for row in expected))
+
+    # distance bounds are the full catalog's
+    macro_distance = np.linalg.norm(catalog.scored_macros[rows] - target, axis=1)
+    calorie_distance = np.abs(catalog.calories[rows] - calories)
+    (macro_low, macro_high), (calorie_low, calorie_high) = catalog.distance_ranges(target, calories)
+    assert (macro_low, macro_high) == (macro_distance.min(), macro_distance.max())
+    assert (calorie_low, calorie_high) == (calorie_distance.min(), calorie_distance.max())
+
+    # with an empty fridge nothing is normalized over the nearest set only, so every
+    # returned recipe scores exactly as in a full scan
+    full = {match["index"]: match["final_score"] for match in rank_recipes(catalog, [], macros, calories, priority, len(catalog))}
+    ranked = rank_recipes(catalog, [], macros, calories, priority, 5, nearest=count)
+    assert {match["index"] for match in ranked} <= set(catalog.nearest_rows(target, calories, max(count, 5)).tolist())
+    assert [match["final_score"] for match in ranked] == pytest.approx([full[match["index"]] for match in ranked])
+    assert [match["final_score"] for match in ranked] == sorted((match["final_score"] for match in ranked), reverse=True)
+
+
+def test_nearest_mode_covering_the_catalog_is_a_full_scan():
+    catalog = load_recipes()
+    fridge = ["rice", "chicken", "egg"]
+    full = rank_recipes(catalog, fridge, *TARGETS, "protein", 10)
+    ranked = rank_recipes(catalog, fridge, *TARGETS, "protein", 10, nearest=len(catalog))
+    assert [match["index"] for match in ranked] == [match["index"] for match in full]
+    assert [match["final_score"] for match in ranked] == [match["final_score"] for match in full]
@@ -0,0 +1,75 @@
+# test_fridge_store.py
+
+import os
+import threading
+import pytest
+from fridge_store import FileFridgeStore, RedisFridgeStore, _load_default_fridge
+
+
+@pytest.fixture
+def redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisFridgeStore(fakeredis.FakeRedis(decode_responses=True))
+
+
+def test_redis_new_fridge_gets_the_default(redis_store):
+    assert redis_store.load("alice") == {ingredient: float(amount) for ingredient, amount in _load_default_fridge().items()}
+
+
+def test_redis_emptied_fridge_stays_empty(redis_store):
+    redis_store.load("alice")
+    redis_store.save({}, "alice")
+    fridge, version = redis_store.load_versioned("alice")
+    assert fridge == {}
+    assert redis_store.commit({"rice": 10}, version, "alice")
+    assert redis_store.load("alice") == {}
+
+
+def test_file_commit_refuses_a_fridge_written_since_loading(tmp_path):
+    store = FileFridgeStore(str(tmp_path / "fridge.json"))
+    store.save({"rice": 300})
+    fridge, version = store.load_versioned()
+    store.save({"rice": 300}) # same contents and size, possibly the same inode
+    assert not store.commit({"rice": 100}, version)
+    fridge, version = store.load_versioned()
+    assert store.commit({"rice": 100}, version)
+    assert store.load() == {"rice": 200}
+    assert not store.commit({"rice": 100}, version)
+
+
+def test_file_version_counts_writes(tmp_path):
+    store = FileFridgeStore(str(tmp_path / "fridge.json"))
+    assert store.load() == _load_default_fridge()
+    store.save({"rice": 300})
+    store.consume({"rice": 100})
+    assert store.load_versioned()[1][0] == 3
+
+
+def _within(seconds, fn):
+    # fn's result, failing the test instead of hanging when fn deadlocks
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "deadlocked"
+    return result[0]
+
+
+def test_file_consume_on_a_missing_fridge_uses_the_default(tmp_path):
+    store = FileFridgeStore(str(tmp_path / "fridge.json"))
+    ingredient = next(iter(_load_default_fridge()))
+    _within(5, lambda: store.consume({ingredient: 1}))
+    assert store.load()[ingredient] == max(_load_default_fridge()[ingredient] - 1, 0)
+    store.save({"rice": 300}) # the lock is free again
+
+
+def test_file_commit_on_a_corrupt_fridge_uses_the_default(tmp_path):
+    path = tmp_path / "fridge.json"
+    store = FileFridgeStore(str(path))
+    store.save({"rice": 300})
+    path.write_text("{not json") # a hand edit gone wrong
+    version = store._version(store._written(None), os.stat(path))
+    ingredient = next(iter(_load_default_fridge()))
+    assert _within(5, lambda: store.commit({ingredient: 1}, version))
+    assert store.load()[ingredient] == max(_load_default_fridge()[ingredient] - 1, 0)
+    store.save({"rice": 300})
@@ -0,0 +1,61 @@
+# test_llm.py
+
+import pytest
+import metrics
+import llm
+from llm import build_prompt, estimate_tokens
+
+PREFERENCES = {"days": 2, "meals_per_day": 3, "target_calories_per_day": 2000,
+               "target_macros_per_day": {"protein": 120, "fat": 60, "carbs": 220}, "priority": "protein"}
+FRIDGE = {"rice": 900, "chicken": 600, "spinach": 250, "egg": 120, "lemon": 40, "chilli": 10}
+SELECTED = [{"meal_title": "Chicken rice bowl"}, {"meal_title": "Spinach omelette"}, {"meal_title": "Lemon rice"}]
+MISSING = {"garlic": 20, "onion": 150}
+
+
+def _prompt(budget):
+    return build_prompt(PREFERENCES, FRIDGE, SELECTED, MISSING, 3, budget=budget)
+
+
+def test_an_untrimmed_prompt_has_all_the_context():
+    prompt, tokens, trimmed = _prompt(10000)
+    assert trimmed == {}
+    assert tokens == estimate_tokens(prompt)
+    assert all(meal["meal_title"] in prompt for meal in SELECTED)
+    assert '"garlic":20' in prompt and '"chilli":10' in prompt
+
+
+def test_over_budget_prompts_are_trimmed_in_order():
+    # shrinking the budget one token at a time drops the missing ingredients first, then
+    # the selected titles from the last one, then the fridge from its smallest amount
+    _, full, _ = _prompt(10000)
+    stages = []
+    for budget in range(full, 0, -1):
+        prompt, tokens, trimmed = _prompt(budget)
+        stage = (trimmed.get("missing", 0), trimmed.get("titles", 0), trimmed.get("fridge", 0))
+        if not stages or stages[-1] != stage:
+            stages.append(stage)
+        if trimmed.get("fridge", 0) < len(FRIDGE) - 1:
+            assert tokens <= budget
+        kept_titles = len(SELECTED) - stage[1]
+        assert all((meal["meal_title"] in prompt) == (i < kept_titles) for i, meal in enumerate(SELECTED))
+        kept_fridge = sorted(FRIDGE, key=FRIDGE.get)[stage[2]:]
+        assert all((f'"{ingredient}":' in prompt) == (ingredient in kept_fridge) for ingredient in FRIDGE)
+        assert ('"garlic":' in prompt) == (stage[0] == 0)
+        assert "3 already selected" in prompt # the count stays
+
+    assert stages == [(0, 0, 0), (2, 0, 0), (2, 1, 0), (2, 2, 0), (2, 3, 0)] + [(2, 3, n) for n in range(1, len(FRIDGE))]
+
+
+def test_each_request_records_its_prompt_size(monkeypatch):
+    metrics.reset()
+    monkeypatch.setattr(llm, "LLM_PROMPT_TOKENS", 10000)
+    llm._meal_messages(PREFERENCES, FRIDGE, SELECTED, MISSING, 3)
+    monkeypatch.setattr(llm, "LLM_PROMPT_TOKENS", 120)
+    messages = llm._meal_messages(PREFERENCES, FRIDGE, SELECTED, MISSING, 3)
+
+    histograms, counters = metrics.snapshot()
+    counts, total = histograms["llm_prompt_tokens"]
+    assert sum(counts) == 2
+    assert total == _prompt(10000)[1] + estimate_tokens(messages[1]["content"])
+    assert counters["llm_prompts_trimmed"] == 1
+    assert "cheffie_llm_prompt_tokens_count 2" in metrics.render()
@@ -0,0 +1,63 @@
+# test_llm_cache.py
+
+import json
+import pytest
+import llm_cache
+from llm_cache import CompletionCache, DiskCompletionBackend, completion_key, iter_meals
+
+PREFERENCES = {
+    "days": 1, "meals_per_day": 2, "target_calories_per_day": 1800,
+    "target_macros_per_day": {"protein": 120, "fat": 60, "carbs": 200}
+}
+FRIDGE = {"rice": 300, "egg": 100}
+
+
+def test_prompt_version_is_part_of_the_key(monkeypatch):
+    key = completion_key(PREFERENCES, FRIDGE, [], {}, 2)
+    assert completion_key(PREFERENCES, dict(FRIDGE, egg=110), [], {}, 2) == key
+    monkeypatch.setattr(llm_cache, "PROMPT_VERSION", llm_cache.PROMPT_VERSION + 1)
+    assert completion_key(PREFERENCES, FRIDGE, [], {}, 2) != key
+
+
+MEALS = [{"meal_title": "Egg fried rice", "ingredients": {"rice": 200, "egg": 100}},
+         {"meal_title": "Plain rice", "ingredients": {"rice": 100}}]
+
+
+def _pieces(text):
+    # a streamed completion of text, a few characters at a time
+    def call_stream(*args):
+        yield from (text[i:i + 7] for i in range(0, len(text), 7))
+    return call_stream
+
+
+def test_iter_meals_reports_a_cut_short_array():
+    text = json.dumps(MEALS)
+    parsed = iter_meals(_pieces(text)())
+    assert list(parsed) == MEALS
+    for cut, complete in [(len(text), True), (len(text) - 1, False)]:
+        parsed = iter_meals(_pieces(text[:cut])())
+        with pytest.raises(StopIteration) as end:
+            while True:
+                next(parsed)
+        assert end.value.value is complete
+
+
+@pytest.mark.parametrize("cut, cached", [(0, True), (1, False), (20, False)])
+def test_only_a_complete_stream_is_cached(tmp_path, cut, cached):
+    cache = CompletionCache(DiskCompletionBackend(str(tmp_path)))
+    text = json.dumps(MEALS)
+    stream = _pieces(text[:len(text) - cut])
+    meals = list(cache.stream(stream, PREFERENCES, FRIDGE, [], {}, 2))
+    assert meals == (MEALS if cut < 20 else MEALS[:1])
+
+    again = list(cache.stream(_pieces("[]"), PREFERENCES, FRIDGE, [], {}, 2))
+    assert again == (MEALS if cached else [])
+    assert cache.stats()["hits"] == int(cached)
+
+
+def test_a_stream_the_reader_stops_is_not_cached(tmp_path):
+    cache = CompletionCache(DiskCompletionBackend(str(tmp_path)))
+    stream = cache.stream(_pieces(json.dumps(MEALS)), PREFERENCES, FRIDGE, [], {}, 2)
+    assert next(stream) == MEALS[0]
+    stream.close()
+    assert list(cache.stream(_pieces("[]"), PREFERENCES, FRIDGE, [], {}, 2)) == []
@@ -0,0 +1,111 @@
+# test_llm_client.py
+
+import json
+import time
+from types import SimpleNamespace
+import pytest
+import llm_client
+from llm_cache import iter_meals
+from llm_client import LLMClient, CircuitBreaker, LLMUnavailable
+
+MESSAGES = [{"role": "user", "content": 'Fridge (g): {"rice":300,"egg":100}\nPropose 2 new'}]
+
+
+def _client(server, breaker):
+    return LLMClient(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", retries=0, breaker=breaker)
+
+
+def test_stream_read_to_closing_bracket_closes_breaker(stub):
+    # iter_meals stops at "]" and closes the stream before [DONE]
+    breaker = CircuitBreaker(failures=2, reset=0)
+    client = _client(stub, breaker)
+
+    stub.error_rate = 1.0
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            list(client.chat_stream(MESSAGES))
+    assert breaker.state == "half-open"
+
+    stub.error_rate = 0.0
+    assert len(list(iter_meals(client.chat_stream(MESSAGES)))) == 2
+    assert breaker.state == "closed"
+    assert len(list(iter_meals(client.chat_stream(MESSAGES)))) == 2
+
+
+def test_half_open_trial_closed_after_first_piece_closes_breaker(stub):
+    breaker = CircuitBreaker(failures=1, reset=0)
+    breaker.failure()
+    stream = _client(stub, breaker).chat_stream(MESSAGES)
+    next(stream)
+    stream.close()
+    assert breaker.state == "closed"
+
+
+def test_a_half_open_trial_that_raises_reopens_the_breaker(stub, monkeypatch):
+    breaker = CircuitBreaker(failures=1, reset=0)
+    breaker.failure()
+    client = _client(stub, breaker)
+
+    def post(*args, **kwargs):
+        raise ValueError("bad header") # not a connection error or timeout
+
+    monkeypatch.setattr(client.session, "post", post)
+    with pytest.raises(LLMUnavailable):
+        client.chat(MESSAGES)
+    assert breaker.state == "half-open" # the trial counted as a failure; reset=0 lets the next one through
+
+    monkeypatch.undo()
+    assert len(list(iter_meals(client.chat_stream(MESSAGES)))) == 2
+    assert breaker.state == "closed"
+
+
+class _Responses:
+    # session.post answering with the scripted (status, headers) pairs in turn
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = 0
+
+    def post(self, *args, **kwargs):
+        self.posts += 1
+        status, headers = self.responses.pop(0)
+        body = json.dumps({"choices": [{"message": {"content": "[]"}}]})
+        return SimpleNamespace(status_code=status, headers=headers, text=body, json=lambda: json.loads(body))
+
+
+def _scheduled(monkeypatch, client, *responses):
+    # the waits before each retry, with the jitter at its upper bound and no real sleeping
+    delays = []
+    monkeypatch.setattr(llm_client, "time", SimpleNamespace(sleep=delays.append, monotonic=time.monotonic))
+    monkeypatch.setattr(llm_client, "random", SimpleNamespace(uniform=lambda low, high: high))
+    client.session = _Responses(*responses)
+    return delays
+
+
+@pytest.mark.parametrize("backoff, expected", [(0.5, [0.5, 1.0, 2.0]), (3, [3, 6, 8])]) # doubled, capped at MAX_BACKOFF
+def test_retries_back_off_exponentially(monkeypatch, backoff, expected):
+    breaker = CircuitBreaker(failures=2, reset=60)
+    client = LLMClient(base_url="http://llm.invalid/v1", retries=3, backoff=backoff, breaker=breaker)
+    delays = _scheduled(monkeypatch, client, *[(503, {})] * 4)
+    with pytest.raises(LLMUnavailable):
+        client.chat(MESSAGES)
+    assert delays == expected
+    assert client.session.posts == 4
+    assert breaker.state == "closed" # the whole call is one failure
+
+
+def test_retry_after_is_honoured_up_to_the_cap(monkeypatch):
+    client = LLMClient(base_url="http://llm.invalid/v1", retries=3, backoff=0.5)
+    delays = _scheduled(monkeypatch, client, (429, {"Retry-After": "2"}), (429, {"Retry-After": "120"}),
+                        (503, {"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"}), (200, {}))
+    assert client.chat(MESSAGES) == "[]"
+    assert delays == [2, llm_client.MAX_BACKOFF, 2.0] # the date form falls back to the jittered backoff
+
+
+def test_a_rejected_request_is_not_retried(monkeypatch):
+    breaker = CircuitBreaker(failures=1, reset=60)
+    client = LLMClient(base_url="http://llm.invalid/v1", retries=3, breaker=breaker)
+    delays = _scheduled(monkeypatch, client, (400, {}))
+    with pytest.raises(LLMUnavailable):
+        client.chat(MESSAGES)
+    assert (delays, client.session.posts) == ([], 1)
+    assert breaker.state == "closed"
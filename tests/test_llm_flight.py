@@ -0,0 +1,94 @@
+# test_llm_flight.py
+
+import threading
+import pytest
+import metrics
+from llm_cache import iter_meals, parse_meals
+from llm_client import LLMClient, LLMUnavailable
+from llm_flight import SingleFlightClient
+
+MESSAGES = [{"role": "user", "content": 'Fridge (g): {"rice":300,"egg":100,"tofu":200}\nPropose 3 new'}]
+CALLERS = 6
+
+
+@pytest.fixture
+def stub(stub_server):
+    # slow enough that every caller joins before the first answer is in
+    return stub_server("fixed:0.3")
+
+
+def _client(server):
+    return LLMClient(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", retries=0)
+
+
+def _meals(client, i):
+    # half the callers stream (and stop at the closing bracket), half wait for the whole answer
+    if i % 2:
+        return list(iter_meals(client.chat_stream(MESSAGES)))
+    return parse_meals(client.chat(MESSAGES))
+
+
+def _run(callers):
+    # call every caller at once from its own thread; (results, errors) by caller
+    results, errors = [None] * len(callers), [None] * len(callers)
+    start = threading.Barrier(len(callers))
+
+    def call(i):
+        start.wait()
+        try:
+            results[i] = callers[i](i)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(callers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+
+def test_concurrent_identical_requests_make_one_upstream_call(stub):
+    client = SingleFlightClient(_client(stub))
+    results, errors = _run([lambda i: _meals(client, i)] * CALLERS)
+    assert errors == [None] * CALLERS
+    assert stub.requests == 1
+    assert len(results[0]) == 3
+    assert all(meals == results[0] for meals in results)
+
+    # every caller parsed its own copy
+    results[0][0]["ingredients"]["rice"] = -1
+    assert all(meals[0]["ingredients"]["rice"] != -1 for meals in results[1:])
+
+
+def test_leader_failure_fails_its_followers(stub):
+    stub.error_rate = 1.0
+    client = SingleFlightClient(_client(stub))
+    results, errors = _run([lambda i: _meals(client, i)] * CALLERS)
+    assert all(isinstance(error, LLMUnavailable) for error in errors)
+    assert stub.requests == 1
+
+
+def _workers(stub):
+    # two worker processes, each with its own client and connection to the same Redis
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return [SingleFlightClient(_client(stub), fakeredis.FakeRedis(server=server, decode_responses=True)) for _ in range(2)]
+
+
+def test_workers_sharing_redis_make_one_upstream_call(stub):
+    workers = _workers(stub)
+    metrics.reset()
+    results, errors = _run([lambda i: _meals(workers[i * 2 // CALLERS], i)] * CALLERS)
+    assert errors == [None] * CALLERS
+    assert stub.requests == 1
+    assert all(meals == results[0] for meals in results)
+    assert metrics.snapshot()[1]["llm_coalesced_remote"] == 1 # the other worker's leader, the rest wait in-process
+
+
+def test_leader_failure_reaches_other_workers(stub):
+    stub.error_rate = 1.0
+    workers = _workers(stub)
+    results, errors = _run([lambda i: _meals(workers[i * 2 // CALLERS], i)] * CALLERS)
+    assert all(isinstance(error, LLMUnavailable) for error in errors)
+    assert stub.requests == 1
@@ -0,0 +1,73 @@
+# test_llm_jobs.py
+
+import threading
+from types import SimpleNamespace
+import pytest
+import llm_jobs
+from llm_jobs import JobQueue
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(workers=2, ttl=60)
+    yield queue
+    queue.shutdown()
+
+
+def _streaming(meals, release):
+    # a fake completion: adds each meal, waiting for release between them
+    def work(job):
+        for meal in meals:
+            assert release.acquire(timeout=5)
+            job.add_meal(meal)
+    return work
+
+
+def _finished(job):
+    while not job.wait_for_update(len(job.meals), timeout=5)[1]:
+        pass
+    return job
+
+
+def test_meals_are_streamed_to_readers(queue):
+    release = threading.Semaphore(0)
+    job = queue.submit(_streaming([{"meal_title": "A"}, {"meal_title": "B"}], release))
+    assert queue.get(job.id) is job
+
+    assert job.wait_for_update(0, timeout=0.05) == ([], False) # nothing yet
+    release.release()
+    assert job.wait_for_update(0, timeout=5) == ([{"meal_title": "A"}], False)
+    assert job.status == "running"
+    release.release()
+    assert job.wait_for_update(1, timeout=5)[0] == [{"meal_title": "B"}]
+    assert _finished(job).wait_for_update(2) == ([], True)
+    assert job.to_dict() == {"id": job.id, "status": "done", "meals": [{"meal_title": "A"}, {"meal_title": "B"}], "error": None}
+
+
+def test_a_failing_job_keeps_its_meals(queue):
+    def work(job):
+        job.add_meal({"meal_title": "A"})
+        raise RuntimeError("LLM unavailable")
+
+    job = _finished(queue.submit(work))
+    assert job.to_dict() == {"id": job.id, "status": "failed", "meals": [{"meal_title": "A"}], "error": "LLM unavailable"}
+    assert job.wait_for_update(1, timeout=0.05) == ([], True)
+
+
+def test_finished_jobs_expire_after_the_ttl(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_jobs, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    release = threading.Semaphore(0)
+    done = _finished(queue.submit(lambda job: None))
+    running = queue.submit(_streaming([{"meal_title": "A"}], release))
+
+    now[0] += 60
+    queue.submit(lambda job: None) # jobs are expired when a new one comes in
+    assert queue.get(done.id) is done # not past the ttl yet
+
+    now[0] += 1
+    queue.submit(lambda job: None)
+    assert queue.get(done.id) is None
+    assert queue.get(running.id) is running # still running, however long it takes
+    release.release()
+    _finished(running)
@@ -0,0 +1,21 @@
+# test_llm_replay.py
+
+import pytest
+from llm_cache import iter_meals
+from llm_client import LLMClient, LLMUnavailable
+from llm_replay import RecordingClient, RecordingStore, ReplayClient
+
+MESSAGES = [{"role": "user", "content": 'Fridge (g): {"rice":300,"egg":100}\nPropose 2 new'}]
+
+
+def test_stream_read_to_closing_bracket_is_recorded_and_replayed(stub, tmp_path):
+    store = RecordingStore(str(tmp_path))
+    client = LLMClient(base_url=f"http://127.0.0.1:{stub.server_address[1]}/v1", retries=0)
+    recorded = list(iter_meals(RecordingClient(client, store).chat_stream(MESSAGES)))
+    assert len(recorded) == 2
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+    replay = ReplayClient(store, model=client.model)
+    assert list(iter_meals(replay.chat_stream(MESSAGES))) == recorded
+    with pytest.raises(LLMUnavailable):
+        replay.chat([{"role": "user", "content": "never recorded"}])
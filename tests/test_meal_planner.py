@@ -0,0 +1,350 @@
+# test_meal_planner.py
+
+import random
+from collections import defaultdict, OrderedDict
+from itertools import combinations
+import pytest
+import metrics
+import meal_planner
+from cbr_retrieval import RecipeCatalog
+from fridge_store import _consumed
+from llm_client import LLMUnavailable
+from meal_planner import (FridgeSession, Speculation, optimize_meals, replan_meals, build_meal_plan, predict_shortfall,
+                          speculate_llm_meals, reconcile_speculation, _greedy_state, has_enough_ingredients,
+                          use_ingredients, calculate_missing_ingredients)
+
+INGREDIENTS = ["rice", "egg", "chicken", "tofu", "spinach", "cheese"]
+
+
+def _match(title, score, ingredients):
+    return {"final_score": score, "adjusted_recipe": {"title": title, "ingredients": ingredients, "adjusted_macros": {}}}
+
+
+def _random_matches(rng, count):
+    # ranked matches as rank_recipes returns them, with only what the planners read
+    matches = []
+    for i in range(count):
+        picked = rng.sample(INGREDIENTS, rng.randint(1, 3))
+        matches.append(_match(f"Meal {i}", rng.random(), {ingredient: rng.choice([50, 100, 150, 200]) for ingredient in picked}))
+    matches.sort(key=lambda match: -match["final_score"])
+    return matches
+
+
+def _random_fridge(rng):
+    # some ingredients missing, some at 0
+    return {ingredient: rng.choice([0, 100, 200, 300, 450]) for ingredient in INGREDIENTS if rng.random() < 0.85}
+
+
+def _fits(meals, fridge):
+    total = {}
+    for match in meals:
+        for ingredient, amount in match["adjusted_recipe"]["ingredients"].items():
+            total[ingredient] = total.get(ingredient, 0) + amount
+    return all(ingredient in fridge and fridge[ingredient] >= amount for ingredient, amount in total.items())
+
+
+def _brute_force(matches, fridge, meals_needed):
+    # (meal count, total score) of the best set of matches the fridge covers together
+    best = (0, 0.0)
+    for size in range(1, min(meals_needed, len(matches)) + 1):
+        for meals in combinations(matches, size):
+            if _fits(meals, fridge):
+                best = max(best, (size, sum(match["final_score"] for match in meals)))
+    return best
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_optimize_meals_matches_brute_force(seed):
+    rng = random.Random(seed)
+    matches = _random_matches(rng, rng.randint(1, 9))
+    fridge = _random_fridge(rng)
+    meals_needed = rng.randint(1, 5)
+    expected_count, expected_score = _brute_force(matches, fridge, meals_needed)
+
+    left = dict(fridge)
+    selected, pending, missing = optimize_meals(matches, left, meals_needed, time_budget=60)
+    titles = {meal["meal_title"] for meal in selected}
+    chosen = [match for match in matches if match["adjusted_recipe"]["title"] in titles]
+    assert len(selected) == expected_count
+    assert sum(match["final_score"] for match in chosen) == pytest.approx(expected_score)
+    assert _fits(chosen, fridge)
+    assert len(selected) + len(pending) == len(matches)
+
+    # the fridge is left with what the chosen meals did not use, clamped at 0
+    for ingredient, amount in fridge.items():
+        used = sum(match["adjusted_recipe"]["ingredients"].get(ingredient, 0) for match in chosen)
+        assert left[ingredient] == max(amount - used, 0)
+
+
+def test_optimize_meals_beats_greedy_when_the_best_match_blocks_two():
+    matches = [_match("Big", 0.9, {"rice": 200}), _match("Small A", 0.6, {"rice": 100}), _match("Small B", 0.5, {"rice": 100})]
+    fridge = {"rice": 200}
+    selected, pending, missing = optimize_meals(matches, fridge, 2, time_budget=60)
+    assert [meal["meal_title"] for meal in selected] == ["Small A", "Small B"]
+    assert [match["adjusted_recipe"]["title"] for match in pending] == ["Big"]
+    assert fridge == {"rice": 0}
+    assert dict(missing) == {"rice": 200}
+
+
+def _reference_greedy(matches, fridge):
+    # the greedy selection as a plain loop over the fridge dict, one match at a time
+    selected, pending, missing = [], [], defaultdict(float)
+    for match in matches:
+        ingredients = match["adjusted_recipe"]["ingredients"]
+        if has_enough_ingredients(ingredients, fridge):
+            selected.append(match["adjusted_recipe"]["title"])
+            use_ingredients(ingredients, fridge)
+        else:
+            pending.append(match)
+            for ingredient, amount in calculate_missing_ingredients(ingredients, fridge).items():
+                missing[ingredient] += amount
+    return selected, pending, missing
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_greedy_state_matches_the_dict_loop(seed):
+    rng = random.Random(seed)
+    matches = _random_matches(rng, rng.randint(0, 30))
+    for match in rng.sample(matches, len(matches) // 3): # amounts that don't add up evenly
+        ingredients = match["adjusted_recipe"]["ingredients"]
+        for ingredient in ingredients:
+            ingredients[ingredient] = round(rng.uniform(0.1, 250), 2)
+    fridge = _random_fridge(rng)
+    if rng.random() < 0.3:
+        fridge = {ingredient: amount + rng.random() for ingredient, amount in fridge.items()}
+
+    expected_fridge = dict(fridge)
+    expected_titles, expected_pending, expected_missing = _reference_greedy(matches, expected_fridge)
+    selected, pending, missing = _greedy_state("v1", matches, fridge).plan()
+    assert [meal["meal_title"] for meal in selected] == expected_titles
+    assert pending == expected_pending
+    assert list(missing) == list(expected_missing) # first-seen order
+    assert list(missing.values()) == pytest.approx(list(expected_missing.values()))
+    assert fridge == pytest.approx(expected_fridge)
+
+
+def _edited(rng, fridge):
+    # the same ingredients with a few amounts changed, as a restock or a consumed meal leaves them
+    fridge = dict(fridge)
+    for ingredient in rng.sample(sorted(fridge), rng.randint(1, min(2, len(fridge)))):
+        fridge[ingredient] = rng.choice([0, 50, 100, 200, 300, 450, fridge[ingredient] + 50])
+    return fridge
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_replan_meals_matches_a_full_replan(seed):
+    rng = random.Random(seed)
+    matches = _random_matches(rng, rng.randint(1, 12))
+    fridge = _random_fridge(rng) or {"rice": 100}
+    state = _greedy_state("v1", matches, dict(fridge))
+
+    for _ in range(5): # each replan starts from the last one, as build_meal_plan chains them
+        fridge = _edited(rng, fridge)
+        replanned = dict(fridge)
+        state, position = replan_meals(state, replanned)
+        full = dict(fridge)
+        expected = _greedy_state("v1", matches, full).plan()
+        assert state.plan() == expected
+        assert replanned == full
+        assert state.fridge == fridge
+
+
+class _ChangingStore:
+    # in-memory fridge store; `writes` are applied (one per commit attempt) as if another
+    # request wrote the fridge between this request's load and its commit
+    def __init__(self, fridge, writes=()):
+        self.fridge, self.version = dict(fridge), 0
+        self.writes = list(writes)
+        self.commits = 0
+
+    def load_versioned(self, user=None):
+        return dict(self.fridge), self.version
+
+    def _apply(self, write):
+        write(self.fridge)
+        self.version += 1
+
+    def commit(self, used, version, user=None):
+        self.commits += 1
+        if self.writes:
+            self._apply(self.writes.pop(0))
+        if version != self.version:
+            return False
+        _consumed(self.fridge, used)
+        self.version += 1
+        return True
+
+    def consume(self, used, user=None):
+        _consumed(self.fridge, used)
+        self.version += 1
+
+
+def _session(monkeypatch, fridge, writes=()):
+    store = _ChangingStore(fridge, writes)
+    monkeypatch.setattr(meal_planner, "_fridge_store", lambda path: store)
+    return FridgeSession(), store
+
+
+def _greedy(matches):
+    # a plan step as build_meal_plan's callers record it; counts how often it ran
+    def plan(fridge):
+        plan.runs += 1
+        selected, _, _ = _greedy_state(None, matches, fridge).plan()
+        return [meal["meal_title"] for meal in selected]
+    plan.runs = 0
+    return plan
+
+
+MATCHES = [_match("Rice bowl", 0.9, {"rice": 200, "egg": 100}), _match("Omelette", 0.8, {"egg": 150})]
+
+
+def test_session_commits_its_usage_in_one_write(monkeypatch):
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 300})
+    plan = _greedy(MATCHES)
+    assert session.plan(plan) == ["Rice bowl", "Omelette"]
+    session.use({"rice": 50})
+    assert session.commit() == {"rice": 50, "egg": 50}
+    assert store.fridge == {"rice": 50, "egg": 50}
+    assert (store.commits, plan.runs) == (1, 1)
+
+
+def test_session_keeps_its_usage_when_the_new_fridge_still_covers_it(monkeypatch):
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 300}, [lambda fridge: fridge.update(rice=500)])
+    plan = _greedy(MATCHES)
+    session.plan(plan)
+    session.use({"rice": 50})
+    assert session.commit() == {"rice": 250, "egg": 50}
+    assert store.fridge == {"rice": 250, "egg": 50}
+    assert session.plan_result == ["Rice bowl", "Omelette"]
+    assert (store.commits, plan.runs) == (2, 1)
+
+
+def test_session_replays_its_steps_when_the_new_fridge_falls_short(monkeypatch):
+    # another request took eggs: the plan is redone and the LLM meal consumed again
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 300}, [lambda fridge: fridge.update(egg=150)])
+    plan = _greedy(MATCHES)
+    session.plan(plan)
+    session.use({"rice": 50})
+    assert session.commit() == {"rice": 50, "egg": 50}
+    assert store.fridge == {"rice": 50, "egg": 50}
+    assert session.plan_result == ["Rice bowl"] # not enough eggs left for the omelette
+    assert (store.commits, plan.runs) == (2, 2)
+
+
+def test_session_replays_when_an_ingredient_was_added(monkeypatch):
+    # the ranking depends on which ingredients are in the fridge, so the plan is redone
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 300}, [lambda fridge: fridge.update(tofu=100)])
+    plan = _greedy(MATCHES)
+    session.plan(plan)
+    assert session.commit() == {"rice": 100, "egg": 50, "tofu": 100}
+    assert store.fridge == {"rice": 100, "egg": 50, "tofu": 100}
+    assert plan.runs == 2
+
+
+def test_session_gives_up_after_the_commit_attempts(monkeypatch):
+    writes = [lambda fridge: fridge.update(rice=fridge["rice"] + 1)] * meal_planner.FRIDGE_COMMIT_ATTEMPTS
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 300}, writes)
+    session.plan(_greedy(MATCHES))
+    session.commit()
+    assert store.commits == meal_planner.FRIDGE_COMMIT_ATTEMPTS
+    assert store.fridge == {"rice": 300 + meal_planner.FRIDGE_COMMIT_ATTEMPTS - 200, "egg": 50} # consumed anyway
+
+
+def test_a_failed_step_is_rolled_back(monkeypatch):
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 300}, [lambda fridge: fridge.update(egg=150)])
+    fridge = session.fridge
+    session.plan(_greedy(MATCHES[:1]))
+    with pytest.raises(RuntimeError):
+        with session.step():
+            session.use({"egg": 100})
+            session.use({"rice": 100})
+            raise RuntimeError("LLM meal rejected")
+    assert session.fridge is fridge and fridge == {"rice": 100, "egg": 200}
+    # nothing from the failed step is written or replayed
+    assert session.commit() == {"rice": 100, "egg": 50}
+    assert store.fridge == {"rice": 100, "egg": 50}
+
+
+PREFERENCES = {"days": 1, "meals_per_day": 3, "target_calories_per_day": 1350,
+               "target_macros_per_day": {"protein": 90, "fat": 45, "carbs": 150}, "priority": "calories"}
+
+
+def _recipe(title, ingredients):
+    # at the per-meal targets of PREFERENCES, so its amounts aren't rescaled
+    return {"title": title, "macros": {"protein": 30, "fat": 15, "carbs": 50}, "ingredients": ingredients,
+            "calories": 450, "rating": 4}
+
+
+def _meal(title, ingredients):
+    return {"meal_title": title, "ingredients": ingredients, "estimated_nutrition": {}}
+
+
+def _scripted_completions(monkeypatch, *scripts):
+    # llm_cache.stream answering each call with the next script: a list of meals, or an
+    # exception raised after them. Returns the calls as (fridge, selected titles, meals_needed).
+    scripts, calls = list(scripts), []
+
+    def stream(completion, preferences, fridge, selected_meals, missing_ingredients, meals_needed):
+        calls.append((dict(fridge), [meal["meal_title"] for meal in selected_meals], meals_needed))
+        script = scripts.pop(0)
+        yield from (meal for meal in script if isinstance(meal, dict))
+        for error in script:
+            if isinstance(error, Exception):
+                raise error
+
+    monkeypatch.setattr(meal_planner.llm_cache, "stream", stream)
+    return calls
+
+
+@pytest.mark.parametrize("tofu", [False, True])
+def test_predicted_shortfall_matches_the_plan(tofu):
+    recipes = RecipeCatalog([_recipe("Rice bowl", {"rice": 100, "egg": 50}), _recipe("Omelette", {"egg": 100, "cheese": 30}),
+                             _recipe("Tofu stir fry", {"tofu": 150, "spinach": 100})])
+    fridge = {"rice": 1000, "egg": 1000, "cheese": 500, "spinach": 300, "tofu": 300 if tofu else 0}
+    shortfall = predict_shortfall(recipes, fridge, PREFERENCES)
+    selected, _, _ = build_meal_plan(recipes, dict(fridge), PREFERENCES)
+    assert shortfall == 3 - len(selected) == (0 if tofu else 1)
+    if tofu:
+        assert speculate_llm_meals(recipes, fridge, PREFERENCES) is None
+
+
+def test_a_speculative_meal_the_final_fridge_cannot_supply_is_rejected(monkeypatch):
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 200})
+    calls = _scripted_completions(monkeypatch, [_meal("Fried rice", {"rice": 200}), _meal("Boiled eggs", {"egg": 100})],
+                                  [_meal("Egg salad", {"egg": 50})])
+    speculation = Speculation(PREFERENCES, session.fridge, 2)
+    session.plan(_greedy([_match("Rice bowl", 0.9, {"rice": 150})])) # leaves too little rice for the fried rice
+
+    meals = list(reconcile_speculation(speculation, PREFERENCES, session.fridge, [], {}, 2, session=session))
+    assert [meal["meal_title"] for meal in meals] == ["Boiled eggs", "Egg salad"]
+    # the speculation saw the fridge as loaded, the completion for the rest the one left after both
+    assert calls == [({"rice": 300, "egg": 200}, [], 2), ({"rice": 150, "egg": 100}, ["Boiled eggs"], 1)]
+    assert session.commit() == store.fridge == {"rice": 150, "egg": 50}
+
+
+def test_a_failed_speculation_falls_back_to_a_regular_completion(monkeypatch):
+    session, store = _session(monkeypatch, {"rice": 300, "egg": 200})
+    calls = _scripted_completions(monkeypatch, [LLMUnavailable("connection refused")],
+                                  [_meal("Fried rice", {"rice": 100}), _meal("Boiled eggs", {"egg": 100})])
+    speculation = Speculation(PREFERENCES, session.fridge, 2)
+
+    meals = list(reconcile_speculation(speculation, PREFERENCES, session.fridge, [], {}, 2, session=session))
+    assert [meal["meal_title"] for meal in meals] == ["Fried rice", "Boiled eggs"]
+    assert calls[1] == ({"rice": 300, "egg": 200}, [], 2)
+    assert session.commit() == store.fridge == {"rice": 200, "egg": 100}
+
+
+def test_plans_are_only_reused_for_the_same_user(monkeypatch):
+    monkeypatch.setattr(meal_planner, "_plan_states", OrderedDict())
+    recipes = RecipeCatalog([_recipe("Rice bowl", {"rice": 100, "egg": 50}), _recipe("Omelette", {"egg": 100, "cheese": 30})])
+    fridge = {"rice": 1000, "egg": 1000, "cheese": 500}
+
+    def plan(user, **amounts):
+        metrics.reset()
+        *_, changes = build_meal_plan(recipes, dict(fridge, **amounts), PREFERENCES, return_changes=True, user=user)
+        return changes, metrics.snapshot()[1].get("incremental_replans", 0)
+
+    assert plan("alice") == (None, 0)
+    assert plan("bob", egg=120) == (None, 0) # same preferences and ingredients, but not alice's fridge
+    changes, replans = plan("alice", egg=900)
+    assert changes is not None and replans == 1
@@ -0,0 +1,55 @@
+# test_planning_pool.py
+
+import pytest
+import metrics
+import meal_planner
+from cbr_retrieval import CatalogSource
+from planning_pool import PlanningPool
+
+PREFERENCES = {
+    "days": 2, "meals_per_day": 2, "target_calories_per_day": 1800,
+    "target_macros_per_day": {"protein": 120, "fat": 60, "carbs": 200}, "priority": "protein"
+}
+
+
+@pytest.fixture
+def source():
+    return CatalogSource()
+
+
+@pytest.fixture
+def fridge(source):
+    return {ingredient: 2000 for ingredient in source.get().vocabulary}
+
+
+def _in_thread(source, fridge):
+    fridge = dict(fridge)
+    meal_planner._plan_states.clear()
+    return PlanningPool(source, workers=0).plan(fridge, PREFERENCES), fridge
+
+
+def test_worker_plan_matches_in_thread_plan(source, fridge):
+    expected, expected_fridge = _in_thread(source, fridge)
+    with PlanningPool(source, workers=2) as pool:
+        assert pool.plan(fridge, PREFERENCES) == expected
+    assert fridge == expected_fridge
+
+
+def test_worker_metrics_count_in_the_caller(source, fridge):
+    metrics.reset()
+    with PlanningPool(source, workers=1) as pool:
+        pool.plan(dict(fridge), PREFERENCES)
+    histograms, _ = metrics.snapshot()
+    assert sum(histograms["rank_recipes"][0]) == 1
+    assert sum(histograms["select_meals"][0]) == 1
+
+
+def test_workers_plan_against_in_place_edits(source, fridge):
+    catalog = source.get()
+    first = _in_thread(source, fridge)[0][0][0]["meal_title"]
+    for row in [row for row in catalog.active_rows() if catalog.titles[row] == first]:
+        catalog.remove_recipe(row)
+    expected, _ = _in_thread(source, fridge)
+    assert first not in [meal["meal_title"] for meal in expected[0]]
+    with PlanningPool(source, workers=1) as pool:
+        assert pool.plan(dict(fridge), PREFERENCES) == expected
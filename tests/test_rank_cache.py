@@ -0,0 +1,29 @@
+# test_rank_cache.py
+
+import pytest
+from cbr_retrieval import load_recipes
+from rank_cache import RankCache, MemoryRankBackend, RedisRankBackend
+
+QUERY = (["rice", "chicken"], {"protein": 30, "fat": 15, "carbs": 50}, 450, "protein", 5)
+
+
+def test_a_new_worker_keeps_the_shared_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    catalog = load_recipes()
+    first = RankCache(RedisRankBackend(fakeredis.FakeRedis(server=server, decode_responses=True)))
+    expected = first.rank(catalog, *QUERY)
+    started_later = RankCache(RedisRankBackend(fakeredis.FakeRedis(server=server, decode_responses=True)))
+    assert [m["index"] for m in started_later.rank(catalog, *QUERY)] == [m["index"] for m in expected]
+    assert started_later.stats()["hits"] == 1
+
+
+def test_a_changed_catalog_empties_the_memory_cache():
+    backend = MemoryRankBackend()
+    cache = RankCache(backend)
+    catalog = load_recipes()
+    cache.rank(catalog, *QUERY)
+    catalog.remove_recipe(0)
+    cache.rank(catalog, *QUERY)
+    assert len(backend._entries) == 1 # only the entry for the current catalog
+    assert cache.stats()["misses"] == 2